@@ -0,0 +1,386 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, time as dtime
+
+import lazy_imports
+import market_hours
+import metrics
+import quotes
+
+np = lazy_imports.lazy_import('numpy')
+
+ALERTS_KEY = 'alerts'
+VERSION_KEY = 'alerts_version'
+SEQ_KEY = 'alerts_seq'
+FIRED_KEY = 'alerts_fired'
+WATCHLISTS_KEY = 'watchlists'
+DIGESTS_KEY = 'alerts_digests'
+
+MAX_WATCHLIST = 25
+
+ALERT_PATTERN = re.compile(
+    r'^(?:alert|notify)(?:\s+me)?(?:\s+(?:if|when))?\s+(?P<subject>.+?)\s+'
+    r'(?:(?:drops|falls|goes|gets|is|rises|climbs|trades|moves)\s+)?'
+    r'(?P<op>below|under|above|over|<=?|>=?)\s*\$?(?P<price>\d[\d,]*(?:\.\d+)?)\s*$',
+    re.IGNORECASE)
+LIST_PATTERN = re.compile(r'^(?:my\s+)?alerts$', re.IGNORECASE)
+CANCEL_PATTERN = re.compile(r'^(?:(?:cancel|delete|remove)\s+alert|unalert)\s+#?(\d+)$', re.IGNORECASE)
+WATCH_PATTERN = re.compile(r'^(watch|unwatch)\s+(.+)$', re.IGNORECASE)
+WATCHLIST_PATTERN = re.compile(r'^(?:my\s+)?watchlist$', re.IGNORECASE)
+
+USAGE = ('Try "alert me if TSLA drops below 200", "alerts", "cancel alert 3", '
+         '"watch AAPL, MSFT", "unwatch MSFT" or "watchlist".')
+
+
+def _names(text):
+    separator = ',' if ',' in text else None
+    return list(dict.fromkeys(name.strip() for name in text.split(separator) if name.strip()))
+
+
+def parse_command(text):
+    """
+    Returns (command, *args) for an alert or watchlist message, or None:
+
+        ('alert', subject, above, price)
+        ('alerts',)
+        ('cancel', alert_id)
+        ('watch', names) / ('unwatch', names)
+        ('watchlist',)
+    """
+    text = text.strip()
+    match = ALERT_PATTERN.match(text)
+    if match:
+        above = match.group('op').lower() in ('above', 'over', '>', '>=')
+        return 'alert', match.group('subject'), above, float(match.group('price').replace(',', ''))
+    if LIST_PATTERN.match(text):
+        return ('alerts',)
+    match = CANCEL_PATTERN.match(text)
+    if match:
+        return 'cancel', int(match.group(1))
+    match = WATCH_PATTERN.match(text)
+    if match:
+        return match.group(1).lower(), _names(match.group(2))
+    if WATCHLIST_PATTERN.match(text):
+        return ('watchlist',)
+    return None
+
+
+def _money(value):
+    return f"${value:,.2f}"
+
+
+def describe(record):
+    direction = 'above' if record['above'] else 'below'
+    return f"#{record['id']} {record['symbol']} {direction} {_money(record['price'])}"
+
+
+class AlertBook:
+    """
+    Every active alert compiled into flat arrays, so a tick checks all
+    thresholds against the polled prices in one vectorized pass
+    """
+
+    def __init__(self, records, version=None):
+        self.records = records
+        self.version = version
+        self.symbols = sorted({record['symbol'] for record in records})
+        index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.symbol_index = np.array([index[r['symbol']] for r in records], dtype=np.intp)
+        self.thresholds = np.array([r['price'] for r in records], dtype='f8')
+        self.above = np.array([r['above'] for r in records], dtype=bool)
+
+    def __len__(self):
+        return len(self.records)
+
+    def evaluate(self, prices):
+        """
+        [(record, price)] for the alerts whose threshold `prices`
+        ({symbol: price}) has crossed; symbols without a price never fire
+        """
+        if not self.records:
+            return []
+        polled = np.array([prices.get(symbol, np.nan) for symbol in self.symbols], dtype='f8')
+        current = polled[self.symbol_index]
+        # NaN compares False either way
+        fired = np.where(self.above, current >= self.thresholds, current <= self.thresholds)
+        return [(self.records[i], float(current[i])) for i in np.flatnonzero(fired)]
+
+
+class AlertManager:
+    """
+    Price alerts and watchlists kept in the state store, so every worker
+    sees the same subscriptions. A scheduler thread polls the distinct
+    subscribed symbols with one batched quote request per tick, which keeps
+    upstream cost proportional to the number of tickers rather than the
+    number of users or alerts. Alerts fire once and are then removed.
+    Watchlists get a digest each weekday at `digest_time` (exchange time).
+    """
+
+    def __init__(self, state, outbox, resolve, interval=60.0, digest_time=dtime(16, 5), max_per_user=20):
+        self.state = state
+        if hasattr(state, 'persist'):
+            # Alerts and watchlists are only read by the poller, so idle
+            # expiry would drop them while they are still wanted
+            state.persist(ALERTS_KEY, SEQ_KEY, VERSION_KEY, FIRED_KEY, WATCHLISTS_KEY)
+        self.outbox = outbox
+        self.resolve = resolve
+        self.interval = interval
+        self.digest_time = digest_time
+        self.max_per_user = max_per_user
+
+        self._book = None
+        self._digest_day = None
+        self._purged_at = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.polls = 0
+        self.symbols_polled = 0
+        self.fired = 0
+        self.digests = 0
+        self.errors = 0
+
+    # Commands
+
+    def handle(self, command, channel, user):
+        """
+        Run a command from parse_command and return the reply text
+        """
+        name, args = command[0], command[1:]
+        if name == 'alert':
+            return self.add_alert(channel, user, *args)
+        if name == 'alerts':
+            return self.list_alerts(channel, user)
+        if name == 'cancel':
+            return self.cancel_alert(user, *args)
+        if name == 'watch':
+            return self.watch(channel, user, *args)
+        if name == 'unwatch':
+            return self.unwatch(channel, user, *args)
+        if name == 'watchlist':
+            return self.watchlist(channel, user)
+        return USAGE
+
+    def _alerts(self):
+        records = []
+        for field, value in self.state.hgetall(ALERTS_KEY).items():
+            try:
+                records.append(json.loads(value))
+            except ValueError:
+                logging.error(f"Dropping unreadable alert {field}")
+                self.state.hdel(ALERTS_KEY, field)
+        records.sort(key=lambda record: record['id'])
+        return records
+
+    def _user_alerts(self, channel, user):
+        return [r for r in self._alerts() if r['user'] == user and r['channel'] == channel]
+
+    def add_alert(self, channel, user, subject, above, price):
+        if len(self._user_alerts(channel, user)) >= self.max_per_user:
+            return f"You already have {self.max_per_user} alerts here. Cancel one first."
+        symbol = self.resolve(subject)
+        if not symbol:
+            return f"Sorry, I couldn't find a ticker symbol for '{subject}'."
+        record = {
+            'id': self.state.incr(SEQ_KEY),
+            'user': user,
+            'channel': channel,
+            'symbol': symbol.upper(),
+            'above': above,
+            'price': price,
+            'created': int(time.time()),
+        }
+        with self.state.pipeline() as pipe:
+            pipe.hset(ALERTS_KEY, str(record['id']), json.dumps(record))
+            pipe.incr(VERSION_KEY)
+        return f"OK, I'll tell you when {record['symbol']} goes {'above' if above else 'below'} {_money(price)} (alert #{record['id']})."
+
+    def list_alerts(self, channel, user):
+        records = self._user_alerts(channel, user)
+        if not records:
+            return f"You have no alerts here. {USAGE}"
+        return "Your alerts:\n" + '\n'.join(f"• {describe(record)}" for record in records)
+
+    def cancel_alert(self, user, alert_id):
+        value = self.state.hget(ALERTS_KEY, str(alert_id))
+        if value is None or json.loads(value)['user'] != user:
+            return f"You don't have an alert #{alert_id}."
+        with self.state.pipeline() as pipe:
+            pipe.hdel(ALERTS_KEY, str(alert_id))
+            pipe.incr(VERSION_KEY)
+        return f"Cancelled alert #{alert_id}."
+
+    def _watchlist(self, channel, user):
+        value = self.state.hget(WATCHLISTS_KEY, f'{channel}:{user}')
+        return json.loads(value) if value else []
+
+    def _save_watchlist(self, channel, user, symbols):
+        if symbols:
+            self.state.hset(WATCHLISTS_KEY, f'{channel}:{user}', json.dumps(symbols))
+        else:
+            self.state.hdel(WATCHLISTS_KEY, f'{channel}:{user}')
+
+    def watch(self, channel, user, names):
+        symbols = self._watchlist(channel, user)
+        added = []
+        missing = []
+        for name in names:
+            symbol = self.resolve(name)
+            if not symbol:
+                missing.append(name)
+            elif symbol.upper() not in symbols:
+                symbols.append(symbol.upper())
+                added.append(symbol.upper())
+        if len(symbols) > MAX_WATCHLIST:
+            return f"Watchlists are limited to {MAX_WATCHLIST} symbols."
+        self._save_watchlist(channel, user, symbols)
+
+        reply = f"Watching {', '.join(symbols)}." if symbols else "Your watchlist is empty."
+        if missing:
+            reply += f"\nCouldn't find ticker symbols for: {', '.join(missing)}"
+        return reply
+
+    def unwatch(self, channel, user, names):
+        removed = {name.upper() for name in names}
+        symbols = [symbol for symbol in self._watchlist(channel, user) if symbol not in removed]
+        self._save_watchlist(channel, user, symbols)
+        return f"Watching {', '.join(symbols)}." if symbols else "Your watchlist is empty."
+
+    def watchlist(self, channel, user):
+        symbols = self._watchlist(channel, user)
+        if not symbols:
+            return f"Your watchlist is empty. {USAGE}"
+        return self._digest_text(symbols, quotes.fetch_quotes(symbols))
+
+    def _digest_text(self, symbols, latest):
+        lines = []
+        for symbol in symbols:
+            quote = latest.get(symbol) or {}
+            price = quote.get('regularMarketPrice')
+            prev_close = quote.get('regularMarketPreviousClose')
+            if price is None:
+                lines.append(f"• {symbol}: N/A")
+            elif prev_close:
+                lines.append(f"• {symbol}: {_money(price)} ({(price / prev_close - 1) * 100:+.2f}%)")
+            else:
+                lines.append(f"• {symbol}: {_money(price)}")
+        return "*Watchlist*\n" + '\n'.join(lines)
+
+    # Scheduler
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='alerts', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Alert tick failed: {e}")
+
+    def book(self):
+        """
+        The compiled alerts, rebuilt only when another command changed them
+        """
+        version = self.state.get(VERSION_KEY)
+        # A missing version with alerts cached means the store lost it
+        # (e.g. a restarted Redis); re-read rather than trust the cache
+        if self._book is None or version != self._book.version or (version is None and len(self._book)):
+            self._book = AlertBook(self._alerts(), version)
+        return self._book
+
+    def _digest_due(self, now):
+        local = now.astimezone(market_hours.EXCHANGE_TZ)
+        day = local.date().isoformat()
+        if local.weekday() >= 5 or local.time() < self.digest_time or self._digest_day == day:
+            return False
+        self._digest_day = day
+        # Only one worker sends each day's digest
+        return self.state.hsetnx(DIGESTS_KEY, day, int(time.time()))
+
+    def tick(self, now=None):
+        now = now or datetime.now(market_hours.EXCHANGE_TZ)
+        trading = market_hours.is_open(now)
+        book = self.book() if trading else None
+        watchlists = {}
+        if self._digest_due(now):
+            watchlists = {key: json.loads(value) for key, value in self.state.hgetall(WATCHLISTS_KEY).items()}
+
+        symbols = set(book.symbols) if book else set()
+        for watched in watchlists.values():
+            symbols.update(watched)
+        if not symbols:
+            return
+
+        with metrics.stage('alerts.poll'):
+            latest = quotes.fetch_quotes(sorted(symbols))
+        self.polls += 1
+        self.symbols_polled += len(symbols)
+
+        prices = {symbol: quote['regularMarketPrice'] for symbol, quote in latest.items()
+                  if quotes.is_tradable_quote(quote)}
+        if book:
+            for record, price in book.evaluate(prices):
+                self._fire(record, price)
+        for key, watched in watchlists.items():
+            channel, user = key.split(':', 1)
+            self.outbox.post(channel, text=f"<@{user}> {self._digest_text(watched, latest)}")
+            self.digests += 1
+        self._purge_fired()
+
+    def _fire(self, record, price):
+        # Claim the alert so only one worker reports it
+        if not self.state.hsetnx(FIRED_KEY, str(record['id']), int(time.time())):
+            return
+        with self.state.pipeline() as pipe:
+            pipe.hdel(ALERTS_KEY, str(record['id']))
+            pipe.incr(VERSION_KEY)
+        direction = 'above' if record['above'] else 'below'
+        self.outbox.post(
+            record['channel'],
+            text=f"<@{record['user']}> {record['symbol']} is at {_money(price)}, "
+                 f"{direction} your alert at {_money(record['price'])} (alert #{record['id']}).")
+        self.fired += 1
+
+    def _purge_fired(self, max_age=3600):
+        # Claims outlive the alert long enough for every worker to reload
+        if time.time() - self._purged_at < max_age:
+            return
+        self._purged_at = time.time()
+        for field, fired_at in self.state.hgetall(FIRED_KEY).items():
+            if time.time() - int(fired_at) > max_age:
+                self.state.hdel(FIRED_KEY, field)
+
+    def stats(self):
+        book = self._book
+        return {
+            'alerts': len(book) if book else 0,
+            'symbols': len(book.symbols) if book else 0,
+            'polls': self.polls,
+            'symbols_polled': self.symbols_polled,
+            'fired': self.fired,
+            'digests': self.digests,
+            'errors': self.errors,
+        }
+
+
+def from_env(state, outbox, resolve):
+    hour, _, minute = os.environ.get('ALERTS_DIGEST_TIME', '16:05').partition(':')
+    return AlertManager(
+        state,
+        outbox,
+        resolve,
+        interval=float(os.environ.get('ALERTS_INTERVAL', 60)),
+        digest_time=dtime(int(hour), int(minute or 0)),
+        max_per_user=int(os.environ.get('ALERTS_MAX_PER_USER', 20)),
+    )
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from urllib.parse import urlsplit
+
+import lazy_imports
+from http_client import (
+    DEFAULT_HEADERS, RETRY_STATUSES, HostStats, TokenBucket, attempt_timeout, backoff_delay,
+    host_limits_from_env)
+
+aiohttp = lazy_imports.lazy_import('aiohttp')
+
+
+class AsyncResponse:
+    """
+    A fully read aiohttp response with the parts of the requests.Response
+    interface the lookup code uses
+    """
+
+    def __init__(self, url, status_code, headers, text):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"{self.status_code} error for {self.url}")
+
+
+class AsyncHttpClient:
+    """
+    asyncio counterpart of http_client.HttpClient: one pooled aiohttp
+    session, with the same timeouts, per-host token buckets and jittered
+    backoff on 429/5xx, so lookups can share an event loop instead of
+    holding a thread each
+    """
+
+    def __init__(self, timeout=5.0, max_retries=3, backoff_base=0.5, backoff_max=10.0,
+                 rate=10.0, burst=20, host_limits=None, pool_size=100):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate = rate
+        self.burst = burst
+        self.host_limits = dict(host_limits or {})
+        self.pool_size = pool_size
+
+        self.session = None
+        self._buckets = {}
+        self._stats = {}
+
+    def _session(self):
+        # Created lazily so it binds to the running loop
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                headers=DEFAULT_HEADERS,
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+            )
+        return self.session
+
+    def _host(self, host):
+        if host not in self._buckets:
+            rate, burst = self.host_limits.get(host, (self.rate, self.burst))
+            self._buckets[host] = TokenBucket(rate, burst)
+            self._stats[host] = HostStats()
+        return self._buckets[host], self._stats[host]
+
+    def _backoff(self, attempt, response=None, deadline=None):
+        return backoff_delay(attempt, response, deadline, self.backoff_base, self.backoff_max)
+
+    async def request(self, method, url, timeout=None, deadline=None, **kwargs):
+        host = urlsplit(url).netloc
+        bucket, stats = self._host(host)
+        timeout = self.timeout if timeout is None else timeout
+
+        attempt = 0
+        while True:
+            waited = await bucket.acquire_async(deadline)
+            if waited is None:
+                stats.gave_up += 1
+                raise asyncio.TimeoutError(f"{host} rate limit would hold the request past its deadline")
+            if waited > 0:
+                stats.throttled += 1
+
+            started = time.monotonic()
+            response = None
+            error = None
+            try:
+                total = aiohttp.ClientTimeout(total=attempt_timeout(timeout, deadline))
+                async with self._session().request(method, url, timeout=total, **kwargs) as raw:
+                    text = await raw.text()
+                    response = AsyncResponse(str(raw.url), raw.status, raw.headers, text)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+            elapsed = time.monotonic() - started
+
+            stats.requests += 1
+            stats.latency_total += elapsed
+            stats.latency_max = max(stats.latency_max, elapsed)
+            if error is not None or response.status_code >= 400:
+                stats.errors += 1
+
+            retryable = error is not None or response.status_code in RETRY_STATUSES
+            delay = self._backoff(attempt, response, deadline) if retryable and attempt < self.max_retries else None
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response
+
+            logging.warning(
+                f"Retrying {method} {host} in {delay:.2f}s "
+                f"({error or response.status_code}, attempt {attempt + 1})")
+            stats.retries += 1
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    def stats(self):
+        return {host: stats.as_dict() for host, stats in self._stats.items()}
+
+
+_shared = None
+
+
+def shared():
+    """
+    The event loop's client, created from the same environment as
+    http_client.shared()
+    """
+    global _shared
+    if _shared is None:
+        _shared = AsyncHttpClient(
+            timeout=float(os.environ.get('HTTP_TIMEOUT', 5)),
+            max_retries=int(os.environ.get('HTTP_MAX_RETRIES', 3)),
+            rate=float(os.environ.get('HTTP_RATE', 10)),
+            burst=int(os.environ.get('HTTP_BURST', 20)),
+            host_limits=host_limits_from_env(),
+            pool_size=int(os.environ.get('ASYNC_HTTP_POOL_SIZE', 100)),
+        )
+    return _shared
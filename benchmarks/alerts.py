@@ -0,0 +1,85 @@
+"""
+Alert benchmark: cost of one scheduler tick as subscriptions grow.
+
+    python benchmarks/alerts.py [--symbols 200]
+
+Alerts are spread over a fixed set of symbols, so upstream cost is one
+batched quote request per tick whatever the alert count. This measures the
+local side: checking each alert in a Python loop against the vectorized
+AlertBook, plus the time to compile the book when alerts change.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from alerts import AlertBook  # noqa: E402
+
+SIZES = [100, 1000, 10000, 100000]
+
+
+def make_alerts(rng, count, symbols, prices):
+    records = []
+    for i in range(count):
+        symbol = rng.choice(symbols)
+        above = rng.random() < 0.5
+        # Mostly set away from the current price, so a few percent fire
+        move = rng.uniform(0.99, 1.3) if above else rng.uniform(0.7, 1.01)
+        records.append({
+            'id': i + 1,
+            'user': f'U{rng.randrange(count // 5 + 1)}',
+            'channel': 'C1',
+            'symbol': symbol,
+            'above': above,
+            'price': round(prices[symbol] * move, 2),
+        })
+    return records
+
+
+def loop_evaluate(records, prices):
+    fired = []
+    for record in records:
+        price = prices.get(record['symbol'])
+        if price is None:
+            continue
+        if (price >= record['price']) if record['above'] else (price <= record['price']):
+            fired.append((record, price))
+    return fired
+
+
+def best_ms(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--symbols', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    symbols = [f'S{i:04d}' for i in range(args.symbols)]
+    prices = {symbol: rng.uniform(5, 500) for symbol in symbols}
+
+    print(f"{'alerts':>8} {'loop ms':>10} {'book ms':>10} {'build ms':>10} {'fired':>8}")
+    for size in SIZES:
+        records = make_alerts(rng, size, symbols, prices)
+        book = AlertBook(records)
+        assert len(book.evaluate(prices)) == len(loop_evaluate(records, prices))
+
+        loop = best_ms(lambda: loop_evaluate(records, prices))
+        vectorized = best_ms(lambda: book.evaluate(prices))
+        build = best_ms(lambda: AlertBook(records))
+        print(f"{size:>8} {loop:>10.2f} {vectorized:>10.2f} {build:>10.2f} {len(book.evaluate(prices)):>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Minimal Redis-protocol server backed by MemoryStateStore, for exercising
+RedisStateStore (and multi-process setups) without a real Redis.
+
+    python benchmarks/fake_redis.py --port 6379
+"""
+import argparse
+import os
+import socketserver
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from state_store import MemoryStateStore  # noqa: E402
+
+
+def _encode(value):
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, bool):
+        return f':{int(value)}\r\n'.encode()
+    if isinstance(value, int):
+        return f':{value}\r\n'.encode()
+    if isinstance(value, (list, tuple)):
+        return f'*{len(value)}\r\n'.encode() + b''.join(_encode(v) for v in value)
+    data = str(value).encode()
+    return f'${len(data)}\r\n'.encode() + data + b'\r\n'
+
+
+class FakeRedis:
+    def __init__(self):
+        self.store = MemoryStateStore()
+        self.commands = 0
+
+    def handle(self, command):
+        self.commands += 1
+        name, args = command[0].upper(), command[1:]
+        store = self.store
+        if name in ('PING', 'SELECT', 'AUTH'):
+            return b'+OK\r\n' if name != 'PING' else b'+PONG\r\n'
+        if name == 'GET':
+            return _encode(store.get(args[0]))
+        if name == 'SET':
+            store.set(args[0], args[1])
+            return b'+OK\r\n'
+        if name == 'DEL':
+            existed = store.get(args[0]) is not None or bool(store.hgetall(args[0]))
+            store.delete(args[0])
+            return _encode(int(existed))
+        if name == 'INCRBY':
+            return _encode(store.incr(args[0], int(args[1])))
+        if name == 'HGET':
+            return _encode(store.hget(args[0], args[1]))
+        if name == 'HSET':
+            created = store.hget(args[0], args[1]) is None
+            store.hset(args[0], args[1], args[2])
+            return _encode(int(created))
+        if name == 'HSETNX':
+            return _encode(store.hsetnx(args[0], args[1], args[2]))
+        if name == 'HDEL':
+            existed = store.hget(args[0], args[1]) is not None
+            store.hdel(args[0], args[1])
+            return _encode(int(existed))
+        if name == 'HGETALL':
+            return _encode([item for pair in store.hgetall(args[0]).items() for item in pair])
+        if name == 'HINCRBY':
+            return _encode(store.hincr(args[0], args[1], int(args[2])))
+        return f'-ERR unknown command {name}\r\n'.encode()
+
+
+def _read_command(reader):
+    line = reader.readline()
+    if not line:
+        return None
+    count = int(line[1:-2])
+    command = []
+    for _ in range(count):
+        length = int(reader.readline()[1:-2])
+        command.append(reader.read(length + 2)[:-2].decode())
+    return command
+
+
+def serve(host='127.0.0.1', port=0):
+    """
+    Start a FakeRedis server on a daemon thread; returns (server, fake)
+    """
+    fake = FakeRedis()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            while True:
+                command = _read_command(self.rfile)
+                if command is None:
+                    return
+                self.wfile.write(fake.handle(command))
+
+    server = socketserver.ThreadingTCPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6379)
+    args = parser.parse_args()
+
+    server, _ = serve(args.host, args.port)
+    print(f"Fake Redis listening on {args.host}:{server.server_address[1]}")
+    threading.Event().wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+"""
+Local stand-ins for the services the bot talks to, for offline benchmarks.
+
+Each FakeService runs its own HTTP server with a configurable latency and
+error rate and counts the requests it receives per route:
+
+    slack        Slack Web API (chat.postMessage, chat.update, auth.test, ...)
+    yahoo        search, batch quote (with Yahoo's cookie and crumb
+                 check), fundamentals timeseries, and the
+                 info/history/download routes used by the yfinance
+                 stand-in in benchmarks/stubs/
+    marketwatch  the ticker lookup page
+    wikipedia    the S&P 500 listing table
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from datetime import date, timedelta
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+COMPANIES = [
+    ('AAPL', 'Apple Inc.'),
+    ('MSFT', 'Microsoft'),
+    ('AMZN', 'Amazon'),
+    ('GOOG', 'Alphabet Inc. (Class C)'),
+    ('META', 'Meta Platforms'),
+    ('TSLA', 'Tesla, Inc.'),
+    ('NVDA', 'Nvidia'),
+    ('JPM', 'JPMorgan Chase'),
+    ('V', 'Visa Inc.'),
+    ('JNJ', 'Johnson & Johnson'),
+    ('WMT', 'Walmart'),
+    ('PG', 'Procter & Gamble'),
+    ('MA', 'Mastercard'),
+    ('HD', 'Home Depot (The)'),
+    ('DIS', 'Walt Disney Company (The)'),
+    ('NFLX', 'Netflix'),
+    ('KO', 'Coca-Cola Company (The)'),
+    ('PEP', 'PepsiCo'),
+    ('INTC', 'Intel'),
+    ('CSCO', 'Cisco'),
+    ('ORCL', 'Oracle Corporation'),
+    ('IBM', 'IBM'),
+    ('NKE', 'Nike, Inc.'),
+    ('MCD', "McDonald's"),
+    ('BA', 'Boeing'),
+    ('XOM', 'ExxonMobil'),
+    ('CVX', 'Chevron Corporation'),
+    ('PFE', 'Pfizer'),
+    ('T', 'AT&T'),
+    ('VZ', 'Verizon'),
+]
+
+BY_SYMBOL = dict(COMPANIES)
+
+# What the fake Yahoo hands out from its cookie and crumb routes
+YAHOO_COOKIE = 'A3=fake-session'
+YAHOO_CRUMB = 'fake-crumb'
+
+
+def _seed(symbol):
+    return int(hashlib.md5(symbol.encode()).hexdigest()[:8], 16)
+
+
+def price_of(symbol):
+    return round(20 + _seed(symbol) % 480 + (_seed(symbol) % 100) / 100, 2)
+
+
+def bars_for(symbol, start, end):
+    """
+    Deterministic daily bars [date, open, high, low, close, volume] for
+    the weekdays in [start, end)
+    """
+    rng = random.Random(_seed(symbol))
+    price = price_of(symbol)
+    bars = []
+    day = date(2000, 1, 3)
+    while day < end:
+        change = rng.uniform(-0.02, 0.02)
+        close = max(1.0, price * (1 + change))
+        if day.weekday() < 5 and day >= start:
+            bars.append([day.isoformat(), price, max(price, close) * 1.01, min(price, close) * 0.99,
+                         close, float(rng.randint(1_000_000, 50_000_000))])
+        price = close
+        day += timedelta(days=1)
+    return bars
+
+
+def info_for(symbol):
+    price = price_of(symbol)
+    return {
+        'symbol': symbol,
+        'shortName': BY_SYMBOL[symbol],
+        'regularMarketPrice': price,
+        'regularMarketPreviousClose': round(price * 0.99, 2),
+        'regularMarketOpen': round(price * 0.995, 2),
+        'regularMarketDayLow': round(price * 0.98, 2),
+        'regularMarketDayHigh': round(price * 1.02, 2),
+        'regularMarketVolume': 12_345_678,
+        'averageVolume': 15_000_000,
+        'marketCap': int(price * 1e9),
+        'trailingPE': 25.5,
+        'trailingEps': round(price / 25.5, 2),
+        'dividendYield': 0.012,
+        'totalRevenue': int(price * 5e8),
+        'profitMargins': 0.21,
+    }
+
+
+def timeseries_for(symbol, types, today=None):
+    """
+    Fundamentals timeseries results: the last four fiscal years (ending
+    September) for each annual* type, the latest for each trailing* type
+    """
+    today = today or date.today()
+    revenue = info_for(symbol)['totalRevenue']
+    scale = {'TotalRevenue': 1.0, 'NetIncome': info_for(symbol)['profitMargins']}
+    year = today.year if today.month > 9 else today.year - 1
+    results = []
+    for kind in types:
+        for prefix in ('annual', 'trailing'):
+            series = kind[len(prefix):]
+            if kind.startswith(prefix) and series in scale:
+                break
+        else:
+            continue
+        years = range(year - 3, year + 1) if prefix == 'annual' else [year]
+        points = [
+            {'asOfDate': f'{y}-09-30', 'periodType': '12M' if prefix == 'annual' else 'TTM', 'currencyCode': 'USD',
+             'reportedValue': {'raw': round(revenue * scale[series] * 0.9 ** (year - y))}}
+            for y in years
+        ]
+        results.append({'meta': {'symbol': [symbol], 'type': [kind]}, kind: points})
+    return results
+
+
+def parse_service_values(value):
+    """
+    Parse "yahoo=0.05,slack=0.01" into {service: float}
+    """
+    values = {}
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        name, _, number = item.partition('=')
+        values[name.strip()] = float(number)
+    return values
+
+
+class _Server(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections at shutdown is expected
+        pass
+
+
+class FakeService:
+    """
+    HTTP server on a daemon thread. Subclasses map paths to handlers that
+    return (status, content type, body), optionally followed by a dict of
+    extra headers.
+    """
+
+    name = None
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.counts = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_port}'
+
+    def start(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                service._serve(self, b'')
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                service._serve(self, self.rfile.read(length))
+
+        self.server = _Server(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name=f'fake-{self.name}', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts = {}
+
+    def _serve(self, request, body):
+        parts = urlsplit(request.path)
+        route = self.route(parts.path)
+        with self._lock:
+            self.counts[route] = self.counts.get(route, 0) + 1
+            failed = self._rng.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+
+        if failed:
+            status, content_type, payload, *extra = self.error()
+        else:
+            query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+            status, content_type, payload, *extra = self.handle(parts.path, query, body, request.headers)
+
+        data = payload.encode() if isinstance(payload, str) else payload
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(data)))
+        if status == 429:
+            request.send_header('Retry-After', '0.05')
+        for header, value in (extra[0] if extra else {}).items():
+            request.send_header(header, value)
+        request.end_headers()
+        request.wfile.write(data)
+
+    def route(self, path):
+        return path.rstrip('/').rsplit('/', 1)[-1] or '/'
+
+    def error(self):
+        return 503, 'text/plain', 'unavailable'
+
+    def handle(self, path, query, body, headers):
+        raise NotImplementedError
+
+
+class FakeSlack(FakeService):
+    name = 'slack'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Reply ts -> ts of the message it answers, and when each message was
+        # last touched, so end-to-end latency can be measured per message
+        self.replies = {}
+        self.last_call = {}
+        self._ts = 0
+
+    def error(self):
+        return 429, 'application/json', json.dumps({'ok': False, 'error': 'ratelimited'})
+
+    def _params(self, body, headers):
+        if 'json' in headers.get('Content-Type', ''):
+            return json.loads(body or b'{}')
+        return {k: v[-1] for k, v in parse_qs(body.decode()).items()}
+
+    def handle(self, path, query, body, headers):
+        method = self.route(path)
+        params = dict(query, **self._params(body, headers))
+        now = time.perf_counter()
+        with self._lock:
+            self._ts += 1
+            ts = f'{int(time.time())}.{self._ts:06d}'
+            origin = None
+            if method == 'chat.postMessage':
+                origin = params.get('thread_ts')
+                if origin:
+                    self.replies[ts] = origin
+            elif method == 'chat.update':
+                origin = self.replies.get(params.get('ts'))
+                ts = params.get('ts') or ts
+            if origin:
+                self.last_call[origin] = now
+        return 200, 'application/json', json.dumps({
+            'ok': True, 'user_id': 'UBOT', 'ts': ts, 'channel': params.get('channel')})
+
+
+class FakeYahoo(FakeService):
+    name = 'yahoo'
+
+    def route(self, path):
+        # .../timeseries/<symbol>
+        if '/timeseries/' in path:
+            return 'timeseries'
+        return super().route(path)
+
+    def handle(self, path, query, body, headers):
+        route = self.route(path)
+        if route == 'search':
+            words = query.get('q', '').lower().split()
+            matches = [
+                {'symbol': symbol, 'shortname': name, 'quoteType': 'EQUITY'}
+                for symbol, name in COMPANIES
+                if words and (symbol.lower() == words[0] or all(w in name.lower() for w in words))
+            ]
+            return 200, 'application/json', json.dumps({'quotes': matches[:5]})
+
+        if route == 'cookie':
+            # Like fc.yahoo.com: a 404 page that sets the session cookie
+            return 404, 'text/html', 'not found', {'Set-Cookie': f'{YAHOO_COOKIE}; Path=/'}
+
+        authorized = YAHOO_COOKIE in (headers.get('Cookie') or '')
+        if route == 'getcrumb':
+            if not authorized:
+                return 401, 'text/plain', 'Unauthorized'
+            return 200, 'text/plain', YAHOO_CRUMB
+
+        if route == 'quote':
+            if not authorized or query.get('crumb') != YAHOO_CRUMB:
+                return 401, 'application/json', json.dumps(
+                    {'finance': {'result': None, 'error': {'code': 'Unauthorized', 'description': 'Invalid Crumb'}}})
+            symbols = [s.upper() for s in query.get('symbols', '').split(',')]
+            result = [info_for(s) for s in symbols if s in BY_SYMBOL]
+            return 200, 'application/json', json.dumps({'quoteResponse': {'result': result}})
+
+        symbol = query.get('symbol', '').upper()
+        if route == 'timeseries':
+            result = timeseries_for(symbol, query.get('type', '').split(',')) if symbol in BY_SYMBOL else []
+            return 200, 'application/json', json.dumps({'timeseries': {'result': result, 'error': None}})
+
+        if route == 'info':
+            return 200, 'application/json', json.dumps(info_for(symbol) if symbol in BY_SYMBOL else {})
+
+        if route == 'history':
+            start = date.fromisoformat(query['start'])
+            end = date.fromisoformat(query['end'])
+            bars = bars_for(symbol, start, end) if symbol in BY_SYMBOL else []
+            return 200, 'application/json', json.dumps(bars)
+
+        if route == 'download':
+            start = date.fromisoformat(query['start'])
+            end = date.fromisoformat(query['end'])
+            symbols = [s.upper() for s in query.get('symbols', '').split(',')]
+            return 200, 'application/json', json.dumps(
+                {s: bars_for(s, start, end) for s in symbols if s in BY_SYMBOL})
+
+        return 404, 'text/plain', 'not found'
+
+
+class FakeMarketWatch(FakeService):
+    name = 'marketwatch'
+
+    def handle(self, path, query, body, headers):
+        words = query.get('Lookup', '').lower().split()
+        rows = ''.join(
+            f'<tr><td><a href="/investing/stock/{symbol}">{symbol}</a></td><td>{escape(name)}</td></tr>'
+            for symbol, name in COMPANIES
+            if words and all(w in name.lower() for w in words)
+        )
+        return 200, 'text/html', f'<html><body><table class="results">{rows}</table></body></html>'
+
+
+class FakeWikipedia(FakeService):
+    name = 'wikipedia'
+
+    def handle(self, path, query, body, headers):
+        rows = ''.join(f'<tr><td>{symbol}</td><td>{escape(name)}</td></tr>' for symbol, name in COMPANIES)
+        return 200, 'text/html', (
+            '<html><body><table><tr><th>Symbol</th><th>Security</th></tr>'
+            f'{rows}</table></body></html>')
+
+
+SERVICES = [FakeSlack, FakeYahoo, FakeMarketWatch, FakeWikipedia]
+
+
+def start_all(latency=None, error_rate=None, seed=0):
+    """
+    Start one of each fake; returns {name: service}
+    """
+    latency = latency or {}
+    error_rate = error_rate or {}
+    return {
+        cls.name: cls(latency.get(cls.name, 0.0), error_rate.get(cls.name, 0.0), seed).start()
+        for cls in SERVICES
+    }
+
+
+def bot_env(services):
+    """
+    Environment variables that point the bot at the fakes
+    """
+    yahoo = services['yahoo'].url
+    return {
+        'SLACK_API_URL': services['slack'].url + '/',
+        'YAHOO_SEARCH_URL': yahoo + '/v1/finance/search',
+        'YAHOO_QUOTE_URL': yahoo + '/v7/finance/quote',
+        'YAHOO_COOKIE_URL': yahoo + '/cookie',
+        'YAHOO_CRUMB_URL': yahoo + '/v1/test/getcrumb',
+        'YAHOO_TIMESERIES_URL': yahoo + '/ws/fundamentals-timeseries/v1/finance/timeseries',
+        'FAKE_YAHOO_URL': yahoo,
+        # The budget the bot keeps for Yahoo's query hosts by default
+        # (http_client.DEFAULT_HOST_LIMITS), applied to the stand-in;
+        # limits already in the environment still win
+        'HTTP_HOST_LIMITS': ','.join(filter(None, [
+            f'{urlsplit(yahoo).netloc}=50/100', os.environ.get('HTTP_HOST_LIMITS')])),
+        'MARKETWATCH_LOOKUP_URL': services['marketwatch'].url + '/tools/quotes/lookup.asp',
+        'SYMBOL_UNIVERSE_URL': services['wikipedia'].url + '/wiki/List_of_S%26P_500_companies',
+    }
@@ -0,0 +1,70 @@
+"""
+Moderation benchmark: per-message cost of the bad-word check as the word
+list grows.
+
+    python benchmarks/moderation.py [--messages 2000]
+
+Compares the old approach (a substring test per listed word) against the
+compiled ModerationEngine on the same random word lists and messages.
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from moderation import ModerationEngine  # noqa: E402
+
+SIZES = [10, 100, 1000, 10000]
+
+
+def random_word(rng):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 10)))
+
+
+def random_message(rng, words):
+    parts = [random_word(rng) for _ in range(rng.randint(5, 20))]
+    if rng.random() < 0.1:
+        parts.insert(rng.randrange(len(parts)), rng.choice(words))
+    return ' '.join(parts)
+
+
+def naive_check(message, words):
+    msg = message.lower()
+    msg = msg.translate(str.maketrans('', '', string.punctuation))
+    return any(word in msg for word in words)
+
+
+def per_message_us(check, messages):
+    started = time.perf_counter()
+    for message in messages:
+        check(message)
+    return (time.perf_counter() - started) / len(messages) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'words':>8} {'naive us/msg':>14} {'engine us/msg':>14} {'build ms':>10}")
+    for size in SIZES:
+        rng = random.Random(args.seed)
+        words = [random_word(rng) for _ in range(size)]
+        messages = [random_message(rng, words) for _ in range(args.messages)]
+
+        started = time.perf_counter()
+        engine = ModerationEngine(words, word_boundary=False, leetspeak=False)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        naive = per_message_us(lambda m: naive_check(m, words), messages)
+        compiled = per_message_us(engine.check, messages)
+        print(f"{size:>8} {naive:>14.1f} {compiled:>14.1f} {build_ms:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Replay a recorded request log (EVENT_RECORD_PATH) against a local bot.
+
+    python benchmarks/replay.py events.log [--speed 1|10|max]
+        [--latency yahoo=0.05] [--errors yahoo=0.05] [--json]
+
+Requests are re-sent with their original spacing divided by --speed (or
+back to back with --speed max), re-signed with a local secret. Upstreams
+are the fakes from benchmarks/fakes.py, as in load.py.
+
+Reports per-event queueing delay (arrival until a worker picks it up) and
+end-to-end latency (until the handler and its Slack calls are done).
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import fakes  # noqa: E402
+import load  # noqa: E402
+from event_recorder import read_log  # noqa: E402
+
+
+def parse_speed(value):
+    return 0.0 if value == 'max' else float(value)
+
+
+def instrument(bot):
+    """
+    Wrap the event queue's handler to record when each event is picked up
+    and when its handler returns
+    """
+    started = {}
+    finished = {}
+    handler = bot.events.handler
+
+    def timed_handler(payload):
+        event_id = payload.get('event_id')
+        started[event_id] = time.perf_counter()
+        try:
+            handler(payload)
+        finally:
+            finished[event_id] = time.perf_counter()
+
+    bot.events.handler = timed_handler
+    return started, finished
+
+
+def replay(bot, services, entries, speed):
+    local = threading.local()
+    arrivals = {}
+    acks = []
+    errors = []
+
+    def send(entry):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = bot.app.test_client()
+        body = entry['body'].encode()
+        headers = load.signed(body)
+        headers['Content-Type'] = entry.get('type') or headers['Content-Type']
+        if entry.get('retry') is not None:
+            headers['X-Slack-Retry-Num'] = str(entry['retry'])
+
+        arrived = time.perf_counter()
+        if entry['path'] == '/slack/events':
+            try:
+                payload = json.loads(entry['body'])
+                event_id = payload.get('event_id')
+                # The first delivery of an event is the one that gets processed
+                if event_id and event_id not in arrivals:
+                    arrivals[event_id] = (arrived, payload.get('event', {}).get('ts'))
+            except ValueError:
+                pass
+        response = client.post(entry['path'], data=body, headers=headers)
+        acks.append(time.perf_counter() - arrived)
+        if response.status_code != 200:
+            errors.append(response.status_code)
+
+    origin = entries[0]['t'] if entries else 0.0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        for entry in entries:
+            if speed:
+                delay = started + (entry['t'] - origin) / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            executor.submit(send, entry)
+    return arrivals, acks, errors, started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('log')
+    parser.add_argument('--speed', type=parse_speed, default=1.0, help="time scale, e.g. 1, 10 or 'max'")
+    parser.add_argument('--latency', default='', help='per-service latency, e.g. yahoo=0.05,slack=0.01')
+    parser.add_argument('--errors', default='', help='per-service error rate, e.g. yahoo=0.05')
+    parser.add_argument('--update-rate', type=float, default=6000, help='chat.update calls per minute')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', action='store_true', help='print the summary as JSON')
+    args = parser.parse_args()
+
+    entries = sorted(read_log(os.path.abspath(args.log)), key=lambda entry: entry['t'])
+    services = fakes.start_all(
+        fakes.parse_service_values(args.latency), fakes.parse_service_values(args.errors), args.seed)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        bot = load.start_bot(services, workdir, args.update_rate)
+        for service in services.values():
+            service.reset_counts()
+        started, finished = instrument(bot)
+        arrivals, acks, errors, replay_started = replay(bot, services, entries, args.speed)
+        bot.events.join()
+        bot.outbox.join()
+
+    last_call = services['slack'].last_call
+    queueing = []
+    latency = []
+    for event_id, (arrived, ts) in arrivals.items():
+        if event_id not in started:
+            continue
+        queueing.append(started[event_id] - arrived)
+        latency.append(max(finished.get(event_id, 0.0), last_call.get(ts, 0.0)) - arrived)
+
+    duration = (entries[-1]['t'] - entries[0]['t']) if entries else 0.0
+    elapsed = time.perf_counter() - replay_started
+    summary = {
+        'requests': len(entries),
+        'events': len(arrivals),
+        'processed': len(latency),
+        'http_errors': len(errors),
+        'recorded_seconds': duration,
+        'replay_seconds': elapsed,
+        'ack': {q: load.percentile(acks, q) for q in (50, 95, 99)},
+        'queueing': {q: load.percentile(queueing, q) for q in (50, 95, 99)},
+        'latency': {q: load.percentile(latency, q) for q in (50, 95, 99)},
+        'queue': bot.events.stats(),
+    }
+
+    if args.json:
+        print(json.dumps(summary, indent=2, default=str))
+        return
+
+    print(f"requests      {summary['requests']} ({summary['events']} events,"
+          f" {summary['processed']} processed, {summary['http_errors']} HTTP errors)")
+    print(f"duration      {duration:.1f}s recorded, {elapsed:.1f}s until replay drained")
+    for key in ('ack', 'queueing', 'latency'):
+        values = summary[key]
+        print(f"{key:<13} p50 {values[50] * 1000:8.1f} ms  p95 {values[95] * 1000:8.1f} ms"
+              f"  p99 {values[99] * 1000:8.1f} ms")
+    print(f"queue         max depth {summary['queue']['max_depth']},"
+          f" {summary['queue']['rejected']} rejected, {summary['queue']['duplicates']} duplicates")
+
+
+if __name__ == '__main__':
+    main()
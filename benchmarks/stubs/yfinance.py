@@ -0,0 +1,64 @@
+"""
+Stand-in for the parts of yfinance the bot uses, backed by the fake Yahoo
+service in benchmarks/fakes.py (FAKE_YAHOO_URL). Benchmarks put this
+directory first on sys.path so nothing reaches the real Yahoo.
+"""
+import json
+import os
+from datetime import date, timedelta
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+import pandas as pd
+
+PERIODS = {'d': 1, 'wk': 7, 'mo': 31, 'y': 365}
+
+
+def _get(route, **params):
+    url = f"{os.environ['FAKE_YAHOO_URL']}/{route}?{urlencode(params)}"
+    with urlopen(url, timeout=30) as response:
+        return json.load(response)
+
+
+def _range(start=None, end=None, period='1mo'):
+    end = pd.Timestamp(end).date() if end is not None else date.today() + timedelta(days=1)
+    if start is None:
+        for suffix, days in PERIODS.items():
+            if period.endswith(suffix) and period[:-len(suffix)].isdigit():
+                start = end - timedelta(days=int(period[:-len(suffix)]) * days)
+                break
+        else:
+            start = end - timedelta(days=31)
+    return pd.Timestamp(start).date(), end
+
+
+def _frame(bars):
+    frame = pd.DataFrame(bars, columns=['Date', 'Open', 'High', 'Low', 'Close', 'Volume'])
+    frame.index = pd.DatetimeIndex(pd.to_datetime(frame.pop('Date')), name='Date')
+    frame['Adj Close'] = frame['Close']
+    return frame
+
+
+class Ticker:
+    def __init__(self, symbol):
+        self.ticker = symbol.upper()
+
+    @property
+    def info(self):
+        return _get('info', symbol=self.ticker)
+
+    def history(self, period='1mo', start=None, end=None, **kwargs):
+        start, end = _range(start, end, period)
+        return _frame(_get('history', symbol=self.ticker, start=start.isoformat(), end=end.isoformat()))
+
+
+def download(tickers, period='1mo', start=None, end=None, group_by='column', **kwargs):
+    symbols = tickers.split() if isinstance(tickers, str) else list(tickers)
+    start, end = _range(start, end, period)
+    data = _get('download', symbols=','.join(symbols), start=start.isoformat(), end=end.isoformat())
+    frames = {symbol: _frame(bars) for symbol, bars in data.items()}
+    if not frames:
+        return pd.DataFrame()
+    if len(symbols) == 1:
+        return next(iter(frames.values()))
+    return pd.concat(frames, axis=1).swaplevel(axis=1).sort_index(axis=1)
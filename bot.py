@@ -1,39 +1,85 @@
-
 import slack
 import os
 from pathlib import Path
 from dotenv import load_dotenv
 from flask import Flask, request, Response
 from slackeventsapi import SlackEventAdapter
-import string
 import logging
-import yfinance as yf
-import pandas as pd
-from datetime import datetime, timedelta
-import requests
-from bs4 import BeautifulSoup
+import time
 import re
 import json
-
-logging.basicConfig(level=logging.DEBUG)
+import hashlib
+import hmac
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, TimeoutError as FuturesTimeoutError, wait
+import event_queue
+import ticker_cache
+import symbol_index
+import resolver
+import quotes
+import snapshot_cache
+import history_store
+import compare
+import http_client
+import slack_outbox
+import bot_identity
+import lazy_imports
+import state_store
+import moderation
+import metrics
+import event_recorder
+import company_snapshot
+import prefetch
+import alerts
+import logging_setup
+import metric_picker
+
+# Heavy libraries load on first use (or when warmed below) to keep startup fast
+yf = lazy_imports.lazy_import('yfinance')
+bs4 = lazy_imports.lazy_import('bs4')
+HEAVY_MODULES = ['yfinance', 'pandas', 'numpy', 'bs4']
 
 # Load environment variables
 env_path = Path('.') / '.env'
 load_dotenv(dotenv_path=env_path)
 
+# LOG_MODE=json moves formatting and writes onto a background thread
+logging_setup.from_env()
+
+# Background work that isn't needed for the first ack waits this long
+WARM_IMPORTS_DELAY = float(os.environ.get('WARM_IMPORTS_DELAY', 1))
+
 # Initialize Flask app and Slack client
 app = Flask(__name__)
 slack_event_adapter = SlackEventAdapter(
     os.environ['SIGNING_SECRET'], '/slack/events', app)
 
-client = slack.WebClient(token=os.environ['SLACK_TOKEN'])
-BOT_ID = client.api_call("auth.test")['user_id']
+# Optional raw request log for replaying traffic (EVENT_RECORD_PATH)
+recorder = event_recorder.from_env()
+if recorder:
+    @app.before_request
+    def record_request():
+        recorder.record_request(request)
 
-message_counts = {}
-welcome_messages = {}
-user_states = {}  # Track user conversation state
+client = slack.WebClient(
+    token=os.environ['SLACK_TOKEN'],
+    base_url=os.environ.get('SLACK_API_URL', slack.WebClient.BASE_URL))
+
+# Resolved by auth.test in the background and cached on disk
+identity = bot_identity.BotIdentity(
+    client, os.environ['SLACK_TOKEN'], cache_path=os.environ.get('BOT_IDENTITY_PATH', '.bot_identity.json'))
+identity.start()
+
+# All outgoing messages go through per-channel, rate-limited queues
+outbox = slack_outbox.from_env(client)
+
+# Message counts, welcome messages and conversation state, shared between
+# worker processes when STATE_BACKEND is sqlite or redis
+state = state_store.from_env()
 
 BAD_WORDS = ['stupid', 'bitch', 'idiot']
+moderation_engine = moderation.from_env(BAD_WORDS)
+
+resolution_cache = ticker_cache.from_env()
 
 # Fallback common ticker corrections for when search fails
 TICKER_CORRECTIONS = {
@@ -42,6 +88,10 @@ TICKER_CORRECTIONS = {
     'AMZM': 'AMZN',   # Common misspelling for Amazon
 }
 
+# Local S&P 500 listing used for name matching and typo correction
+symbol_universe = symbol_index.from_env(aliases=TICKER_CORRECTIONS)
+symbol_universe.start(delay=WARM_IMPORTS_DELAY)
+
 
 class WelcomeMessage:
     START_TEXT = {
@@ -57,9 +107,12 @@ class WelcomeMessage:
 
     DIVIDER = {'type': 'divider'}
 
+    icon_emoji = ':chart_with_upwards_trend:'
+
+    __slots__ = ('channel', 'timestamp', 'completed')
+
     def __init__(self, channel):
         self.channel = channel
-        self.icon_emoji = ':chart_with_upwards_trend:'
         self.timestamp = ''
         self.completed = False
 
@@ -76,271 +129,554 @@ class WelcomeMessage:
             ]
         }
 
+    def to_record(self):
+        return json.dumps({'ts': self.timestamp, 'completed': self.completed})
+
+    @classmethod
+    def from_record(cls, channel, record):
+        data = json.loads(record)
+        if data.get('ts') is None:
+            # Still being posted by another worker, or the post failed
+            return None
+        welcome = cls(channel)
+        welcome.timestamp = data['ts']
+        welcome.completed = data['completed']
+        return welcome
+
     def _get_instruction_block(self):
         text = "Type a company name (e.g., 'Apple', 'Microsoft', 'Tesla') to get financial information."
         return {'type': 'section', 'text': {'type': 'mrkdwn', 'text': text}}
 
 
 def send_welcome_message(channel, user):
-    if channel not in welcome_messages:
-        welcome_messages[channel] = {}
+    key = f'welcome:{channel}'
 
-    if user in welcome_messages[channel]:
+    # Claim the slot first so two workers can't both welcome the same user
+    if not state.hsetnx(key, user, '{}'):
         return
 
     welcome = WelcomeMessage(channel)
     message = welcome.get_message()
-    response = client.chat_postMessage(**message)
-    welcome.timestamp = response['ts']
+    handle = outbox.post(**message)
+    welcome.timestamp = handle.wait()
+    if welcome.timestamp is None:
+        # The post failed (see handle.error); free the slot so it's retried
+        logging.error(f"Could not post the welcome message for {user} in {channel}: {handle.error}")
+        state.hdel(key, user)
+        return
+
+    with state.pipeline() as pipe:
+        pipe.hset(key, user, welcome.to_record())
+        pipe.hset('user_states', user, "awaiting_company")
 
-    welcome_messages[channel][user] = welcome
-    user_states[user] = "awaiting_company"
+
+def load_welcome_message(channel, user):
+    record = state.hget(f'welcome:{channel}', user)
+    if not record:
+        return None
+    return WelcomeMessage.from_record(channel, record)
 
 
 def check_if_bad_words(message):
-    msg = message.lower()
-    msg = msg.translate(str.maketrans('', '', string.punctuation))
-    return any(word in msg for word in BAD_WORDS)
+    return moderation_engine.check(message)
 
 
+@metrics.timed('search')
 def search_ticker_symbol(company_name):
     """
-    Search for ticker symbol using multiple methods:
-    1. Yahoo Finance ticker search
-    2. MarketWatch search
-    3. Direct finviz lookup
-    4. Wikipedia search
-    5. YFinance direct API
+    Resolve a company name to a ticker, using the resolution cache before
+    falling back to the full search cascade. "No match" is only cached when
+    every source actually answered.
     """
-    company_name = company_name.strip()
-    
+    cached = resolution_cache.get(company_name)
+    if cached is not ticker_cache.MISS:
+        return cached
+
+    ticker = _search_ticker_symbol(company_name)
+    if ticker is resolver.UNRESOLVED:
+        return None
+    resolution_cache.set(company_name, ticker)
+    return ticker
+
+
+# Timeout for each upstream HTTP request made by a search source
+SEARCH_SOURCES_TIMEOUT = float(os.environ.get('SEARCH_HTTP_TIMEOUT', 5))
+
+# Search endpoints, overridable to point at local stand-ins (see benchmarks/)
+YAHOO_SEARCH_URL = os.environ.get('YAHOO_SEARCH_URL', 'https://query2.finance.yahoo.com/v1/finance/search')
+MARKETWATCH_LOOKUP_URL = os.environ.get('MARKETWATCH_LOOKUP_URL', 'https://www.marketwatch.com/tools/quotes/lookup.asp')
+
+
+def is_listed_symbol(symbol):
+    """
+    Whether the symbol is in the local index (no network)
+    """
+    return symbol_universe.name_for(symbol) is not None
+
+
+def is_tradable(symbol, deadline=None):
+    """
+    Verify a ticker actually works
+    """
+    return quotes.first_tradable([symbol], deadline) is not None
+
+
+def yahoo_candidates(text):
+    data = json.loads(text)
+    return [quote['symbol'] for quote in data.get('quotes') or [] if 'symbol' in quote]
+
+
+def marketwatch_candidates(html):
+    soup = bs4.BeautifulSoup(html, 'html.parser')
+    return [result.text.strip() for result in soup.select('table.results tr td:first-child a')]
+
+
+def marketwatch_params(company_name):
+    return {'siteID': 'mktw', 'Lookup': company_name, 'Country': 'us', 'Type': 'All'}
+
+
+@metrics.timed('search.symbol')
+def _search_exact_symbol(company_name, cancelled, deadline):
     # If input is already in ticker format (all caps, 1-5 letters), try it directly
     if company_name.isupper() and 1 <= len(company_name) <= 5:
         # Still verify it actually exists
-        try:
-            ticker = yf.Ticker(company_name)
-            info = ticker.info
-            if info and 'regularMarketPrice' in info and info['regularMarketPrice'] is not None:
-                return company_name
-        except:
-            pass
-    
-    # Try Yahoo Finance API
-    try:
-        url = f"https://query2.finance.yahoo.com/v1/finance/search?q={company_name}"
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(url, headers=headers)
-        data = json.loads(response.text)
-        
-        if 'quotes' in data and data['quotes']:
-            for quote in data['quotes']:
-                if 'symbol' in quote:
-                    # Verify the ticker actually works
-                    ticker = yf.Ticker(quote['symbol'])
-                    if hasattr(ticker, 'info') and ticker.info and 'regularMarketPrice' in ticker.info:
-                        return quote['symbol']
-    except Exception as e:
-        logging.error(f"Error in Yahoo Finance search: {e}")
-    
-    # Try MarketWatch search
-    try:
-        url = f"https://www.marketwatch.com/tools/quotes/lookup.asp?siteID=mktw&Lookup={company_name}&Country=us&Type=All"
-        headers = {'User-Agent': 'Mozilla/5.0'}
-        response = requests.get(url, headers=headers)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Find the first result in the search table
-        results = soup.select('table.results tr td:first-child a')
-        if results:
-            for result in results:
-                ticker_candidate = result.text.strip()
-                # Verify the ticker actually works
-                ticker = yf.Ticker(ticker_candidate)
-                if hasattr(ticker, 'info') and ticker.info and 'regularMarketPrice' in ticker.info:
-                    return ticker_candidate
-    except Exception as e:
-        logging.error(f"Error in MarketWatch search: {e}")
+        if is_tradable(company_name, deadline):
+            return company_name
+    return None
+
+
+@metrics.timed('search.yahoo')
+def _search_yahoo(company_name, cancelled, deadline):
+    response = http_client.shared().get(
+        YAHOO_SEARCH_URL, params={'q': company_name}, timeout=SEARCH_SOURCES_TIMEOUT, deadline=deadline)
+    response.raise_for_status()
     
-    # Try finviz directly with company name as ticker
-    try:
-        # normalize to probable ticker format
-        possible_ticker = ''.join(filter(str.isalpha, company_name)).upper()
-        if 1 <= len(possible_ticker) <= 5:  # Valid ticker length
-            ticker = yf.Ticker(possible_ticker)
-            info = ticker.info
-            if info and 'regularMarketPrice' in info and info['regularMarketPrice'] is not None:
-                return possible_ticker
-    except Exception as e:
-        logging.error(f"Error in direct ticker check: {e}")
+    # Verify all the candidates in one batch
+    candidates = yahoo_candidates(response.text)
+    if cancelled.is_set():
+        return None
+    return quotes.first_tradable(candidates, deadline)
+
+
+@metrics.timed('search.marketwatch')
+def _search_marketwatch(company_name, cancelled, deadline):
+    response = http_client.shared().get(
+        MARKETWATCH_LOOKUP_URL, params=marketwatch_params(company_name), timeout=SEARCH_SOURCES_TIMEOUT,
+        deadline=deadline)
+    # An error page would otherwise parse as "no results"
+    response.raise_for_status()
     
-    # Try Wikipedia S&P 500 list
-    try:
-        sp500 = pd.read_html('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')[0]
-        company_match = sp500[sp500['Security'].str.contains(company_name, case=False)]
-        if not company_match.empty:
-            ticker_candidate = company_match.iloc[0]['Symbol']
-            # Verify the ticker actually works
-            ticker = yf.Ticker(ticker_candidate)
-            if hasattr(ticker, 'info') and ticker.info and 'regularMarketPrice' in ticker.info:
-                return ticker_candidate
-    except Exception as e:
-        logging.error(f"Error in Wikipedia search: {e}")
+    # Verify the results in the search table in one batch
+    candidates = marketwatch_candidates(response.text)
+    if cancelled.is_set():
+        return None
+    return quotes.first_tradable(candidates, deadline)
+
+
+@metrics.timed('search.direct')
+def _search_direct(company_name, cancelled, deadline):
+    # normalize to probable ticker format
+    possible_ticker = ''.join(filter(str.isalpha, company_name)).upper()
+    if 1 <= len(possible_ticker) <= 5 and is_tradable(possible_ticker, deadline):
+        return possible_ticker
+    return None
+
+
+@metrics.timed('search.universe')
+def _search_universe(company_name, cancelled, deadline):
+    candidates = [symbol for symbol, security, score in symbol_universe.search(company_name, limit=3)]
+    if cancelled.is_set():
+        return None
+    return quotes.first_tradable(candidates, deadline)
+
+
+# Independent sources, in default priority order
+SEARCH_SOURCES = [
+    resolver.Source('symbol', _search_exact_symbol),
+    resolver.Source('yahoo', _search_yahoo),
+    resolver.Source('marketwatch', _search_marketwatch),
+    resolver.Source('direct', _search_direct),
+    resolver.Source('universe', _search_universe),
+]
+
+# 'hedged' runs the sources concurrently, 'sequential' tries them one by one
+RESOLVE_MODE = os.environ.get('RESOLVE_MODE', 'hedged')
+hedged_resolver = resolver.from_env(SEARCH_SOURCES)
+
+
+def _search_ticker_symbol(company_name):
+    """
+    Search for ticker symbol using multiple methods:
+    1. Direct check when the input already looks like a ticker
+    2. Yahoo Finance ticker search
+    3. MarketWatch search
+    4. Direct finviz lookup
+    5. Local S&P 500 index
+    then fall back to typo correction and the YFinance direct API.
+
+    In 'hedged' mode 1-5 run concurrently and the first verified ticker wins.
+    Either way sources that keep failing are skipped for a while, and the
+    rest are ranked by their recent speed and hit rate (see resolver.py).
+    Returns resolver.UNRESOLVED rather than None when nothing was found but
+    some step failed, timed out or was skipped.
+    """
+    company_name = company_name.strip()
     
+    if RESOLVE_MODE == 'sequential':
+        ticker = hedged_resolver.resolve_sequential(company_name)
+    else:
+        ticker = hedged_resolver.resolve(company_name)
+    if ticker:
+        return ticker
+    return fallback_result(ticker, search_fallback(company_name))
+
+
+def fallback_result(resolved, fallback):
+    """
+    The fallback's ticker if it found one; otherwise None only when both the
+    resolver and the fallback gave a real "no match"
+    """
+    if fallback or resolved is None:
+        return fallback
+    return resolver.UNRESOLVED
+
+
+def search_fallback(company_name):
+    """
+    Typo correction, then the YFinance direct API. resolver.UNRESOLVED
+    when the API call fails.
+    """
     # If company name is a common misspelling, correct it
     upper_name = company_name.upper()
-    if upper_name in TICKER_CORRECTIONS:
-        return TICKER_CORRECTIONS[upper_name]
+    corrected = symbol_universe.correct(upper_name, fuzzy=True)
+    if corrected != upper_name:
+        return corrected
     
     # Try using yfinance's search capability with the company name directly
     try:
-        ticker = yf.Ticker(company_name)
-        info = ticker.info
+        with metrics.stage('search.yfinance'):
+            ticker = yf.Ticker(company_name)
+            info = ticker.info
         if info and 'symbol' in info:
             return info['symbol']
     except Exception as e:
         logging.error(f"Error in yfinance direct search: {e}")
+        return resolver.UNRESOLVED
     
     # If all else fails, return None
     return None
 
 
-def get_company_info(ticker_symbol):
+def fetch_company_data(ticker_symbol):
     """
-    function for getting company info using its tckr symbol
+    Fetch the info payload and the 52-week range from daily history as a
+    CompanySnapshot, or None when Yahoo has no live price for the ticker
+    """
+    ticker = yf.Ticker(ticker_symbol)
+    with metrics.stage('yfinance.info'):
+        info = ticker.info
+    
+    # Validate that we have actual data
+    if not info or 'regularMarketPrice' not in info or info['regularMarketPrice'] is None:
+        return None
+    
+    # 52-week high/low from the local history store, which only downloads
+    # the bars added since it was last updated
+    with metrics.stage('history'):
+        hist_low, hist_high = history.range_52w(ticker_symbol)
+    
+    return company_snapshot.CompanySnapshot.from_info(ticker_symbol, info, hist_low, hist_high)
+
+
+history = history_store.from_env()
+
+# Market-hours aware cache in front of fetch_company_data. Snapshots
+# without a live price or a 52-week range only get the short negative TTL.
+company_data = snapshot_cache.from_env(
+    fetch_company_data, usable=lambda snapshot: snapshot is not None and snapshot.hist_low is not None)
+
+# Keeps the most requested symbols warm around the open (PREFETCH_TOP_N=0 disables)
+prefetcher = prefetch.from_env(company_data, history)
+if prefetcher:
+    prefetcher.start()
+
+# How company info is posted: 'mrkdwn', 'blocks' or 'compact'
+COMPANY_INFO_FORMAT = os.environ.get('COMPANY_INFO_FORMAT', 'mrkdwn')
+
+
+def load_company_snapshot(ticker_symbol):
+    """
+    (snapshot, None) from the cache, or (None, message) explaining why
+    there's nothing to show
     """
     try:
         # misspelling
-        if ticker_symbol in TICKER_CORRECTIONS:
-            ticker_symbol = TICKER_CORRECTIONS[ticker_symbol]
-            
-        ticker = yf.Ticker(ticker_symbol)
-        info = ticker.info
-        
-        # Validate that we have actual data
-        if not info or 'regularMarketPrice' not in info or info['regularMarketPrice'] is None:
-            return f"Could not find complete data for ticker {ticker_symbol}"
-        
-        # Get historical data for 52-week high/low
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=365)
-        hist = ticker.history(start=start_date, end=end_date)
-        
-        if hist.empty:
-            return f"Could not find historical data for ticker {ticker_symbol}"
+        ticker_symbol = symbol_universe.correct(ticker_symbol)
+        if prefetcher:
+            prefetcher.record(ticker_symbol)
         
-        # Prepare the information blocks
-        company_name = info.get('shortName', ticker_symbol)
+        snapshot = company_data.get(ticker_symbol)
+        if snapshot is None:
+            return None, f"Could not find complete data for ticker {ticker_symbol}"
         
-        # Basic price information
-        current_price = info.get('regularMarketPrice', info.get('currentPrice', 'N/A'))
-        prev_close = info.get('regularMarketPreviousClose', info.get('previousClose', 'N/A'))
-        open_price = info.get('regularMarketOpen', info.get('open', 'N/A'))
-        day_low = info.get('regularMarketDayLow', info.get('dayLow', 'N/A'))
-        day_high = info.get('regularMarketDayHigh', info.get('dayHigh', 'N/A'))
+        if snapshot.hist_low is None:
+            return None, f"Could not find historical data for ticker {ticker_symbol}"
         
-        # 52-week information
-        week_52_low = info.get('fiftyTwoWeekLow', round(hist['Low'].min(), 2))
-        week_52_high = info.get('fiftyTwoWeekHigh', round(hist['High'].max(), 2))
-        
-        # Volume information
-        volume = info.get('regularMarketVolume', info.get('volume', 'N/A'))
-        avg_volume = info.get('averageDailyVolume10Day', info.get('averageVolume', 'N/A'))
-        
-        # Circuit limits (typically not directly available, approximating)
-        # Most exchanges have limits like 5-20% depending on the security and market
-        if isinstance(current_price, (int, float)):
-            lower_circuit = round(current_price * 0.9, 2)  # Assuming 10% limit
-            upper_circuit = round(current_price * 1.1, 2)  # Assuming 10% limit
-        else:
-            lower_circuit = 'N/A'
-            upper_circuit = 'N/A'
-        
-        # Fundamentals
-        market_cap = info.get('marketCap', 'N/A')
-        if isinstance(market_cap, (int, float)) and market_cap > 1000000:
-            market_cap = f"${market_cap/1000000000:.2f}B"
-        
-        pe_ratio = info.get('trailingPE', 'N/A')
-        eps = info.get('trailingEps', 'N/A')
-        dividend_yield = info.get('dividendYield', 'N/A')
-        if isinstance(dividend_yield, (int, float)):
-            dividend_yield = f"{dividend_yield * 100:.2f}%"
-        
-        # Financial summaries
-        revenue = info.get('totalRevenue', 'N/A')
-        if isinstance(revenue, (int, float)) and revenue > 1000000:
-            revenue = f"${revenue/1000000000:.2f}B"
-            
-        profit_margins = info.get('profitMargins', 'N/A')
-        if isinstance(profit_margins, (int, float)):
-            profit_margins = f"{profit_margins * 100:.2f}%"
-        
-        # Format the response
-        response = f"*Financial Information for {company_name} ({ticker_symbol})*\n\n"
-        
-        # Price Section
-        response += "*Price Information:*\n"
-        response += f"• Current Price: ${current_price if isinstance(current_price, (int, float)) else current_price}\n"
-        response += f"• Previous Close: ${prev_close if isinstance(prev_close, (int, float)) else prev_close}\n"
-        response += f"• Open Price: ${open_price if isinstance(open_price, (int, float)) else open_price}\n"
-        response += f"• Today's Range: ${day_low if isinstance(day_low, (int, float)) else day_low} - ${day_high if isinstance(day_high, (int, float)) else day_high}\n"
-        response += f"• 52-Week Range: ${week_52_low if isinstance(week_52_low, (int, float)) else week_52_low} - ${week_52_high if isinstance(week_52_high, (int, float)) else week_52_high}\n\n"
-        
-        # Volume Section
-        response += "*Volume Information:*\n"
-        response += f"• Volume: {volume:,} shares\n" if isinstance(volume, (int, float)) else f"• Volume: {volume}\n"
-        response += f"• Average Volume: {avg_volume:,} shares\n\n" if isinstance(avg_volume, (int, float)) else f"• Average Volume: {avg_volume}\n\n"
-        
-        # Circuit Limits
-        response += "*Circuit Limits:*\n"
-        response += f"• Lower Circuit: ${lower_circuit}\n"
-        response += f"• Upper Circuit: ${upper_circuit}\n\n"
-        
-        # Fundamentals
-        response += "*Fundamentals:*\n"
-        response += f"• Market Cap: {market_cap}\n"
-        response += f"• P/E Ratio: {pe_ratio}\n"
-        response += f"• EPS (TTM): ${eps}\n"
-        response += f"• Dividend Yield: {dividend_yield}\n\n"
-        
-        # Financial Summaries
-        response += "*Financial Summary:*\n"
-        response += f"• Revenue (TTM): {revenue}\n"
-        response += f"• Profit Margin: {profit_margins}\n"
-        
-        return response
+        return snapshot, None
         
     except Exception as e:
         logging.error(f"Error getting company info: {e}")
-        return f"Error fetching financial data for {ticker_symbol}. Please check if the ticker symbol is correct."
+        return None, f"Error fetching financial data for {ticker_symbol}. Please check if the ticker symbol is correct."
 
 
-@slack_event_adapter.on('message')
-def message(payLoad):
+@metrics.timed('company_info')
+def get_company_message(ticker_symbol, fmt=None):
+    """
+    Slack message kwargs describing the company, rendered from the cached
+    snapshot (each snapshot is only rendered once per format)
+    """
+    snapshot, error = load_company_snapshot(ticker_symbol)
+    if snapshot is None:
+        return {'text': error}
+    return snapshot.render(fmt or COMPANY_INFO_FORMAT)
+
+
+def get_company_info(ticker_symbol):
+    """
+    function for getting company info using its tckr symbol
+    """
+    return get_company_message(ticker_symbol, 'mrkdwn')['text']
+
+
+# Progressive replies post the live quote within PROGRESSIVE_QUOTE_BUDGET
+# seconds and edit the rest in as it arrives, giving up waiting
+# RESPONSE_DEADLINE seconds after the event was picked up. They are only
+# used while quotes.source_stats shows full quotes arriving well inside
+# the budget.
+PROGRESSIVE_REPLIES = os.environ.get('PROGRESSIVE_REPLIES', '1') == '1'
+PROGRESSIVE_QUOTE_BUDGET = float(os.environ.get('PROGRESSIVE_QUOTE_BUDGET', 1.0))
+RESPONSE_DEADLINE = float(os.environ.get('RESPONSE_DEADLINE', 8.0))
+progressive_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('PROGRESSIVE_WORKERS', 16)), thread_name_prefix='progressive')
+
+
+def quote_snapshot(ticker_symbol, latest):
+    """
+    Partial snapshot from a batch quote result, or None when the quote
+    is missing
+    """
+    quote = latest.get(ticker_symbol.upper())
+    if not quotes.is_tradable_quote(quote):
+        return None
+    return company_snapshot.CompanySnapshot.partial(ticker_symbol, quote)
+
+
+@metrics.timed('quote')
+def fetch_quote_snapshot(ticker_symbol):
+    return quote_snapshot(ticker_symbol, quotes.fetch_quotes([ticker_symbol]))
+
+
+def wants_progressive(ticker_symbol):
+    """
+    Whether a reply should go out in stages: not when the full snapshot is
+    already cached, nor while the quote source is too slow or only has
+    prices, when the first stage would show little but pending fields
+    """
+    if not PROGRESSIVE_REPLIES or not quotes.source_stats.fast(PROGRESSIVE_QUOTE_BUDGET):
+        return False
+    snapshot, expires_in = company_data.peek(ticker_symbol)
+    return snapshot is None or expires_in <= 0
+
+
+def finished_quote(quote):
+    """
+    The partial snapshot a quote future finished with, or None while it's
+    still running or when it came back empty or failed
+    """
+    if not quote.done() or quote.cancelled() or quote.exception() is not None:
+        return None
+    return quote.result()
+
+
+def first_message(ticker_symbol, partial):
+    """
+    What to post when the quote budget runs out: the quote if it came
+    back, otherwise everything pending
+    """
+    if partial is None:
+        partial = company_snapshot.CompanySnapshot.partial(ticker_symbol)
+    return partial.render(COMPANY_INFO_FORMAT)
+
+
+def backfill_message(result, partial):
+    """
+    The edit once the full snapshot load finishes. If it failed, keep the
+    quote already shown rather than replacing it with the error.
+    """
+    snapshot, error = result
+    if snapshot is not None:
+        return snapshot.render(COMPANY_INFO_FORMAT)
+    if partial is not None:
+        return partial.settled().render(COMPANY_INFO_FORMAT)
+    return {'text': error}
+
+
+def send_company_info(reply, ticker_symbol, deadline):
+    """
+    Edit `reply` into the company info. Progressively, the quote goes out
+    as soon as it arrives with data (or the budget runs out) and the full
+    snapshot is edited in after; if that misses `deadline` its sections
+    stay pending until the load completes in the background.
+    """
+    ticker_symbol = symbol_universe.correct(ticker_symbol)
+    if not wants_progressive(ticker_symbol):
+        outbox.update(reply, text=f"Found ticker: {ticker_symbol}. Fetching financial data...")
+        outbox.update(reply, **get_company_message(ticker_symbol))
+        return
+
+    started = time.monotonic()
+    full = logging_setup.submit(progressive_pool, load_company_snapshot, ticker_symbol)
+    quote = logging_setup.submit(progressive_pool, fetch_quote_snapshot, ticker_symbol)
+    budget = min(PROGRESSIVE_QUOTE_BUDGET, max(0.0, deadline - started))
+    wait([full, quote], timeout=budget, return_when=FIRST_COMPLETED)
+    partial = finished_quote(quote)
+    if partial is None and quote.done():
+        # Nothing worth showing early; give the full snapshot the rest of the budget
+        wait([full], timeout=max(0.0, started + budget - time.monotonic()))
+    if full.done():
+        outbox.update(reply, **backfill_message(full.result(), None))
+        return
+
+    metrics.observe('reply.first', time.monotonic() - started, 'ok' if partial else 'empty' if quote.done() else 'late')
+    outbox.update(reply, **first_message(ticker_symbol, partial))
+
+    try:
+        result = full.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FuturesTimeoutError:
+        metrics.observe('reply.backfill', time.monotonic() - started, 'late')
+        full.add_done_callback(lambda f: outbox.update(reply, **backfill_message(f.result(), partial)))
+        return
+    metrics.observe('reply.backfill', time.monotonic() - started, 'ok')
+    outbox.update(reply, **backfill_message(result, partial))
+
+
+# Company and metric buttons. Each metric button fetches and caches only
+# the series it shows, not the whole company snapshot.
+metric_cache = metric_picker.from_env()
+PICKER_SIZE = int(os.environ.get('PICKER_SIZE', 5))
+PICKER_COMPANIES = [
+    symbol.strip().upper()
+    for symbol in os.environ.get('PICKER_COMPANIES', 'AAPL,MSFT,GOOGL,AMZN,TSLA').split(',')
+    if symbol.strip()
+]
+
+
+def picker_companies():
+    """
+    The most requested symbols, topped up with PICKER_COMPANIES
+    """
+    popular = prefetcher.tracker.top(PICKER_SIZE) if prefetcher else []
+    return list(dict.fromkeys(popular + PICKER_COMPANIES))[:PICKER_SIZE]
+
+
+def company_picker_message():
+    return metric_picker.company_picker(picker_companies(), symbol_universe.name_for)
+
+
+@metrics.timed('metric')
+def get_metric_message(symbol, metric):
+    """
+    Slack message kwargs for one metric of one company
+    """
+    try:
+        figures = metric_cache.get(metric_picker.cache_key(symbol, metric))
+    except Exception as e:
+        logging.error(f"Error fetching {metric} for {symbol}: {e}")
+        return {'text': f"Error fetching {metric} for {symbol}. Please try again later."}
+    return metric_picker.render_metric(
+        symbol, metric_picker.METRICS[metric], figures, symbol_universe.name_for(symbol))
+
+
+# Price alerts and watchlist digests, polled in one batch per tick
+alert_manager = alerts.from_env(state, outbox, search_ticker_symbol)
+alert_manager.start()
+
+
+def send_comparison(channel_id, ts, names):
+    reply = outbox.post(
+        channel_id,
+        thread_ts=ts,
+        text=f"Comparing {', '.join(names)}. Please wait..."
+    )
+
+    with ThreadPoolExecutor(max_workers=len(names)) as executor:
+        tickers = list(executor.map(search_ticker_symbol, names))
+
+    symbols = list(dict.fromkeys(ticker for ticker in tickers if ticker))
+    missing = [name for name, ticker in zip(names, tickers) if not ticker]
+
+    if symbols:
+        try:
+            with metrics.stage('compare'):
+                table = compare.compare_symbols(symbols)
+        except Exception as e:
+            logging.error(f"Error comparing {symbols}: {e}")
+            table = f"Error fetching comparison data for {', '.join(symbols)}."
+    else:
+        table = "Sorry, I couldn't find ticker symbols for any of those companies."
+
+    if symbols and missing:
+        table += f"\nCouldn't find ticker symbols for: {', '.join(missing)}"
+
+    outbox.update(reply, text=table)
+
+
+def process_message(payLoad):
     event = payLoad.get('event', {})
     channel_id = event.get('channel')
     user_id = event.get('user')
     text = event.get('text')
     ts = event.get('ts')
+    deadline = time.monotonic() + RESPONSE_DEADLINE
 
-    if user_id is not None and BOT_ID != user_id:
-        if user_id in message_counts:
-            message_counts[user_id] += 1
-        else:
-            message_counts[user_id] = 1
+    # Other bots (including this one) and edits, joins etc. never get a reply
+    if user_id is None or event.get('bot_id') or event.get('subtype'):
+        return
+
+    bot_user_id = identity.get(timeout=0)
+    if bot_user_id is None:
+        # auth.test hasn't answered yet, so this could be one of our own
+        # posts; handle it again once it has instead of holding a worker
+        identity.defer(events.requeue, payLoad)
+        return
+
+    if bot_user_id != user_id:
+        state.hincr('message_counts', user_id)
 
         if text.lower() == 'start':
             send_welcome_message(channel_id, user_id)
             return
 
         elif check_if_bad_words(text):
-            client.chat_postMessage(
-                channel=channel_id, thread_ts=ts, text="Please keep conversations professional.")
+            outbox.post(channel_id, thread_ts=ts, text="Please keep conversations professional.")
             return
 
-        # For any text, assume it might be a company name or ticker
-        client.chat_postMessage(
-            channel=channel_id,
+        # "alert me if TSLA drops below 200", "watch AAPL, MSFT", ...
+        command = alerts.parse_command(text)
+        if command:
+            outbox.post(channel_id, thread_ts=ts, text=alert_manager.handle(command, channel_id, user_id))
+            return
+
+        # Several companies at once, e.g. "AAPL MSFT GOOG" or "compare apple, tesla"
+        names = compare.parse_compare_command(text, is_listed_symbol)
+        if names:
+            send_comparison(channel_id, ts, names)
+            return
+
+        # For any text, assume it might be a company name or ticker.
+        # Post one placeholder and keep editing it as the lookup progresses.
+        reply = outbox.post(
+            channel_id,
             thread_ts=ts,
             text="Looking up financial information for your company. Please wait..."
         )
@@ -349,43 +685,119 @@ def message(payLoad):
         ticker = search_ticker_symbol(text)
         
         if ticker:
-            client.chat_postMessage(
-                channel=channel_id,
-                thread_ts=ts,
-                text=f"Found ticker: {ticker}. Fetching financial data..."
-            )
-            
             # getting company info
-            info = get_company_info(ticker)
-            client.chat_postMessage(
-                channel=channel_id,
-                text=info
-            )
+            send_company_info(reply, ticker, deadline)
         else:
-            client.chat_postMessage(
-                channel=channel_id,
+            outbox.update(
+                reply,
                 text=f"Sorry, I couldn't find a ticker symbol for '{text}'. Please try another company name or check the spelling."
             )
 
 
-@slack_event_adapter.on('reaction_added')
-def handle_reaction(payLoad):
+def process_reaction(payLoad):
     event = payLoad.get('event', {})
     channel_id = event.get('item', {}).get('channel')
     user_id = event.get('user')
 
-    if channel_id in welcome_messages and user_id in welcome_messages[channel_id]:
-        welcome = welcome_messages[channel_id][user_id]
+    welcome = load_welcome_message(channel_id, user_id)
+    if welcome:
         welcome.completed = True
+        state.hset(f'welcome:{channel_id}', user_id, welcome.to_record())
         message = welcome.get_message()
-        updated_message = client.chat_update(**message)
-        welcome.timestamp = updated_message['ts']
+        outbox.update(outbox.handle(channel_id, welcome.timestamp), **message)
         
-        # Prompt for company name
-        client.chat_postMessage(
-            channel=channel_id,
-            text="Please type a company name to get financial information."
-        )
+        # Prompt for company name, with buttons for the popular ones
+        outbox.post(channel_id, **company_picker_message())
+
+
+def process_block_actions(payLoad):
+    """
+    Button clicks: a company button offers that company's metrics, a
+    metric button answers in the thread of the message it was on
+    """
+    interaction = payLoad.get('event', {})
+    channel_id = interaction.get('channel', {}).get('id')
+    message_ts = interaction.get('message', {}).get('ts')
+
+    for action in interaction.get('actions', []):
+        picked = metric_picker.parse_action(action)
+        if picked is None:
+            logging.debug(f"Ignoring action {action.get('action_id')}")
+            continue
+
+        symbol, metric = picked
+        if metric is None:
+            outbox.post(channel_id, **metric_picker.metric_picker(symbol, symbol_universe.name_for(symbol)))
+        else:
+            outbox.post(channel_id, thread_ts=message_ts, **get_metric_message(symbol, metric))
+
+
+EVENT_HANDLERS = {
+    'message': process_message,
+    'reaction_added': process_reaction,
+    'block_actions': process_block_actions,
+}
+
+
+def dispatch_event(payLoad):
+    event_type = payLoad.get('event', {}).get('type')
+    handler = EVENT_HANDLERS.get(event_type)
+    if handler:
+        handler(payLoad)
+
+
+events = event_queue.from_env(dispatch_event)
+
+
+@slack_event_adapter.on('message')
+def message(payLoad):
+    # Ack right away; the lookup runs on the worker pool
+    events.submit(payLoad, retry_num=request.headers.get('X-Slack-Retry-Num'))
+
+
+@slack_event_adapter.on('reaction_added')
+def handle_reaction(payLoad):
+    events.submit(payLoad, retry_num=request.headers.get('X-Slack-Retry-Num'))
+
+
+def verify_signature(headers, body):
+    """
+    Slack request signing (v0), for routes slackeventsapi doesn't cover
+    """
+    timestamp = headers.get('X-Slack-Request-Timestamp')
+    signature = headers.get('X-Slack-Signature')
+    if not timestamp or not signature:
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > 60 * 5:
+            return False
+    except ValueError:
+        return False
+    basestring = f'v0:{timestamp}:'.encode() + body
+    expected = 'v0=' + hmac.new(os.environ['SIGNING_SECRET'].encode(), basestring, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+def interaction_event(payLoad):
+    """
+    Wrap a block_actions payload like an event, so it shares the event
+    queue (trigger_id stands in for event_id); None for other interactions
+    """
+    if payLoad.get('type') != 'block_actions':
+        return None
+    return {'event_id': payLoad.get('trigger_id'), 'event': payLoad}
+
+
+@app.route('/slack/interactions', methods=['POST'])
+def interactions():
+    if not verify_signature(request.headers, request.get_data()):
+        return Response('Invalid request signature', status=403)
+
+    # Slack wants the ack within 3 seconds; the action runs on the worker pool
+    event = interaction_event(json.loads(request.form.get('payload', '{}')))
+    if event:
+        events.submit(event)
+    return Response(), 200
 
 
 @app.route('/message-count', methods=['POST'])
@@ -393,10 +805,56 @@ def message_count():
     data = request.form
     user_id = data.get('user_id')
     channel_id = data.get('channel_id')
-    message_count = message_counts.get(user_id, 0)
-    client.chat_postMessage(channel=channel_id, text=f"Message: {message_count}")
+    message_count = int(state.hget('message_counts', user_id) or 0)
+    outbox.post(channel_id, text=f"Message: {message_count}")
     return Response(), 200
 
 
+@app.route('/queue-stats', methods=['GET'])
+def queue_stats():
+    return {
+        'events': events.stats(),
+        'resolution_cache': resolution_cache.stats(),
+        'company_data': company_data.stats(),
+        'http': http_client.shared().stats(),
+        'slack': outbox.stats(),
+        'state': state.stats() if hasattr(state, 'stats') else {},
+        'recorder': recorder.stats() if recorder else {},
+        'prefetch': prefetcher.stats() if prefetcher else {},
+        'alerts': alert_manager.stats(),
+        'resolver': hedged_resolver.stats(),
+        'logging': logging_setup.stats(),
+        'metric_cache': metric_cache.stats(),
+        'yahoo_crumb': quotes.crumb.stats(),
+        'quotes': quotes.source_stats.stats(),
+    }, 200
+
+
+metrics.REGISTRY.add_stats('slackbot_events', events.stats)
+metrics.REGISTRY.add_stats('slackbot_resolution_cache', resolution_cache.stats)
+metrics.REGISTRY.add_stats('slackbot_company_data_cache', company_data.stats)
+metrics.REGISTRY.add_stats('slackbot_http', lambda: http_client.shared().stats(), by='host')
+metrics.REGISTRY.add_stats('slackbot_slack', outbox.stats, label='method')
+if hasattr(state, 'stats'):
+    metrics.REGISTRY.add_stats('slackbot_state', state.stats, label='key')
+if prefetcher:
+    metrics.REGISTRY.add_stats('slackbot_prefetch', prefetcher.stats)
+metrics.REGISTRY.add_stats('slackbot_alerts', alert_manager.stats)
+metrics.REGISTRY.add_stats('slackbot_resolver', hedged_resolver.stats, by='source')
+metrics.REGISTRY.add_stats('slackbot_logging', logging_setup.stats)
+metrics.REGISTRY.add_stats('slackbot_metric_cache', metric_cache.stats)
+metrics.REGISTRY.add_stats('slackbot_yahoo_crumb', quotes.crumb.stats)
+metrics.REGISTRY.add_stats('slackbot_quotes', quotes.source_stats.stats)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+if os.environ.get('WARM_IMPORTS', '1') == '1':
+    lazy_imports.warm_in_background(HEAVY_MODULES, delay=WARM_IMPORTS_DELAY)
+
+
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,420 @@
+"""
+Asyncio entry point. Serves the same Slack events and /message-count
+command as bot.py from a single aiohttp event loop, so hundreds of lookups
+in flight share one thread instead of holding one each:
+
+    python bot_async.py
+
+Configuration, caches and the state store are shared with bot.py. Slack
+calls use the async WebClient and the Yahoo/MarketWatch lookups use
+aiohttp. yfinance has no async API, so its calls run on a small thread pool.
+"""
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import slack
+from aiohttp import web
+
+import bot
+import alerts
+import async_http
+import compare
+import event_queue
+import logging_setup
+import metric_picker
+import metrics
+import quotes
+import resolver
+import slack_outbox
+import ticker_cache
+
+# yfinance, the state store and disk caches block, so they get their own pool
+blocking = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ASYNC_BLOCKING_WORKERS', 32)), thread_name_prefix='blocking')
+
+# Created on startup, inside the event loop
+client = None
+outbox = None
+
+
+async def run_blocking(fn, *args):
+    # Unlike tasks, executor jobs don't inherit the caller's context (and trace id)
+    return await asyncio.get_running_loop().run_in_executor(blocking, contextvars.copy_context().run, fn, *args)
+
+
+@metrics.timed('search.symbol')
+async def _search_exact_symbol(company_name, cancelled, deadline):
+    if company_name.isupper() and 1 <= len(company_name) <= 5:
+        if await quotes.first_tradable_async([company_name], deadline):
+            return company_name
+    return None
+
+
+@metrics.timed('search.yahoo')
+async def _search_yahoo(company_name, cancelled, deadline):
+    response = await async_http.shared().get(
+        bot.YAHOO_SEARCH_URL, params={'q': company_name}, timeout=bot.SEARCH_SOURCES_TIMEOUT, deadline=deadline)
+    response.raise_for_status()
+    candidates = bot.yahoo_candidates(response.text)
+    if cancelled.is_set():
+        return None
+    return await quotes.first_tradable_async(candidates, deadline)
+
+
+@metrics.timed('search.marketwatch')
+async def _search_marketwatch(company_name, cancelled, deadline):
+    response = await async_http.shared().get(
+        bot.MARKETWATCH_LOOKUP_URL, params=bot.marketwatch_params(company_name),
+        timeout=bot.SEARCH_SOURCES_TIMEOUT, deadline=deadline)
+    response.raise_for_status()
+    # Parsing HTML is CPU work, keep it off the loop
+    candidates = await run_blocking(bot.marketwatch_candidates, response.text)
+    if cancelled.is_set():
+        return None
+    return await quotes.first_tradable_async(candidates, deadline)
+
+
+@metrics.timed('search.direct')
+async def _search_direct(company_name, cancelled, deadline):
+    possible_ticker = ''.join(filter(str.isalpha, company_name)).upper()
+    if 1 <= len(possible_ticker) <= 5 and await quotes.first_tradable_async([possible_ticker], deadline):
+        return possible_ticker
+    return None
+
+
+@metrics.timed('search.universe')
+async def _search_universe(company_name, cancelled, deadline):
+    candidates = [symbol for symbol, security, score in bot.symbol_universe.search(company_name, limit=3)]
+    if cancelled.is_set():
+        return None
+    return await quotes.first_tradable_async(candidates, deadline)
+
+
+SEARCH_SOURCES = [
+    resolver.Source('symbol', _search_exact_symbol),
+    resolver.Source('yahoo', _search_yahoo),
+    resolver.Source('marketwatch', _search_marketwatch),
+    resolver.Source('direct', _search_direct),
+    resolver.Source('universe', _search_universe),
+]
+hedged_resolver = resolver.from_env(SEARCH_SOURCES)
+
+
+@metrics.timed('search')
+async def search_ticker_symbol(company_name):
+    cached = bot.resolution_cache.get(company_name)
+    if cached is not ticker_cache.MISS:
+        return cached
+
+    name = company_name.strip()
+    if bot.RESOLVE_MODE == 'sequential':
+        ticker = await hedged_resolver.resolve_sequential_async(name)
+    else:
+        ticker = await hedged_resolver.resolve_async(name)
+    if not ticker:
+        ticker = bot.fallback_result(ticker, await run_blocking(bot.search_fallback, name))
+    if ticker is resolver.UNRESOLVED:
+        return None
+
+    await run_blocking(bot.resolution_cache.set, company_name, ticker)
+    return ticker
+
+
+def _save_welcome(key, user, welcome):
+    with bot.state.pipeline() as pipe:
+        pipe.hset(key, user, welcome.to_record())
+        pipe.hset('user_states', user, "awaiting_company")
+
+
+async def send_welcome_message(channel, user):
+    key = f'welcome:{channel}'
+    if not await run_blocking(bot.state.hsetnx, key, user, '{}'):
+        return
+
+    welcome = bot.WelcomeMessage(channel)
+    message = welcome.get_message()
+    welcome.timestamp = await outbox.wait(outbox.post(**message))
+    if welcome.timestamp is None:
+        await run_blocking(bot.state.hdel, key, user)
+        return
+    await run_blocking(_save_welcome, key, user, welcome)
+
+
+async def send_comparison(channel_id, ts, names):
+    reply = outbox.post(channel_id, thread_ts=ts, text=f"Comparing {', '.join(names)}. Please wait...")
+
+    tickers = await asyncio.gather(*(search_ticker_symbol(name) for name in names))
+    symbols = list(dict.fromkeys(ticker for ticker in tickers if ticker))
+    missing = [name for name, ticker in zip(names, tickers) if not ticker]
+
+    if symbols:
+        try:
+            with metrics.stage('compare'):
+                table = await run_blocking(compare.compare_symbols, symbols)
+        except Exception as e:
+            logging.error(f"Error comparing {symbols}: {e}")
+            table = f"Error fetching comparison data for {', '.join(symbols)}."
+    else:
+        table = "Sorry, I couldn't find ticker symbols for any of those companies."
+
+    if symbols and missing:
+        table += f"\nCouldn't find ticker symbols for: {', '.join(missing)}"
+
+    outbox.update(reply, text=table)
+
+
+@metrics.timed('quote')
+async def fetch_quote_snapshot(ticker):
+    return bot.quote_snapshot(ticker, await quotes.fetch_quotes_async([ticker]))
+
+
+async def send_company_info(reply, ticker, deadline):
+    """
+    bot.send_company_info on the loop: quote first, then the full snapshot
+    """
+    ticker = bot.symbol_universe.correct(ticker)
+    if not bot.wants_progressive(ticker):
+        outbox.update(reply, text=f"Found ticker: {ticker}. Fetching financial data...")
+        outbox.update(reply, **await run_blocking(bot.get_company_message, ticker))
+        return
+
+    started = time.monotonic()
+    full = asyncio.ensure_future(run_blocking(bot.load_company_snapshot, ticker))
+    quote = asyncio.ensure_future(fetch_quote_snapshot(ticker))
+    budget = min(bot.PROGRESSIVE_QUOTE_BUDGET, max(0.0, deadline - started))
+    await asyncio.wait({full, quote}, timeout=budget, return_when=asyncio.FIRST_COMPLETED)
+    partial = bot.finished_quote(quote)
+    if partial is None and quote.done():
+        # Nothing worth showing early; give the full snapshot the rest of the budget
+        await asyncio.wait({full}, timeout=max(0.0, started + budget - time.monotonic()))
+    if full.done():
+        quote.cancel()
+        outbox.update(reply, **bot.backfill_message(full.result(), None))
+        return
+
+    metrics.observe('reply.first', time.monotonic() - started, 'ok' if partial else 'empty' if quote.done() else 'late')
+    outbox.update(reply, **bot.first_message(ticker, partial))
+
+    try:
+        result = await asyncio.wait_for(asyncio.shield(full), max(0.0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        metrics.observe('reply.backfill', time.monotonic() - started, 'late')
+        full.add_done_callback(lambda f: outbox.update(reply, **bot.backfill_message(f.result(), partial)))
+        return
+    metrics.observe('reply.backfill', time.monotonic() - started, 'ok')
+    outbox.update(reply, **bot.backfill_message(result, partial))
+
+
+async def process_message(payLoad):
+    event = payLoad.get('event', {})
+    channel_id = event.get('channel')
+    user_id = event.get('user')
+    text = event.get('text')
+    ts = event.get('ts')
+    deadline = time.monotonic() + bot.RESPONSE_DEADLINE
+
+    # Other bots (including this one) and edits, joins etc. never get a reply
+    if user_id is None or event.get('bot_id') or event.get('subtype'):
+        return
+
+    bot_user_id = bot.identity.get(timeout=0)
+    if bot_user_id is None:
+        # Could be one of our own posts; run it again once auth.test answers
+        loop = asyncio.get_running_loop()
+        bot.identity.defer(loop.call_soon_threadsafe, events.requeue, payLoad)
+        return
+    if bot_user_id == user_id:
+        return
+    await run_blocking(bot.state.hincr, 'message_counts', user_id)
+
+    if text.lower() == 'start':
+        await send_welcome_message(channel_id, user_id)
+        return
+
+    elif bot.check_if_bad_words(text):
+        outbox.post(channel_id, thread_ts=ts, text="Please keep conversations professional.")
+        return
+
+    command = alerts.parse_command(text)
+    if command:
+        reply = await run_blocking(bot.alert_manager.handle, command, channel_id, user_id)
+        outbox.post(channel_id, thread_ts=ts, text=reply)
+        return
+
+    names = compare.parse_compare_command(text, bot.is_listed_symbol)
+    if names:
+        await send_comparison(channel_id, ts, names)
+        return
+
+    reply = outbox.post(
+        channel_id,
+        thread_ts=ts,
+        text="Looking up financial information for your company. Please wait..."
+    )
+
+    ticker = await search_ticker_symbol(text)
+    if ticker:
+        await send_company_info(reply, ticker, deadline)
+    else:
+        outbox.update(
+            reply,
+            text=f"Sorry, I couldn't find a ticker symbol for '{text}'. Please try another company name or check the spelling."
+        )
+
+
+async def process_reaction(payLoad):
+    event = payLoad.get('event', {})
+    channel_id = event.get('item', {}).get('channel')
+    user_id = event.get('user')
+
+    welcome = await run_blocking(bot.load_welcome_message, channel_id, user_id)
+    if welcome:
+        welcome.completed = True
+        await run_blocking(bot.state.hset, f'welcome:{channel_id}', user_id, welcome.to_record())
+        outbox.update(outbox.handle(channel_id, welcome.timestamp), **welcome.get_message())
+        outbox.post(channel_id, **bot.company_picker_message())
+
+
+async def process_block_actions(payLoad):
+    interaction = payLoad.get('event', {})
+    channel_id = interaction.get('channel', {}).get('id')
+    message_ts = interaction.get('message', {}).get('ts')
+
+    for action in interaction.get('actions', []):
+        picked = metric_picker.parse_action(action)
+        if picked is None:
+            logging.debug(f"Ignoring action {action.get('action_id')}")
+            continue
+
+        symbol, metric = picked
+        if metric is None:
+            outbox.post(channel_id, **metric_picker.metric_picker(symbol, bot.symbol_universe.name_for(symbol)))
+        else:
+            outbox.post(channel_id, thread_ts=message_ts, **await run_blocking(bot.get_metric_message, symbol, metric))
+
+
+EVENT_HANDLERS = {
+    'message': process_message,
+    'reaction_added': process_reaction,
+    'block_actions': process_block_actions,
+}
+
+
+async def dispatch_event(payLoad):
+    handler = EVENT_HANDLERS.get(payLoad.get('event', {}).get('type'))
+    if handler:
+        await handler(payLoad)
+
+
+events = event_queue.from_env_async(dispatch_event)
+
+
+async def slack_events(request):
+    body = await request.read()
+    retry_num = request.headers.get('X-Slack-Retry-Num')
+    if bot.recorder:
+        bot.recorder.record(request.path, body.decode(), request.content_type, retry_num)
+
+    if not bot.verify_signature(request.headers, body):
+        return web.Response(status=403, text='Invalid request signature')
+
+    payLoad = json.loads(body)
+    if payLoad.get('type') == 'url_verification':
+        return web.Response(text=payLoad.get('challenge', ''))
+
+    # Ack right away; the lookup runs as a task on the loop
+    events.submit(payLoad, retry_num=retry_num)
+    return web.Response()
+
+
+async def slack_interactions(request):
+    body = await request.read()
+    if bot.recorder:
+        bot.recorder.record(request.path, body.decode(), request.content_type)
+
+    if not bot.verify_signature(request.headers, body):
+        return web.Response(status=403, text='Invalid request signature')
+
+    data = await request.post()
+    event = bot.interaction_event(json.loads(data.get('payload', '{}')))
+    if event:
+        events.submit(event)
+    return web.Response()
+
+
+async def message_count(request):
+    body = await request.read()
+    if bot.recorder:
+        bot.recorder.record(request.path, body.decode(), request.content_type)
+
+    data = await request.post()
+    user_id = data.get('user_id')
+    channel_id = data.get('channel_id')
+    message_count = int(await run_blocking(bot.state.hget, 'message_counts', user_id) or 0)
+    outbox.post(channel_id, text=f"Message: {message_count}")
+    return web.Response()
+
+
+async def queue_stats(request):
+    return web.json_response({
+        'events': events.stats(),
+        'resolution_cache': bot.resolution_cache.stats(),
+        'company_data': bot.company_data.stats(),
+        'http': async_http.shared().stats(),
+        'slack': outbox.stats(),
+        'state': bot.state.stats() if hasattr(bot.state, 'stats') else {},
+        'recorder': bot.recorder.stats() if bot.recorder else {},
+        'prefetch': bot.prefetcher.stats() if bot.prefetcher else {},
+        'alerts': bot.alert_manager.stats(),
+        'resolver': hedged_resolver.stats(),
+        'logging': logging_setup.stats(),
+        'metric_cache': bot.metric_cache.stats(),
+        'yahoo_crumb': quotes.crumb.stats(),
+        'quotes': quotes.source_stats.stats(),
+    })
+
+
+async def metrics_endpoint(request):
+    return web.Response(body=metrics.render().encode(), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+
+async def on_startup(app):
+    global client, outbox
+    client = slack.WebClient(
+        token=os.environ['SLACK_TOKEN'],
+        base_url=os.environ.get('SLACK_API_URL', slack.WebClient.BASE_URL),
+        run_async=True)
+    outbox = slack_outbox.from_env_async(client)
+
+
+async def on_cleanup(app):
+    await events.join()
+    await outbox.join()
+    await async_http.shared().close()
+
+
+metrics.REGISTRY.add_stats('slackbot_async_events', events.stats)
+metrics.REGISTRY.add_stats('slackbot_async_resolver', hedged_resolver.stats, by='source')
+metrics.REGISTRY.add_stats('slackbot_async_http', lambda: async_http.shared().stats(), by='host')
+metrics.REGISTRY.add_stats('slackbot_async_slack', lambda: outbox.stats() if outbox else {}, label='method')
+
+
+def create_app():
+    app = web.Application()
+    app.router.add_post('/slack/events', slack_events)
+    app.router.add_post('/slack/interactions', slack_interactions)
+    app.router.add_post('/message-count', message_count)
+    app.router.add_get('/queue-stats', queue_stats)
+    app.router.add_get('/metrics', metrics_endpoint)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == "__main__":
+    web.run_app(create_app(), host=os.environ.get('HOST', '127.0.0.1'), port=int(os.environ.get('PORT', 5000)))
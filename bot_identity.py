@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+
+class BotIdentity:
+    """
+    The bot's own Slack user id, resolved with auth.test off the startup
+    path and cached on disk so restarts know it immediately
+    """
+
+    def __init__(self, client, token, cache_path=None, retry_interval=5.0, max_deferred=1000):
+        self.client = client
+        self.cache_path = cache_path
+        self.retry_interval = retry_interval
+        # Only a hash of the token is stored, to tell cache entries apart
+        self.token_key = hashlib.sha256(token.encode()).hexdigest()[:16]
+
+        self.user_id = None
+        self._resolved = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._deferred = []
+        self.max_deferred = max_deferred
+        self.dropped = 0
+
+        cached = self._read_cache()
+        if cached:
+            self.user_id = cached
+            self._resolved.set()
+
+    def _read_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f).get(self.token_key)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable bot identity cache: {e}")
+            return None
+
+    def _write_cache(self):
+        if not self.cache_path:
+            return
+        try:
+            tmp_path = f'{self.cache_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({self.token_key: self.user_id}, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logging.warning(f"Could not cache bot identity: {e}")
+
+    def start(self):
+        """
+        Confirm the identity with auth.test in the background, retrying until
+        Slack answers
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._resolve, name='bot-identity', daemon=True)
+            self._thread.start()
+
+    def _resolve(self):
+        while True:
+            try:
+                user_id = self.client.api_call("auth.test")['user_id']
+                if user_id != self.user_id:
+                    self.user_id = user_id
+                    self._write_cache()
+                with self._lock:
+                    self._resolved.set()
+                    deferred, self._deferred = self._deferred, []
+                self._run_deferred(deferred)
+                return
+            except Exception as e:
+                logging.warning(f"auth.test failed, retrying in {self.retry_interval}s: {e}")
+                time.sleep(self.retry_interval)
+
+    def get(self, timeout=None):
+        """
+        The bot user id, waiting up to `timeout` seconds for auth.test if it
+        isn't known yet (None if it still isn't)
+        """
+        self._resolved.wait(timeout)
+        return self.user_id
+
+    def defer(self, fn, *args):
+        """
+        Call fn(*args) once the identity is known: right away if it already
+        is, otherwise from the resolving thread when auth.test answers. Past
+        `max_deferred` waiting calls, new ones are dropped.
+        """
+        with self._lock:
+            if not self._resolved.is_set():
+                if len(self._deferred) >= self.max_deferred:
+                    self.dropped += 1
+                    logging.warning(f"Bot identity still unknown, dropping deferred {fn.__name__}")
+                else:
+                    self._deferred.append((fn, args))
+                return
+        fn(*args)
+
+    def _run_deferred(self, deferred):
+        for fn, args in deferred:
+            try:
+                fn(*args)
+            except Exception as e:
+                logging.error(f"Deferred {fn.__name__} failed: {e}")
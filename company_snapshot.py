@@ -0,0 +1,285 @@
+import itertools
+import threading
+
+import metrics
+
+_versions = itertools.count(1)
+
+RENDERS = metrics.REGISTRY.counter(
+    'slackbot_snapshot_renders_total', 'Company snapshot renders by format and memo use', ('format', 'memoized'))
+
+# (slot, info keys tried in order)
+INFO_FIELDS = [
+    ('name', ('shortName',)),
+    ('price', ('regularMarketPrice', 'currentPrice')),
+    ('prev_close', ('regularMarketPreviousClose', 'previousClose')),
+    ('open', ('regularMarketOpen', 'open')),
+    ('day_low', ('regularMarketDayLow', 'dayLow')),
+    ('day_high', ('regularMarketDayHigh', 'dayHigh')),
+    ('week52_low', ('fiftyTwoWeekLow',)),
+    ('week52_high', ('fiftyTwoWeekHigh',)),
+    ('volume', ('regularMarketVolume', 'volume')),
+    ('avg_volume', ('averageDailyVolume10Day', 'averageVolume')),
+    ('market_cap', ('marketCap',)),
+    ('pe_ratio', ('trailingPE',)),
+    ('eps', ('trailingEps',)),
+    ('dividend_yield', ('dividendYield',)),
+    ('revenue', ('totalRevenue',)),
+    ('profit_margin', ('profitMargins',)),
+]
+
+
+class _Pending:
+    """
+    Placeholder for a field a progressive reply hasn't received yet
+    """
+
+    def __bool__(self):
+        return False
+
+    def __str__(self):
+        return '_pending_'
+
+    __repr__ = __str__
+
+
+PENDING = _Pending()
+
+
+def _first(info, keys):
+    for key in keys:
+        if key in info:
+            return info[key]
+    return None
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class CompanySnapshot:
+    """
+    The fields the bot reports for one ticker at one point in time,
+    extracted from the yfinance info payload once. Each snapshot gets a new
+    version, and its rendered forms are memoized on it, so a popular ticker
+    is formatted once per refresh however many people ask for it.
+    """
+
+    __slots__ = ['symbol', 'version', 'hist_low', 'hist_high', '_rendered', '_lock'] + [
+        slot for slot, _ in INFO_FIELDS]
+
+    def __init__(self, symbol, hist_low=None, hist_high=None, **fields):
+        self.symbol = symbol
+        self.version = next(_versions)
+        self.hist_low = hist_low
+        self.hist_high = hist_high
+        for slot, _ in INFO_FIELDS:
+            setattr(self, slot, fields.get(slot))
+        self._rendered = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_info(cls, symbol, info, hist_low=None, hist_high=None):
+        fields = {slot: _first(info, keys) for slot, keys in INFO_FIELDS}
+        # Fall back to the 52-week range computed from daily history
+        if fields['week52_low'] is None:
+            fields['week52_low'] = hist_low
+        if fields['week52_high'] is None:
+            fields['week52_high'] = hist_high
+        return cls(symbol, hist_low, hist_high, **fields)
+
+    def updated(self, info, hist_low=None, hist_high=None):
+        """
+        A new snapshot with the fields present in `info` (e.g. a batch quote,
+        which lacks the fundamentals) replacing this one's
+        """
+        fields = {slot: getattr(self, slot) for slot, _ in INFO_FIELDS}
+        for slot, keys in INFO_FIELDS:
+            value = _first(info, keys)
+            if value is not None:
+                fields[slot] = value
+        return CompanySnapshot(
+            self.symbol,
+            self.hist_low if hist_low is None else hist_low,
+            self.hist_high if hist_high is None else hist_high,
+            **fields)
+
+    @classmethod
+    def partial(cls, symbol, info=None):
+        """
+        A snapshot for the first message of a progressive reply: whatever
+        `info` (e.g. a quote) has, with every other field pending
+        """
+        info = info or {}
+        fields = {slot: _first(info, keys) for slot, keys in INFO_FIELDS}
+        return cls(symbol, **{slot: PENDING if value is None else value for slot, value in fields.items()})
+
+    @property
+    def is_partial(self):
+        return any(getattr(self, slot) is PENDING for slot, _ in INFO_FIELDS)
+
+    def settled(self):
+        """
+        This snapshot with pending fields given up on (shown as N/A)
+        """
+        fields = {slot: getattr(self, slot) for slot, _ in INFO_FIELDS}
+        return CompanySnapshot(
+            self.symbol, self.hist_low, self.hist_high,
+            **{slot: None if value is PENDING else value for slot, value in fields.items()})
+
+    @property
+    def display_name(self):
+        return self.name or self.symbol
+
+    def render(self, fmt='mrkdwn'):
+        """
+        Slack message kwargs (text and, for some formats, blocks) for this
+        snapshot in the given format
+        """
+        rendered = self._rendered.get(fmt)
+        if rendered is not None:
+            RENDERS.inc(fmt, 'yes')
+            return rendered
+        renderer = RENDERERS[fmt]
+        with self._lock:
+            rendered = self._rendered.get(fmt)
+            if rendered is None:
+                rendered = self._rendered[fmt] = renderer(self)
+                RENDERS.inc(fmt, 'no')
+            else:
+                RENDERS.inc(fmt, 'yes')
+        return rendered
+
+
+RENDERERS = {}
+
+
+def renderer(name):
+    """
+    Register a function snapshot -> message kwargs as format `name`
+    """
+    def decorator(fn):
+        RENDERERS[name] = fn
+        return fn
+    return decorator
+
+
+def _text(value):
+    return 'N/A' if value is None else value
+
+
+def _money(value):
+    if value is PENDING:
+        return str(PENDING)
+    return f"${_text(value)}"
+
+
+def _billions(value):
+    if _is_number(value) and value > 1000000:
+        return f"${value / 1000000000:.2f}B"
+    return _text(value)
+
+
+def _percent(value):
+    if _is_number(value):
+        return f"{value * 100:.2f}%"
+    return _text(value)
+
+
+def _shares(value):
+    if _is_number(value):
+        return f"{value:,} shares"
+    return _text(value)
+
+
+def _circuits(price):
+    # Circuit limits aren't published; approximate with a 10% band
+    if _is_number(price):
+        return round(price * 0.9, 2), round(price * 1.1, 2)
+    if price is PENDING:
+        return PENDING, PENDING
+    return 'N/A', 'N/A'
+
+
+@renderer('mrkdwn')
+def render_mrkdwn(s):
+    lower_circuit, upper_circuit = _circuits(s.price)
+    lines = [
+        f"*Financial Information for {s.display_name} ({s.symbol})*",
+        "",
+        "*Price Information:*",
+        f"• Current Price: {_money(s.price)}",
+        f"• Previous Close: {_money(s.prev_close)}",
+        f"• Open Price: {_money(s.open)}",
+        f"• Today's Range: {_money(s.day_low)} - {_money(s.day_high)}",
+        f"• 52-Week Range: {_money(s.week52_low)} - {_money(s.week52_high)}",
+        "",
+        "*Volume Information:*",
+        f"• Volume: {_shares(s.volume)}",
+        f"• Average Volume: {_shares(s.avg_volume)}",
+        "",
+        "*Circuit Limits:*",
+        f"• Lower Circuit: {_money(lower_circuit)}",
+        f"• Upper Circuit: {_money(upper_circuit)}",
+        "",
+        "*Fundamentals:*",
+        f"• Market Cap: {_billions(s.market_cap)}",
+        f"• P/E Ratio: {_text(s.pe_ratio)}",
+        f"• EPS (TTM): {_money(s.eps)}",
+        f"• Dividend Yield: {_percent(s.dividend_yield)}",
+        "",
+        "*Financial Summary:*",
+        f"• Revenue (TTM): {_billions(s.revenue)}",
+        f"• Profit Margin: {_percent(s.profit_margin)}",
+    ]
+    return {'text': '\n'.join(lines) + '\n'}
+
+
+@renderer('compact')
+def render_compact(s):
+    change = ''
+    if _is_number(s.price) and _is_number(s.prev_close) and s.prev_close:
+        change = f" ({(s.price / s.prev_close - 1) * 100:+.2f}%)"
+    return {
+        'text': f"*{s.symbol}* {s.display_name}: {_money(s.price)}{change}"
+                f" · 52W {_money(s.week52_low)}-{_money(s.week52_high)}"
+                f" · Mkt cap {_billions(s.market_cap)} · P/E {_text(s.pe_ratio)}"
+    }
+
+
+def _fields_section(title, pairs):
+    return {
+        'type': 'section',
+        'text': {'type': 'mrkdwn', 'text': f"*{title}*"},
+        'fields': [{'type': 'mrkdwn', 'text': f"*{label}*\n{value}"} for label, value in pairs],
+    }
+
+
+@renderer('blocks')
+def render_blocks(s):
+    lower_circuit, upper_circuit = _circuits(s.price)
+    blocks = [
+        {'type': 'header', 'text': {'type': 'plain_text', 'text': f"{s.display_name} ({s.symbol})"}},
+        _fields_section('Price', [
+            ('Current', _money(s.price)),
+            ('Previous close', _money(s.prev_close)),
+            ('Open', _money(s.open)),
+            ("Today's range", f"{_money(s.day_low)} - {_money(s.day_high)}"),
+            ('52-week range', f"{_money(s.week52_low)} - {_money(s.week52_high)}"),
+            ('Circuit limits', f"{_money(lower_circuit)} - {_money(upper_circuit)}"),
+        ]),
+        _fields_section('Volume', [
+            ('Volume', _shares(s.volume)),
+            ('Average', _shares(s.avg_volume)),
+        ]),
+        _fields_section('Fundamentals', [
+            ('Market cap', _billions(s.market_cap)),
+            ('P/E', _text(s.pe_ratio)),
+            ('EPS (TTM)', _money(s.eps)),
+            ('Dividend yield', _percent(s.dividend_yield)),
+            ('Revenue (TTM)', _billions(s.revenue)),
+            ('Profit margin', _percent(s.profit_margin)),
+        ]),
+    ]
+    # Notifications and clients without Block Kit show the text
+    return {'text': render_compact(s)['text'], 'blocks': blocks}
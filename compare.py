@@ -0,0 +1,132 @@
+import re
+
+import lazy_imports
+import quotes
+
+np = lazy_imports.lazy_import('numpy')
+pd = lazy_imports.lazy_import('pandas')
+
+MAX_SYMBOLS = 10
+
+TICKER_PATTERN = re.compile(r'^[A-Z][A-Z0-9.\-]{0,5}$')
+
+# "Apple, Inc." names one company, not two
+NAME_SUFFIXES = {'inc', 'corp', 'co', 'ltd', 'llc', 'plc', 'ag', 'sa', 'nv'}
+
+
+def parse_compare_command(text, is_symbol=None):
+    """
+    Returns the list of names/tickers to compare, or None if the message isn't
+    a comparison. Accepts "compare apple, microsoft", "compare home depot vs
+    lowes" and "AAPL vs MSFT". Without "compare" or "vs", a comma or space
+    separated list only counts when `is_symbol` knows every entry ("AAPL,
+    MSFT", "AAPL MSFT GOOG"), so "Thanks, bot!" or "HOME DEPOT" stay
+    ordinary lookups.
+    """
+    text = text.strip()
+    explicit = re.match(r'^compare\s+(.+)$', text, re.IGNORECASE)
+    body = explicit.group(1) if explicit else text
+
+    def listed(names):
+        return is_symbol is not None and all(TICKER_PATTERN.match(name) and is_symbol(name) for name in names)
+
+    names = [name.strip() for name in re.split(r',|\s+vs\.?\s+', body, flags=re.IGNORECASE)]
+    names = [name for name in names if name and name.strip(' .').lower() not in NAME_SUFFIXES]
+    if len(names) > 1:
+        # Split on "vs" or commas; a bare comma list has to be tickers
+        if not (explicit or re.search(r'\s+vs\.?\s+', body, re.IGNORECASE) or listed(names)):
+            return None
+    else:
+        # No separators: only a list of known tickers, e.g. "AAPL MSFT"
+        names = body.split()
+        if not listed(names):
+            return None
+
+    names = list(dict.fromkeys(names))
+    if len(names) < 2:
+        return None
+    return names[:MAX_SYMBOLS]
+
+
+def download_history(symbols, period='1y'):
+    """
+    One batched download of daily bars for every symbol. Returns
+    (closes, highs, lows) frames with one column per symbol.
+    """
+    import yfinance as yf
+
+    data = yf.download(symbols, period=period, group_by='column', progress=False, auto_adjust=False)
+    frames = []
+    for field in ('Close', 'High', 'Low'):
+        frame = data[field]
+        if isinstance(frame, pd.Series):
+            frame = frame.to_frame(symbols[0])
+        frames.append(frame.reindex(columns=symbols))
+    return tuple(frames)
+
+
+def build_comparison_frame(closes, highs, lows, quote_map=None):
+    """
+    Compute the comparison columns for all symbols at once
+    """
+    quote_map = quote_map or {}
+    closes = closes.ffill()
+
+    last = closes.iloc[-1]
+    prev = closes.iloc[-2] if len(closes) > 1 else last
+    low = lows.min()
+    high = highs.max()
+
+    def quote_field(field):
+        return pd.Series(
+            {symbol: (quote_map.get(symbol) or {}).get(field) for symbol in closes.columns},
+            dtype='float64')
+
+    # Prefer live quote prices, falling back to the last daily close
+    price = quote_field('regularMarketPrice').fillna(last)
+    prev_close = quote_field('regularMarketPreviousClose').fillna(prev)
+    low = np.minimum(low, price)
+    high = np.maximum(high, price)
+    span = (high - low).replace(0, np.nan)
+
+    frame = pd.DataFrame({
+        'price': price,
+        'change_pct': (price / prev_close - 1) * 100,
+        'pos_52w': (price - low) / span * 100,
+        'low_52w': low,
+        'high_52w': high,
+        'pe': quote_field('trailingPE'),
+        'market_cap': quote_field('marketCap'),
+    })
+    frame.index.name = 'symbol'
+    return frame
+
+
+def _format_cap(value):
+    if pd.isna(value):
+        return 'N/A'
+    if value >= 1e12:
+        return f"${value / 1e12:.2f}T"
+    return f"${value / 1e9:.2f}B"
+
+
+def render_comparison_table(frame):
+    """
+    Render the frame as a monospace table for a single Slack message
+    """
+    header = f"{'Symbol':<8}{'Price':>10}{'Chg %':>8}{'52W pos':>9}{'P/E':>8}{'Mkt Cap':>11}"
+    lines = [header, '-' * len(header)]
+    for symbol, row in frame.iterrows():
+        price = 'N/A' if pd.isna(row['price']) else f"{row['price']:.2f}"
+        change = 'N/A' if pd.isna(row['change_pct']) else f"{row['change_pct']:+.2f}"
+        position = 'N/A' if pd.isna(row['pos_52w']) else f"{row['pos_52w']:.0f}%"
+        pe = 'N/A' if pd.isna(row['pe']) else f"{row['pe']:.1f}"
+        lines.append(
+            f"{symbol:<8}{price:>10}{change:>8}{position:>9}{pe:>8}{_format_cap(row['market_cap']):>11}")
+    return "*Comparison*\n```\n" + '\n'.join(lines) + "\n```"
+
+
+def compare_symbols(symbols):
+    closes, highs, lows = download_history(symbols)
+    frame = build_comparison_frame(closes, highs, lows, quotes.fetch_quotes(symbols))
+    return render_comparison_table(frame)
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import logging_setup
+import metrics
+
+
+class EventQueue:
+    """
+    Bounded queue of Slack events served by a pool of background workers.
+
+    Slack expects an ack within 3 seconds and retries the delivery when it
+    doesn't get one, so handlers should only enqueue the event and return.
+    Deliveries are de-duplicated by event_id so retries never reach the
+    workers twice.
+    """
+
+    def __init__(self, handler, workers=4, maxsize=100, put_timeout=0.5, seen_size=10000):
+        self.handler = handler
+        self.workers = workers
+        self.put_timeout = put_timeout
+        self.seen_size = seen_size
+
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+
+        # Metrics
+        self.submitted = 0
+        self.processed = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.retries = 0
+        self.rejected = 0
+        self.requeued = 0
+        self.max_depth = 0
+        self.wait_time = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work, name=f"event-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _remember(self, event_id):
+        """
+        Returns False if the event_id has already been seen
+        """
+        with self._lock:
+            if event_id in self._seen:
+                self._seen.move_to_end(event_id)
+                return False
+            self._seen[event_id] = time.time()
+            if len(self._seen) > self.seen_size:
+                self._seen.popitem(last=False)
+            return True
+
+    def _forget(self, event_id):
+        with self._lock:
+            self._seen.pop(event_id, None)
+
+    def submit(self, payload, retry_num=None):
+        """
+        Enqueue an event payload. Returns True if it was accepted, False if it
+        was dropped as a duplicate or because the queue stayed full.
+        """
+        if not self._threads:
+            self.start()
+
+        if retry_num is not None:
+            with self._lock:
+                self.retries += 1
+
+        event_id = payload.get('event_id')
+        if event_id and not self._remember(event_id):
+            with self._lock:
+                self.duplicates += 1
+            logging.debug(f"Dropping duplicate event {event_id} (retry {retry_num})")
+            return False
+
+        try:
+            # Block briefly so short bursts are absorbed, but never long enough
+            # to blow through Slack's ack deadline
+            self._queue.put((time.time(), payload), timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            if event_id:
+                # Let a later retry of this event through once there is room
+                self._forget(event_id)
+            logging.warning(
+                f"Event queue saturated ({self._queue.qsize()} pending), dropping event {event_id}")
+            return False
+
+        depth = self._queue.qsize()
+        with self._lock:
+            self.submitted += 1
+            self.max_depth = max(self.max_depth, depth)
+        return True
+
+    def requeue(self, payload):
+        """
+        Hand an already accepted event to the workers again, bypassing
+        de-duplication (e.g. once something it was waiting on is ready)
+        """
+        try:
+            self._queue.put((time.time(), payload), timeout=self.put_timeout)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            logging.warning(f"Event queue saturated, dropping requeued event {payload.get('event_id')}")
+            return False
+        with self._lock:
+            self.requeued += 1
+        return True
+
+    def _work(self):
+        while True:
+            enqueued_at, payload = self._queue.get()
+            waited = time.time() - enqueued_at
+            metrics.observe('event.queue_wait', waited)
+            try:
+                with logging_setup.trace(payload.get('event_id')), metrics.stage('event.handle'):
+                    self.handler(payload)
+                with self._lock:
+                    self.processed += 1
+                    self.wait_time += waited
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                    self.wait_time += waited
+                logging.error(f"Error processing event {payload.get('event_id')}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            done = self.processed + self.failed
+            return {
+                'depth': self._queue.qsize(),
+                'max_depth': self.max_depth,
+                'capacity': self._queue.maxsize,
+                'workers': self.workers,
+                'submitted': self.submitted,
+                'processed': self.processed,
+                'failed': self.failed,
+                'duplicates': self.duplicates,
+                'retries': self.retries,
+                'rejected': self.rejected,
+                'requeued': self.requeued,
+                'avg_wait': self.wait_time / done if done else 0.0,
+            }
+
+
+def from_env(handler):
+    return EventQueue(
+        handler,
+        workers=int(os.environ.get('EVENT_WORKERS', 4)),
+        maxsize=int(os.environ.get('EVENT_QUEUE_SIZE', 100)),
+    )
+
+
+class AsyncEventQueue(EventQueue):
+    """
+    EventQueue for an asyncio server: same de-duplication, retry counting
+    and backpressure, but each accepted event runs as a task on the loop
+    (at most `max_in_flight` at once) instead of on a worker thread.
+    """
+
+    def __init__(self, handler, max_in_flight=500, seen_size=10000):
+        super().__init__(handler, workers=0, maxsize=max_in_flight, seen_size=seen_size)
+        self.max_in_flight = max_in_flight
+        self._tasks = set()
+
+    def start(self):
+        pass
+
+    def submit(self, payload, retry_num=None):
+        if retry_num is not None:
+            self.retries += 1
+
+        event_id = payload.get('event_id')
+        if event_id and not self._remember(event_id):
+            self.duplicates += 1
+            logging.debug(f"Dropping duplicate event {event_id} (retry {retry_num})")
+            return False
+
+        if len(self._tasks) >= self.max_in_flight:
+            self.rejected += 1
+            if event_id:
+                self._forget(event_id)
+            logging.warning(f"Too many events in flight ({len(self._tasks)}), dropping event {event_id}")
+            return False
+
+        self.submitted += 1
+        self._spawn(payload)
+        return True
+
+    def requeue(self, payload):
+        # Must be called on the loop (call_soon_threadsafe from other threads)
+        self.requeued += 1
+        self._spawn(payload)
+        return True
+
+    def _spawn(self, payload):
+        task = asyncio.ensure_future(self._run(time.time(), payload))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.max_depth = max(self.max_depth, len(self._tasks))
+
+    async def _run(self, enqueued_at, payload):
+        waited = time.time() - enqueued_at
+        metrics.observe('event.queue_wait', waited)
+        self.wait_time += waited
+        try:
+            with logging_setup.trace(payload.get('event_id')), metrics.stage('event.handle'):
+                await self.handler(payload)
+            self.processed += 1
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Error processing event {payload.get('event_id')}: {e}")
+
+    async def join(self):
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(depth=len(self._tasks), capacity=self.max_in_flight)
+        return stats
+
+
+def from_env_async(handler):
+    return AsyncEventQueue(handler, max_in_flight=int(os.environ.get('ASYNC_MAX_IN_FLIGHT', 500)))
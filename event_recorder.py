@@ -0,0 +1,117 @@
+import atexit
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+
+class EventRecorder:
+    """
+    Appends incoming requests (raw body plus arrival time) to a JSON-lines
+    log so traffic can be replayed later with benchmarks/replay.py.
+
+    Requests are handed to a writer thread, so recording never blocks the
+    ack. Signature headers are not kept; replays are re-signed locally.
+    A path ending in .gz is written gzip-compressed.
+    """
+
+    def __init__(self, path, paths=('/slack/events', '/message-count'), maxsize=10000):
+        self.path = path
+        self.paths = frozenset(paths)
+        self.recorded = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = threading.Thread(target=self._write_loop, name='event-recorder', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _open(self):
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, 'at', encoding='utf-8')
+        return open(self.path, 'a', encoding='utf-8')
+
+    def record(self, path, body, content_type=None, retry_num=None):
+        if path not in self.paths:
+            return
+        entry = {'t': time.time(), 'path': path, 'type': content_type, 'body': body}
+        if retry_num is not None:
+            entry['retry'] = retry_num
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def record_request(self, request):
+        """
+        Record a Flask request; the body stays cached for the real handler
+        """
+        if request.path in self.paths:
+            body = request.get_data(cache=True, as_text=True)
+            self.record(request.path, body, request.content_type, request.headers.get('X-Slack-Retry-Num'))
+
+    def _write_loop(self):
+        with self._open() as f:
+            while True:
+                entry = self._queue.get()
+                if entry is None:
+                    self._queue.task_done()
+                    return
+                try:
+                    f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+                    self.recorded += 1
+                    # Batch writes during bursts, flush once caught up
+                    if self._queue.empty():
+                        f.flush()
+                except (OSError, TypeError, ValueError) as e:
+                    logging.error(f"Error recording request: {e}")
+                finally:
+                    self._queue.task_done()
+
+    def flush(self):
+        """
+        Wait until everything queued so far is written
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Write what is queued and close the file
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+
+    def stats(self):
+        return {
+            'pending': self._queue.qsize(),
+            'recorded': self.recorded,
+            'dropped': self.dropped,
+        }
+
+
+def read_log(path):
+    """
+    Yields the recorded entries in order
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, ValueError):
+            # The tail of a log whose writer didn't shut down cleanly
+            logging.warning(f"Ignoring truncated end of {path}")
+
+
+def from_env():
+    """
+    A recorder writing to EVENT_RECORD_PATH, or None when recording is off
+    """
+    path = os.environ.get('EVENT_RECORD_PATH')
+    if not path:
+        return None
+    return EventRecorder(path)
@@ -0,0 +1,223 @@
+import logging
+import os
+import re
+import threading
+from datetime import date, datetime, timedelta
+
+import lazy_imports
+import market_hours
+
+np = lazy_imports.lazy_import('numpy')
+
+BAR_FIELDS = [
+    ('date', 'datetime64[D]'),
+    ('open', 'f8'),
+    ('high', 'f8'),
+    ('low', 'f8'),
+    ('close', 'f8'),
+    ('volume', 'f8'),
+]
+
+
+def empty_bars(size=0):
+    return np.empty(size, dtype=BAR_FIELDS)
+
+
+def last_complete_session(now=None):
+    """
+    Date of the most recent session whose daily bar is final
+    """
+    now = datetime.now(market_hours.EXCHANGE_TZ) if now is None else now.astimezone(market_hours.EXCHANGE_TZ)
+    day = now.date()
+    if now.weekday() >= 5 or now.time() < market_hours.CLOSE_TIME:
+        day -= timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+
+def bars_from_frame(hist):
+    """
+    Convert a yfinance history DataFrame into an array of BAR_FIELDS
+    """
+    bars = empty_bars(len(hist))
+    if not len(hist):
+        return bars
+    index = hist.index
+    if getattr(index, 'tz', None) is not None:
+        index = index.tz_localize(None)
+    bars['date'] = index.values.astype('datetime64[D]')
+    for column in ('Open', 'High', 'Low', 'Close', 'Volume'):
+        bars[column.lower()] = hist[column].to_numpy(dtype='f8')
+    return bars
+
+
+class HistoryStore:
+    """
+    Local store of daily bars, one memory-mappable .npy file per symbol.
+    Updates only download the bars missing since the last stored session.
+
+    last_complete_session() doesn't know exchange holidays, so a holiday
+    looks like a missing bar. Downloads start at the last stored bar, so one
+    that worked is never empty; when it brings nothing newer the missing
+    session was a holiday, and it is recorded as covered so it isn't asked
+    for again. yfinance reports a failed download as an empty frame, which
+    covers nothing, and a symbol with no stored bars is never marked.
+    """
+
+    def __init__(self, root, max_bars=5 * 252, initial_days=365):
+        self.root = root
+        self.max_bars = max_bars
+        self.initial_days = initial_days
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._checked = {}  # symbol -> last session a download covered
+        os.makedirs(root, exist_ok=True)
+
+    def _lock(self, symbol):
+        with self._locks_lock:
+            return self._locks.setdefault(symbol, threading.Lock())
+
+    def path(self, symbol):
+        return os.path.join(self.root, re.sub(r'[^A-Z0-9.^-]', '_', symbol.upper()) + '.npy')
+
+    def load(self, symbol):
+        path = self.path(symbol)
+        if not os.path.exists(path):
+            return empty_bars()
+        try:
+            return np.load(path, mmap_mode='r')
+        except (OSError, ValueError) as e:
+            logging.error(f"Error loading history for {symbol}: {e}")
+            return empty_bars()
+
+    def _save(self, symbol, bars):
+        path = self.path(symbol)
+        tmp_path = f'{path}.tmp.npy'
+        np.save(tmp_path, bars)
+        os.replace(tmp_path, path)
+
+    def _mark_checked(self, symbol, through):
+        self._checked[symbol.upper()] = through
+
+    def append(self, symbol, new_bars, through=None):
+        """
+        Append bars newer than the last stored one, dropping any after
+        `through` (e.g. today's still-forming bar). A non-empty download for
+        a symbol with stored bars is noted as covering `through`.
+        """
+        with self._lock(symbol):
+            bars = self.load(symbol)
+            if through is not None and len(bars) and len(new_bars):
+                self._mark_checked(symbol, through)
+            if through is not None:
+                new_bars = new_bars[new_bars['date'] <= np.datetime64(through, 'D')]
+            if len(bars):
+                new_bars = new_bars[new_bars['date'] > bars['date'][-1]]
+            if not len(new_bars):
+                return bars
+            combined = np.concatenate([np.asarray(bars), new_bars])[-self.max_bars:]
+            self._save(symbol, combined)
+            return self.load(symbol)
+
+    def missing_since(self, symbol, now=None):
+        """
+        Returns the first date that needs downloading, or None if up to date
+        """
+        through = last_complete_session(now)
+        checked = self._checked.get(symbol.upper())
+        if checked is not None and checked >= through:
+            return None
+        bars = self.load(symbol)
+        if not len(bars):
+            return through - timedelta(days=self.initial_days)
+        last = bars['date'][-1].astype(date)
+        if last >= through:
+            return None
+        return last + timedelta(days=1)
+
+    def update(self, symbol, now=None):
+        """
+        Download whatever bars are missing for `symbol` and append them
+        """
+        start = self.missing_since(symbol, now)
+        if start is None:
+            return self.load(symbol)
+
+        import yfinance as yf
+
+        through = last_complete_session(now)
+        # From the last stored bar (the day before `start`), so a download
+        # that worked is never empty
+        hist = yf.Ticker(symbol).history(start=start - timedelta(days=1), end=through + timedelta(days=1))
+        return self.append(symbol, bars_from_frame(hist), through=through)
+
+    def update_many(self, symbols, now=None):
+        """
+        update() for several symbols with a single batched download from the
+        earliest missing date. Returns the symbols that needed new bars.
+        """
+        starts = {symbol: self.missing_since(symbol, now) for symbol in symbols}
+        stale = [symbol for symbol, start in starts.items() if start is not None]
+        if not stale:
+            return []
+        if len(stale) == 1:
+            self.update(stale[0], now)
+            return stale
+
+        import yfinance as yf
+
+        through = last_complete_session(now)
+        data = yf.download(
+            stale, start=min(starts[s] for s in stale) - timedelta(days=1), end=through + timedelta(days=1),
+            group_by='column', progress=False, auto_adjust=False)
+        if data.empty:
+            # The download failed; the stored bars would have come back otherwise
+            logging.warning(f"History download for {len(stale)} symbols came back empty")
+            return stale
+        for symbol in stale:
+            try:
+                hist = data.xs(symbol, axis=1, level=1).dropna(how='all')
+            except KeyError:
+                continue
+            self.append(symbol, bars_from_frame(hist), through=through)
+        return stale
+
+    def window(self, symbol, days=365, today=None):
+        bars = self.load(symbol)
+        if not len(bars):
+            return bars
+        since = np.datetime64((today or date.today()) - timedelta(days=days), 'D')
+        start = int(np.searchsorted(bars['date'], since, side='left'))
+        return bars[start:]
+
+    def window_stats(self, symbol, days=365, today=None):
+        """
+        Low/high/return over the trailing `days`, or None with no data
+        """
+        bars = self.window(symbol, days, today)
+        if not len(bars):
+            return None
+        first_close = float(bars['close'][0])
+        last_close = float(bars['close'][-1])
+        return {
+            'low': round(float(bars['low'].min()), 2),
+            'high': round(float(bars['high'].max()), 2),
+            'first_close': first_close,
+            'last_close': last_close,
+            'change': (last_close / first_close - 1) if first_close else None,
+            'avg_volume': float(bars['volume'].mean()),
+            'bars': len(bars),
+        }
+
+    def range_52w(self, symbol, refresh=True):
+        if refresh:
+            self.update(symbol)
+        stats = self.window_stats(symbol, days=365)
+        if stats is None:
+            return None, None
+        return stats['low'], stats['high']
+
+
+def from_env():
+    return HistoryStore(os.environ.get('HISTORY_STORE_PATH', 'history'))
@@ -0,0 +1,307 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+DEFAULT_HEADERS = {'User-Agent': 'Mozilla/5.0'}
+
+
+class TokenBucket:
+    """
+    Allows `rate` requests per second on average with bursts up to `burst`
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token, returning how long the caller must wait before using it
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def try_take(self, n=1):
+        """
+        Take `n` tokens if they are available right now, without waiting
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < n:
+                return False
+            self.tokens -= n
+            return True
+
+    def refund(self, n=1):
+        """
+        Give back tokens taken with try_take() that went unused
+        """
+        with self.lock:
+            self.tokens = min(self.burst, self.tokens + n)
+
+    def wait_time(self, n=1):
+        """
+        Seconds until `n` tokens are available, without taking any
+        """
+        with self.lock:
+            tokens = min(self.burst, self.tokens + (time.monotonic() - self.updated) * self.rate)
+            return max(0.0, (n - tokens) / self.rate)
+
+    def _reserve_before(self, deadline):
+        delay = self.reserve()
+        if delay > 0 and deadline is not None and time.monotonic() + delay > deadline:
+            self.refund()
+            return None
+        return delay
+
+    def acquire(self, deadline=None):
+        """
+        Wait for a token and return how long that took, or None, without
+        waiting or taking one, when the wait would run past `deadline`
+        """
+        delay = self._reserve_before(deadline)
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self, deadline=None):
+        delay = self._reserve_before(deadline)
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+
+class HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.throttled = 0
+        self.gave_up = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'retries': self.retries,
+            'throttled': self.throttled,
+            'gave_up': self.gave_up,
+            'avg_latency': self.latency_total / self.requests if self.requests else 0.0,
+            'max_latency': self.latency_max,
+        }
+
+
+def retry_after_seconds(response):
+    """
+    Parse a Retry-After header given either in seconds or as an HTTP date
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, response=None, deadline=None, base=0.5, maximum=10.0):
+    """
+    Seconds to wait before retry number `attempt`, or None to give up.
+    A server's Retry-After is honoured in full: when it runs past `deadline`
+    (a time.monotonic() value), or past `maximum` without one, retrying
+    sooner would only be refused again.
+    """
+    remaining = None if deadline is None else deadline - time.monotonic()
+    retry_after = retry_after_seconds(response) if response is not None else None
+    if retry_after is not None:
+        limit = maximum if remaining is None else remaining
+        return retry_after if retry_after <= limit else None
+    # Full jitter keeps clients that failed together from retrying together
+    delay = random.uniform(0, min(maximum, base * 2 ** attempt))
+    if remaining is not None and delay >= remaining:
+        return None
+    return delay
+
+
+def attempt_timeout(timeout, deadline):
+    """
+    The timeout for one attempt: `timeout`, cut short by `deadline`
+    """
+    if deadline is None:
+        return timeout
+    return max(0.01, min(timeout, deadline - time.monotonic()))
+
+
+class HttpClient:
+    """
+    Pooled keep-alive HTTP client shared by every upstream fetch, with
+    timeouts, jittered exponential backoff on 429/5xx and a token bucket
+    per host. Callers with a time budget pass `deadline` (a time.monotonic()
+    value): attempts are cut short by it, no retry starts past it, and a
+    request the host's bucket would hold past it fails at once with
+    requests.Timeout.
+    """
+
+    def __init__(self, timeout=5.0, max_retries=3, backoff_base=0.5, backoff_max=10.0,
+                 rate=10.0, burst=20, host_limits=None, pool_size=20):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate = rate
+        self.burst = burst
+        self.host_limits = dict(host_limits or {})
+
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._buckets = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host):
+        with self._lock:
+            if host not in self._buckets:
+                rate, burst = self.host_limits.get(host, (self.rate, self.burst))
+                self._buckets[host] = TokenBucket(rate, burst)
+                self._stats[host] = HostStats()
+            return self._buckets[host], self._stats[host]
+
+    def _backoff(self, attempt, response=None, deadline=None):
+        return backoff_delay(attempt, response, deadline, self.backoff_base, self.backoff_max)
+
+    def request(self, method, url, timeout=None, deadline=None, **kwargs):
+        host = urlsplit(url).netloc
+        bucket, stats = self._host(host)
+        timeout = self.timeout if timeout is None else timeout
+
+        attempt = 0
+        while True:
+            waited = bucket.acquire(deadline)
+            if waited is None:
+                with self._lock:
+                    stats.gave_up += 1
+                raise requests.Timeout(f"{host} rate limit would hold the request past its deadline")
+            if waited > 0:
+                with self._lock:
+                    stats.throttled += 1
+
+            started = time.monotonic()
+            response = None
+            error = None
+            try:
+                response = self.session.request(
+                    method, url, timeout=attempt_timeout(timeout, deadline), **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            elapsed = time.monotonic() - started
+
+            with self._lock:
+                stats.requests += 1
+                stats.latency_total += elapsed
+                stats.latency_max = max(stats.latency_max, elapsed)
+                if error is not None or response.status_code >= 400:
+                    stats.errors += 1
+
+            retryable = error is not None or response.status_code in RETRY_STATUSES
+            delay = self._backoff(attempt, response, deadline) if retryable and attempt < self.max_retries else None
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response
+
+            logging.warning(
+                f"Retrying {method} {host} in {delay:.2f}s "
+                f"({error or response.status_code}, attempt {attempt + 1})")
+            with self._lock:
+                stats.retries += 1
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            return {host: stats.as_dict() for host, stats in self._stats.items()}
+
+
+def parse_host_limits(value):
+    """
+    Parse "query1.finance.yahoo.com=5/10,www.marketwatch.com=1/2" into
+    {host: (rate per second, burst)}
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        host, _, limit = item.partition('=')
+        rate, _, burst = limit.partition('/')
+        limits[host.strip()] = (float(rate), int(burst or max(1, float(rate))))
+    return limits
+
+
+# Yahoo's query hosts serve the search, quote and timeseries calls of every
+# lookup (close to three per message), so they get more than HTTP_RATE.
+# HTTP_HOST_LIMITS entries take precedence.
+DEFAULT_HOST_LIMITS = {
+    'query1.finance.yahoo.com': (50.0, 100),
+    'query2.finance.yahoo.com': (50.0, 100),
+}
+
+
+def host_limits_from_env():
+    return dict(DEFAULT_HOST_LIMITS, **parse_host_limits(os.environ.get('HTTP_HOST_LIMITS', '')))
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared():
+    """
+    The process-wide client, created from the environment on first use
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = HttpClient(
+                timeout=float(os.environ.get('HTTP_TIMEOUT', 5)),
+                max_retries=int(os.environ.get('HTTP_MAX_RETRIES', 3)),
+                rate=float(os.environ.get('HTTP_RATE', 10)),
+                burst=int(os.environ.get('HTTP_BURST', 20)),
+                host_limits=host_limits_from_env(),
+                pool_size=int(os.environ.get('HTTP_POOL_SIZE', 20)),
+            )
+        return _shared
@@ -0,0 +1,64 @@
+import importlib
+import logging
+import threading
+import time
+
+
+class LazyModule:
+    """
+    Stands in for a module and imports it on first attribute access, so
+    heavy libraries (pandas, yfinance, ...) stay out of the startup path
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = importlib.import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f"<lazy module '{self.__dict__['_name']}' ({state})>"
+
+
+def lazy_import(name):
+    return LazyModule(name)
+
+
+def warm(names):
+    """
+    Import modules so the first request doesn't pay for it
+    """
+    for name in names:
+        started = time.perf_counter()
+        try:
+            importlib.import_module(name)
+            logging.debug(f"Warmed {name} in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            logging.error(f"Error warming {name}: {e}")
+
+
+def warm_in_background(names, delay=0.0):
+    """
+    Warm modules on a daemon thread, optionally after a short delay so the
+    server can start listening first
+    """
+    def run():
+        if delay:
+            time.sleep(delay)
+        warm(names)
+
+    thread = threading.Thread(target=run, name='warm-imports', daemon=True)
+    thread.start()
+    return thread
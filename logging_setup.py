@@ -0,0 +1,238 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+_trace_id = contextvars.ContextVar('trace_id', default=None)
+
+TEXT_FORMAT = '%(levelname)s:%(name)s:%(message)s'
+
+# Handlers installed by configure(), for stats()
+_installed = {}
+
+
+class trace:
+    """
+    Tags every record logged inside the block with a trace id (the Slack
+    event_id for an event), so the stages of one lookup can be pulled out of
+    the log together. Tasks started inside the block inherit it; worker
+    threads do when the work is handed over with submit().
+    """
+
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self._token = None
+
+    def __enter__(self):
+        self._token = _trace_id.set(self.trace_id)
+        return self.trace_id
+
+    def __exit__(self, *exc):
+        _trace_id.reset(self._token)
+
+
+def current_trace():
+    return _trace_id.get()
+
+
+def submit(executor, fn, *args):
+    """
+    executor.submit(fn, *args), carrying the caller's trace id over to the
+    worker thread
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+class TraceFilter(logging.Filter):
+    """
+    Stamps records with the current trace id. It runs on the logging
+    thread, before the record is queued, while the caller's context is
+    still current.
+    """
+
+    def filter(self, record):
+        record.trace_id = _trace_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through at most `rate` records per second from each configured
+    logger (children included); the rest are dropped before they cost any
+    formatting or I/O. Warnings and errors always get through.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        # Longest prefix first, so 'slack.web' wins over 'slack'
+        self.rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+        self.sampled_out = 0
+        self._rules = {}
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def _rule(self, name):
+        rule = self._rules.get(name, False)
+        if rule is False:
+            rule = None
+            for prefix, rate in self.rates:
+                if name == prefix or name.startswith(prefix + '.'):
+                    rule = (prefix, rate)
+                    break
+            self._rules[name] = rule
+        return rule
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rule = self._rule(record.name)
+        if rule is None:
+            return True
+        prefix, rate = rule
+        second = int(time.monotonic())
+        with self._lock:
+            window = self._windows.get(prefix)
+            if window is None or window[0] != second:
+                window = self._windows[prefix] = [second, 0]
+            window[1] += 1
+            if window[1] <= rate:
+                return True
+            self.sampled_out += 1
+            return False
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line
+    """
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'thread': record.threadName,
+        }
+        trace_id = getattr(record, 'trace_id', None)
+        if trace_id:
+            entry['trace_id'] = trace_id
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to a QueueListener thread without waiting: when the
+    queue is full the record is dropped and counted rather than stalling
+    the request that logged it
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.queued = 0
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The listener is in-process, so the record doesn't need to be made
+        # picklable; formatting the message is left to the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            self.queued += 1
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_levels(value):
+    """
+    'slack=WARNING,urllib3=INFO' -> {'slack': 'WARNING', 'urllib3': 'INFO'}
+    """
+    levels = {}
+    for item in value.split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def parse_rates(value):
+    """
+    'slack=10,urllib3=5' -> {'slack': 10, 'urllib3': 5} records/second
+    """
+    return {name: int(rate) for name, rate in parse_levels(value).items()}
+
+
+def configure(mode='text', level='DEBUG', levels=None, sample=None, queue_size=10000, stream=None):
+    """
+    Install the root handler. 'text' writes plain lines from the logging
+    thread, as before; 'json' queues records for a background thread that
+    writes them as JSON.
+    """
+    shutdown()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level)
+    for name, logger_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if mode == 'json':
+        output.setFormatter(JsonFormatter())
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+        listener = logging.handlers.QueueListener(handler.queue, output)
+        listener.start()
+        _installed['listener'] = listener
+    else:
+        output.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handler = output
+
+    sampler = SamplingFilter(sample or {})
+    handler.addFilter(sampler)
+    handler.addFilter(TraceFilter())
+    root.addHandler(handler)
+    _installed.update(handler=handler, sampler=sampler)
+    return handler
+
+
+@atexit.register
+def shutdown():
+    """
+    Flush and stop the background writer, if there is one
+    """
+    listener = _installed.pop('listener', None)
+    if listener:
+        listener.stop()
+
+
+def stats():
+    handler = _installed.get('handler')
+    sampler = _installed.get('sampler')
+    return {
+        'queued': getattr(handler, 'queued', 0),
+        'dropped': getattr(handler, 'dropped', 0),
+        'backlog': handler.queue.qsize() if hasattr(handler, 'queue') else 0,
+        'sampled_out': sampler.sampled_out if sampler else 0,
+    }
+
+
+def from_env():
+    return configure(
+        mode=os.environ.get('LOG_MODE', 'text'),
+        level=os.environ.get('LOG_LEVEL', 'DEBUG').upper(),
+        levels=parse_levels(os.environ.get('LOG_LEVELS', '')),
+        sample=parse_rates(os.environ.get('LOG_SAMPLE', 'slack=10,urllib3=10,yfinance=10')),
+        queue_size=int(os.environ.get('LOG_QUEUE_SIZE', 10000)),
+    )
@@ -0,0 +1,60 @@
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+# Regular NYSE/Nasdaq session. Exchange holidays aren't modelled; on those
+# days the cache just refreshes more often than it needs to.
+EXCHANGE_TZ = ZoneInfo('America/New_York')
+OPEN_TIME = time(9, 30)
+CLOSE_TIME = time(16, 0)
+
+
+def _local(now=None):
+    if now is None:
+        return datetime.now(EXCHANGE_TZ)
+    if now.tzinfo is None:
+        now = now.astimezone()
+    return now.astimezone(EXCHANGE_TZ)
+
+
+def is_open(now=None):
+    now = _local(now)
+    return now.weekday() < 5 and OPEN_TIME <= now.time() < CLOSE_TIME
+
+
+def next_open(now=None):
+    """
+    The next regular session open strictly after `now`
+    """
+    now = _local(now)
+    day = now.date()
+    if now.time() >= OPEN_TIME:
+        day += timedelta(days=1)
+    while day.weekday() >= 5:
+        day += timedelta(days=1)
+    return datetime.combine(day, OPEN_TIME, tzinfo=EXCHANGE_TZ)
+
+
+def session(now=None):
+    """
+    'open', 'closed' (weekday outside regular hours) or 'weekend'
+    """
+    now = _local(now)
+    if now.weekday() >= 5:
+        return 'weekend'
+    return 'open' if is_open(now) else 'closed'
+
+
+def seconds_until_open(now=None):
+    now = _local(now)
+    return (next_open(now) - now).total_seconds()
+
+
+def quote_ttl(now=None, open_ttl=5.0, min_closed_ttl=60.0):
+    """
+    How long a quote snapshot stays fresh: a few seconds while the market is
+    trading, otherwise until the next open
+    """
+    now = _local(now)
+    if is_open(now):
+        return open_ttl
+    return max(min_closed_ttl, seconds_until_open(now))
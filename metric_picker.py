@@ -0,0 +1,195 @@
+import os
+import time
+
+import http_client
+import snapshot_cache
+
+TIMESERIES_URL = 'https://query2.finance.yahoo.com/ws/fundamentals-timeseries/v1/finance/timeseries'
+
+# Action ids carry what was picked: select_company_<symbol>, query_<metric>_<symbol>
+SELECT_COMPANY = 'select_company_'
+QUERY = 'query_'
+
+# Annual figures shown under the trailing twelve months
+YEARS = 3
+
+
+class Metric:
+    """
+    A button in the metric picker and the one Yahoo fundamentals series it
+    needs, fetched as its trailing-twelve-month and annual values
+    """
+
+    __slots__ = ('name', 'label', 'series')
+
+    def __init__(self, name, label, series):
+        self.name = name
+        self.label = label
+        self.series = series
+
+    @property
+    def types(self):
+        return [f'trailing{self.series}', f'annual{self.series}']
+
+
+METRICS = {metric.name: metric for metric in [
+    Metric('profit', 'Profit', 'NetIncome'),
+    Metric('revenue', 'Revenue', 'TotalRevenue'),
+]}
+
+
+def _button(text, value, action_id):
+    return {
+        'type': 'button',
+        'text': {'type': 'plain_text', 'text': text[:75]},
+        'value': value,
+        'action_id': action_id,
+    }
+
+
+def _section(text):
+    return {'type': 'section', 'text': {'type': 'mrkdwn', 'text': text}}
+
+
+def _company(symbol, name):
+    return f"{name} ({symbol})" if name else symbol
+
+
+def company_picker(symbols, name_for=lambda symbol: None):
+    """
+    Message kwargs with one button per symbol
+    """
+    text = "Please type a company name to get financial information, or pick one:"
+    buttons = []
+    for symbol in symbols:
+        name = name_for(symbol)
+        buttons.append(_button(_company(symbol, name), symbol, f"{SELECT_COMPANY}{symbol}"))
+    return {'text': text, 'blocks': [_section(text), {'type': 'actions', 'elements': buttons}]}
+
+
+def metric_picker(symbol, name=None):
+    """
+    Message kwargs with one button per metric for `symbol`
+    """
+    text = f"Choose a financial metric to query for {_company(symbol, name)}:"
+    buttons = [
+        _button(metric.label, f"{symbol}_{metric.name}", f"{QUERY}{metric.name}_{symbol}")
+        for metric in METRICS.values()
+    ]
+    return {'text': text, 'blocks': [_section(text), {'type': 'actions', 'elements': buttons}]}
+
+
+def parse_action(action):
+    """
+    (symbol, None) for a company button, (symbol, metric name) for a
+    metric button, None for anything else
+    """
+    action_id = action.get('action_id') or ''
+    value = action.get('value') or ''
+    if action_id.startswith(SELECT_COMPANY) and value:
+        return value.upper(), None
+    if action_id.startswith(QUERY):
+        symbol, _, metric = value.rpartition('_')
+        if symbol and metric in METRICS:
+            return symbol.upper(), metric
+    return None
+
+
+def cache_key(symbol, metric):
+    return f"{symbol.upper()}:{metric}"
+
+
+def _timeseries_request(symbol, metric, now=None):
+    now = int(time.time() if now is None else now)
+    return {
+        'url': f"{os.environ.get('YAHOO_TIMESERIES_URL', TIMESERIES_URL)}/{symbol}",
+        'params': {
+            'symbol': symbol,
+            'type': ','.join(metric.types),
+            # Enough history for YEARS annual reports
+            'period1': now - (YEARS + 1) * 366 * 24 * 3600,
+            'period2': now,
+        },
+        'timeout': float(os.environ.get('TIMESERIES_HTTP_TIMEOUT', 5)),
+    }
+
+
+def parse_timeseries(data, metric):
+    """
+    {'ttm': (as_of, value) or None, 'annual': [(as_of, value), ...] newest
+    first}, or None when Yahoo has no figures for the metric
+    """
+    series = {}
+    for result in (data.get('timeseries') or {}).get('result') or []:
+        for kind in (result.get('meta') or {}).get('type') or []:
+            points = [
+                (point['asOfDate'], point['reportedValue']['raw'])
+                for point in result.get(kind) or []
+                if point and (point.get('reportedValue') or {}).get('raw') is not None
+            ]
+            series[kind] = sorted(points, reverse=True)
+
+    trailing, annual = metric.types
+    ttm = series.get(trailing) or []
+    years = series.get(annual) or []
+    if not ttm and not years:
+        return None
+    return {'ttm': ttm[0] if ttm else None, 'annual': years[:YEARS]}
+
+
+def fetch_metric(symbol, metric):
+    """
+    Only the series `metric` needs, in one request, rather than the whole
+    info payload
+    """
+    response = http_client.shared().get(**_timeseries_request(symbol, metric))
+    response.raise_for_status()
+    return parse_timeseries(response.json(), metric)
+
+
+def _amount(value):
+    sign = '-' if value < 0 else ''
+    value = abs(value)
+    if value >= 1e9:
+        return f"{sign}${value / 1e9:.2f}B"
+    if value >= 1e6:
+        return f"{sign}${value / 1e6:.2f}M"
+    return f"{sign}${value:,.0f}"
+
+
+def render_metric(symbol, metric, figures, name=None):
+    """
+    Message kwargs for the figures returned by fetch_metric
+    """
+    title = f"*{metric.label} for {_company(symbol, name)}*"
+    if figures is None:
+        return {'text': f"{title}\nNo {metric.label.lower()} figures are available for {symbol}."}
+
+    lines = [title]
+    if figures['ttm']:
+        as_of, value = figures['ttm']
+        lines.append(f"• TTM (to {as_of}): {_amount(value)}")
+    annual = figures['annual']
+    for i, (as_of, value) in enumerate(annual):
+        line = f"• FY {as_of[:4]}: {_amount(value)}"
+        previous = annual[i + 1][1] if i + 1 < len(annual) else None
+        if previous:
+            line += f" ({(value - previous) / abs(previous) * 100:+.1f}% YoY)"
+        lines.append(line)
+    return {'text': '\n'.join(lines)}
+
+
+def _fetch_key(key):
+    symbol, _, metric = key.rpartition(':')
+    return fetch_metric(symbol, METRICS[metric.lower()])
+
+
+def from_env():
+    """
+    Cache of metric figures by cache_key(). They change with quarterly
+    reports, so entries live for hours rather than following the session.
+    """
+    ttl = float(os.environ.get('METRIC_CACHE_TTL', 6 * 3600))
+    return snapshot_cache.SnapshotCache(
+        _fetch_key, ttl=lambda: ttl, max_size=int(os.environ.get('METRIC_CACHE_SIZE', 2000)),
+        negative_ttl=float(os.environ.get('METRIC_CACHE_NEGATIVE_TTL', 300)))
@@ -0,0 +1,243 @@
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+
+# Latency buckets in seconds, from cache hits up to slow upstream scrapes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. Observing costs one bisect and a few additions
+    under a lock; buckets are only made cumulative when rendered.
+    """
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((labels, (list(s[0]), s[1], s[2])) for labels, s in self._series.items())
+        names = self.labelnames + ('le',)
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                label_text = _format_labels(names, labels + (_format_value(bound),))
+                lines.append(f'{self.name}_bucket{label_text} {cumulative}')
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_text} {_format_value(total)}')
+            lines.append(f'{self.name}_count{label_text} {count}')
+        return lines
+
+
+class StatsCollector:
+    """
+    Exposes an existing stats() dict as gauges named {prefix}_{field}.
+    Nested dicts become a label; with `by`, the top-level keys are the
+    label (e.g. {host: {...}}).
+    """
+
+    def __init__(self, prefix, stats_fn, by=None, label='name'):
+        self.prefix = prefix
+        self.stats_fn = stats_fn
+        self.by = by
+        self.label = label
+
+    def _samples(self):
+        stats = self.stats_fn()
+        if self.by:
+            for key, fields in stats.items():
+                for field, value in fields.items():
+                    yield field, ((self.by, key),), value
+            return
+        for field, value in stats.items():
+            if isinstance(value, dict):
+                for key, sub_value in value.items():
+                    yield field, ((self.label, key),), sub_value
+            else:
+                yield field, (), value
+
+    def render(self):
+        grouped = {}
+        for field, labels, value in self._samples():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                grouped.setdefault(f'{self.prefix}_{field}', []).append((labels, value))
+        lines = []
+        for name, samples in sorted(grouped.items()):
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in samples:
+                names = tuple(label for label, _ in labels)
+                values = tuple(value for _, value in labels)
+                lines.append(f'{name}{_format_labels(names, values)} {_format_value(value)}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def add_stats(self, prefix, stats_fn, by=None, label='name'):
+        return self.register(StatsCollector(prefix, stats_fn, by, label))
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'slackbot_stage_duration_seconds', 'Time spent in each stage of the lookup pipeline', ('stage',))
+STAGE_TOTAL = REGISTRY.counter(
+    'slackbot_stage_total', 'Completed stages by outcome (ok, empty or error)', ('stage', 'outcome'))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class stage:
+    """
+    Times a block as one pipeline stage:
+
+        with metrics.stage('yfinance.info'):
+            info = ticker.info
+
+    The outcome is 'error' if the block raises, otherwise whatever was set
+    on the timer (default 'ok').
+    """
+
+    __slots__ = ('name', 'outcome', 'started')
+
+    def __init__(self, name):
+        self.name = name
+        self.outcome = 'ok'
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_SECONDS.observe(time.perf_counter() - self.started, self.name)
+        STAGE_TOTAL.inc(self.name, 'error' if exc_type else self.outcome)
+        return False
+
+
+def observe(name, seconds, outcome='ok'):
+    """
+    Record a stage that was timed elsewhere
+    """
+    STAGE_SECONDS.observe(seconds, name)
+    STAGE_TOTAL.inc(name, outcome)
+
+
+def timed(name):
+    """
+    Decorator form of `stage`; a None result counts as 'empty'
+    """
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name) as timer:
+                    result = await fn(*args, **kwargs)
+                    if result is None:
+                        timer.outcome = 'empty'
+                    return result
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name) as timer:
+                result = fn(*args, **kwargs)
+                if result is None:
+                    timer.outcome = 'empty'
+                return result
+        return wrapper
+    return decorator
+
+
+def render():
+    return REGISTRY.render()
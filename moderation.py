@@ -0,0 +1,158 @@
+import logging
+import os
+import string
+import threading
+import time
+
+# Common character substitutions used to dodge filters
+LEETSPEAK = {
+    '0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't',
+    '@': 'a', '$': 's',
+}
+
+
+def build_translation(leetspeak=True):
+    """
+    One translate table that maps leetspeak and strips punctuation, so
+    normalizing a message is a single str.translate pass
+    """
+    table = {ord(c): None for c in string.punctuation}
+    if leetspeak:
+        table.update({ord(k): v for k, v in LEETSPEAK.items()})
+    return table
+
+
+class Automaton:
+    """
+    Aho-Corasick automaton over a fixed word list. Scanning a message costs
+    O(message length + matches) no matter how many words there are.
+    """
+
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+
+        for word in words:
+            state = 0
+            for char in word:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(())
+                state = next_state
+            self.output[state] = self.output[state] + (word,)
+
+        # Breadth-first pass to fill in failure links
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def scan(self, text):
+        """
+        Yields (end index, word) for every occurrence in text
+        """
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for word in output[state]:
+                yield i, word
+
+
+class ModerationEngine:
+    """
+    Checks messages against a word list compiled once into an Aho-Corasick
+    automaton. The list can come from a file, which is reloaded when it
+    changes.
+    """
+
+    def __init__(self, words=(), path=None, word_boundary=True, leetspeak=True, reload_interval=30.0):
+        self.default_words = list(words)
+        self.path = path
+        self.word_boundary = word_boundary
+        self.reload_interval = reload_interval
+        self._table = build_translation(leetspeak)
+        self._loaded_mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def _read_words(self):
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as f:
+                return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        return self.default_words
+
+    def normalize(self, text):
+        return text.lower().translate(self._table)
+
+    def reload(self):
+        """
+        Rebuild the automaton from the word list and swap it in
+        """
+        with self._lock:
+            words = {self.normalize(word) for word in self._read_words()}
+            words.discard('')
+            self.automaton = Automaton(sorted(words))
+            self.size = len(words)
+            if self.path and os.path.exists(self.path):
+                self._loaded_mtime = os.path.getmtime(self.path)
+            self._checked_at = time.monotonic()
+        logging.info(f"Loaded moderation list with {self.size} entries")
+
+    def maybe_reload(self):
+        """
+        Reload if the word list file changed, checking at most once per
+        reload_interval
+        """
+        if not self.path or time.monotonic() - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = time.monotonic()
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime != self._loaded_mtime:
+            self.reload()
+
+    def find(self, message):
+        """
+        Returns the listed words found in the message
+        """
+        self.maybe_reload()
+        text = self.normalize(message)
+        found = []
+        for end, word in self.automaton.scan(text):
+            if self.word_boundary:
+                start = end - len(word) + 1
+                if start > 0 and text[start - 1].isalnum():
+                    continue
+                if end + 1 < len(text) and text[end + 1].isalnum():
+                    continue
+            found.append(word)
+        return found
+
+    def check(self, message):
+        return bool(self.find(message))
+
+
+def from_env(default_words):
+    return ModerationEngine(
+        default_words,
+        path=os.environ.get('BAD_WORDS_PATH'),
+        word_boundary=os.environ.get('MODERATION_WORD_BOUNDARY', '1') == '1',
+        leetspeak=os.environ.get('MODERATION_LEETSPEAK', '1') == '1',
+    )
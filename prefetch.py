@@ -0,0 +1,224 @@
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+
+import market_hours
+import metrics
+import quotes
+from http_client import TokenBucket
+
+
+class PopularityTracker:
+    """
+    Exponentially decayed request counts per symbol: a request made
+    `half_life` seconds ago counts half as much as one made now
+    """
+
+    def __init__(self, half_life=6 * 3600, max_symbols=1000):
+        self.half_life = half_life
+        self.max_symbols = max_symbols
+        self._scores = {}
+        self._epoch = time.time()
+        self._lock = threading.Lock()
+
+    def _weight(self, now):
+        return 2 ** ((now - self._epoch) / self.half_life)
+
+    def record(self, symbol, now=None):
+        now = time.time() if now is None else now
+        symbol = symbol.upper()
+        with self._lock:
+            weight = self._weight(now)
+            if weight > 1e100:
+                # Rebase before the weights overflow
+                self._scores = {s: score / weight for s, score in self._scores.items()}
+                self._epoch = now
+                weight = 1.0
+            self._scores[symbol] = self._scores.get(symbol, 0.0) + weight
+            if len(self._scores) > self.max_symbols * 1.25:
+                keep = heapq.nlargest(self.max_symbols, self._scores.items(), key=lambda item: item[1])
+                self._scores = dict(keep)
+
+    def score(self, symbol, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._scores.get(symbol.upper(), 0.0) / self._weight(now)
+
+    def top(self, n):
+        with self._lock:
+            return heapq.nlargest(n, self._scores, key=self._scores.get)
+
+    def __len__(self):
+        return len(self._scores)
+
+
+class Prefetcher:
+    """
+    Keeps the company data of the most requested symbols hot. From `lead`
+    seconds before the open until the close it refreshes the top N ahead of
+    their cache entries expiring: quotes in one batched request, daily
+    history in one batched download, and a full fetch only for symbols
+    that aren't cached at all. Upstream requests are capped at `budget`
+    per minute.
+    """
+
+    def __init__(self, cache, history, top_n=20, budget=60, interval=4.0, lead=900.0, tracker=None):
+        self.cache = cache
+        self.history = history
+        self.top_n = top_n
+        self.interval = interval
+        self.lead = lead
+        self.tracker = tracker or PopularityTracker()
+        self._budget = TokenBucket(budget / 60.0, max(1, budget))
+        self._stop = threading.Event()
+        self._thread = None
+        self._session = None
+
+        self.ticks = 0
+        self.refreshed = 0
+        self.cold_fetched = 0
+        self.history_updated = 0
+        self.requests = 0
+        self.over_budget = 0
+        self.errors = 0
+        self.last_run_seconds = 0.0
+
+    def record(self, symbol):
+        self.tracker.record(symbol)
+
+    def active(self, now=None):
+        return market_hours.is_open(now) or market_hours.seconds_until_open(now) <= self.lead
+
+    def next_delay(self, now=None):
+        """
+        Seconds until the next tick: every `interval` while trading, right
+        at the open during the lead-in, otherwise until the lead-in starts
+        """
+        if market_hours.is_open(now):
+            return self.interval
+        until_open = market_hours.seconds_until_open(now)
+        if until_open > self.lead:
+            # Re-checked at least hourly in case the clock jumps
+            return min(until_open - self.lead, 3600.0)
+        return until_open + 0.01
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='prefetch', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.wait(self.next_delay()):
+            if not self.active():
+                continue
+            try:
+                self.run_once()
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Prefetch failed: {e}")
+
+    def _spend(self, requests):
+        if self._budget.try_take(requests):
+            self.requests += requests
+            return True
+        self.over_budget += 1
+        return False
+
+    def run_once(self, now=None):
+        """
+        One refresh pass over the current top N symbols
+        """
+        symbols = self.tracker.top(self.top_n)
+        if not symbols:
+            return
+        started = time.monotonic()
+        self.ticks += 1
+        with metrics.stage('prefetch'):
+            self._refresh_history(symbols, now)
+            self._refresh(symbols, now)
+        self.last_run_seconds = time.monotonic() - started
+
+    def _refresh_history(self, symbols, now):
+        # Only does any work once a day, after the previous session's bar is final
+        stale = [symbol for symbol in symbols if self.history.missing_since(symbol, now) is not None]
+        if stale and self._spend(1):
+            self.history_updated += len(self.history.update_many(stale, now))
+
+    def _refresh(self, symbols, now):
+        trading = market_hours.is_open(now)
+        # The first pass of a session replaces everything cached before the open
+        session = market_hours.next_open(now)
+        full = trading and self._session != session
+        if trading:
+            self._session = session
+
+        due = {}
+        cold = []
+        for symbol in symbols:
+            snapshot, expires_in = self.cache.peek(symbol)
+            if snapshot is None:
+                if expires_in < self.interval:
+                    cold.append(symbol)
+            elif trading and (full or expires_in < self.interval):
+                due[symbol] = snapshot
+
+        if due and self._spend(math.ceil(len(due) / quotes.CHUNK_SIZE)):
+            latest = quotes.fetch_quotes(list(due))
+            for symbol, snapshot in due.items():
+                quote = latest.get(symbol)
+                if not quotes.is_tradable_quote(quote):
+                    continue
+                hist_low, hist_high = self.history.range_52w(symbol, refresh=False)
+                self.cache.put(symbol, snapshot.updated(quote, hist_low, hist_high), prefetched=True)
+                self.refreshed += 1
+
+        for symbol in cold:
+            # info, plus history when it wasn't batched above
+            if not self._spend(2):
+                break
+            try:
+                self.cache.refresh(symbol, prefetched=True)
+                self.cold_fetched += 1
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Prefetch of {symbol} failed: {e}")
+
+    def stats(self):
+        cache = self.cache.stats()
+        return {
+            'tracked': len(self.tracker),
+            'ticks': self.ticks,
+            'refreshed': self.refreshed,
+            'cold_fetched': self.cold_fetched,
+            'history_updated': self.history_updated,
+            'requests': self.requests,
+            'over_budget': self.over_budget,
+            'errors': self.errors,
+            'last_run_seconds': self.last_run_seconds,
+            'saved_requests': cache['prefetch_saves'],
+            'unused': cache['prefetch_unused'],
+        }
+
+
+def from_env(cache, history):
+    """
+    None when PREFETCH_TOP_N is 0
+    """
+    top_n = int(os.environ.get('PREFETCH_TOP_N', 20))
+    if top_n <= 0:
+        return None
+    return Prefetcher(
+        cache,
+        history,
+        top_n=top_n,
+        budget=int(os.environ.get('PREFETCH_BUDGET', 60)),
+        interval=float(os.environ.get('PREFETCH_INTERVAL', 4)),
+        lead=float(os.environ.get('PREFETCH_LEAD', 900)),
+        tracker=PopularityTracker(half_life=float(os.environ.get('PREFETCH_HALF_LIFE', 6 * 3600))),
+    )
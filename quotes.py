@@ -0,0 +1,345 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+import async_http
+import http_client
+import metrics
+
+QUOTE_URL = 'https://query1.finance.yahoo.com/v7/finance/quote'
+COOKIE_URL = 'https://fc.yahoo.com'
+CRUMB_URL = 'https://query1.finance.yahoo.com/v1/test/getcrumb'
+
+# Yahoo accepts a few hundred symbols per request, but smaller chunks fail less
+CHUNK_SIZE = 50
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+class Crumb:
+    """
+    The quote endpoint only answers requests carrying Yahoo's session
+    cookie and the matching "crumb" token. Both are fetched once, shared
+    by every quote request (sync and async), and fetched again when Yahoo
+    rejects them. One caller fetches while the others wait for its result,
+    never longer than their own deadline. After a failed fetch quotes go
+    out without a crumb for `retry_interval` seconds rather than paying for
+    another attempt each time.
+    """
+
+    def __init__(self, retry_interval=60.0):
+        self.retry_interval = retry_interval
+        self._value = None  # (crumb, cookie header)
+        self._failed_at = None
+        self._flight = None
+        self._lock = threading.Lock()
+        self.refreshes = 0
+        self.failures = 0
+
+    def get(self, deadline=None):
+        """
+        (crumb, cookie header), or None when it can't be had by `deadline`
+        """
+        with self._lock:
+            if self._value is not None or (
+                    self._failed_at is not None and time.monotonic() - self._failed_at < self.retry_interval):
+                return self._value
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = _Flight()
+
+        if not leader:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            flight.done.wait(timeout)
+            return flight.value
+
+        try:
+            flight.value = self._fetch(deadline)
+        except Exception as e:
+            logging.warning(f"Could not get a Yahoo crumb: {e}")
+            with self._lock:
+                self.failures += 1
+                # Running out of this caller's time says nothing about Yahoo
+                if not (deadline is not None and isinstance(e, requests.Timeout)):
+                    self._failed_at = time.monotonic()
+        else:
+            with self._lock:
+                self._value = flight.value
+                self._failed_at = None
+                self.refreshes += 1
+        finally:
+            with self._lock:
+                self._flight = None
+            flight.done.set()
+        return flight.value
+
+    def invalidate(self, stale):
+        with self._lock:
+            if self._value == stale:
+                self._value = None
+
+    def _fetch(self, deadline=None):
+        client = http_client.shared()
+        timeout = float(os.environ.get('QUOTE_HTTP_TIMEOUT', 5))
+        cookie_url = os.environ.get('YAHOO_COOKIE_URL', COOKIE_URL)
+        # The page is a 404; only the cookie it sets matters
+        client.get(cookie_url, timeout=timeout, deadline=deadline)
+        host = urlsplit(cookie_url).hostname or ''
+        cookie = '; '.join(
+            f'{c.name}={c.value}' for c in client.session.cookies if host.endswith(c.domain.lstrip('.')))
+        if not cookie:
+            raise ValueError('no session cookie was set')
+
+        response = client.get(
+            os.environ.get('YAHOO_CRUMB_URL', CRUMB_URL), headers={'Cookie': cookie}, timeout=timeout,
+            deadline=deadline)
+        response.raise_for_status()
+        crumb = response.text.strip()
+        if not crumb or '<' in crumb:
+            raise ValueError(f'unexpected crumb {crumb[:40]!r}')
+        return crumb, cookie
+
+    def stats(self):
+        return {'valid': 0 if self._value is None else 1, 'refreshes': self.refreshes, 'failures': self.failures}
+
+
+crumb = Crumb()
+
+
+class SourceStats:
+    """
+    How batch quotes have been arriving lately: a moving average of the
+    time per chunk (fallback included) and of the share served by the quote
+    endpoint, whose quotes carry every field, rather than the download
+    fallback, which only has prices
+    """
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.latency = None
+        self.endpoint_share = None
+        self.counts = {'endpoint': 0, 'download': 0, 'failed': 0}
+        self._lock = threading.Lock()
+
+    def record(self, source, latency):
+        metrics.observe(f'quote.{source}', latency, 'error' if source == 'failed' else 'ok')
+        served = 1.0 if source == 'endpoint' else 0.0
+        with self._lock:
+            self.counts[source] += 1
+            if self.latency is None:
+                self.latency, self.endpoint_share = latency, served
+            else:
+                self.latency += self.alpha * (latency - self.latency)
+                self.endpoint_share += self.alpha * (served - self.endpoint_share)
+
+    def fast(self, budget):
+        """
+        Whether a full quote usually arrives well within `budget` seconds.
+        True until there is anything to go on.
+        """
+        with self._lock:
+            if self.latency is None:
+                return True
+            return self.latency * 2 <= budget and self.endpoint_share >= 0.5
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self.counts,
+                latency=self.latency or 0.0,
+                endpoint_share=1.0 if self.endpoint_share is None else self.endpoint_share)
+
+
+source_stats = SourceStats()
+
+
+def _quote_request(symbols, auth=None):
+    request = {
+        'url': os.environ.get('YAHOO_QUOTE_URL', QUOTE_URL),
+        'params': {'symbols': ','.join(symbols)},
+        'timeout': float(os.environ.get('QUOTE_HTTP_TIMEOUT', 5)),
+    }
+    if auth is not None:
+        request['params']['crumb'], cookie = auth
+        request['headers'] = {'Cookie': cookie}
+    return request
+
+
+def _parse_quotes(response):
+    response.raise_for_status()
+    results = response.json().get('quoteResponse', {}).get('result') or []
+    return {quote['symbol'].upper(): quote for quote in results if 'symbol' in quote}
+
+
+def _rejected(response):
+    # An expired cookie or crumb; "Invalid Crumb" comes back as a 401
+    return response.status_code in (401, 403)
+
+
+def _fetch_quote_chunk(symbols, deadline=None):
+    auth = crumb.get(deadline)
+    response = http_client.shared().get(**_quote_request(symbols, auth), deadline=deadline)
+    if _rejected(response) and auth is not None:
+        crumb.invalidate(auth)
+        response = http_client.shared().get(**_quote_request(symbols, crumb.get(deadline)), deadline=deadline)
+    return _parse_quotes(response)
+
+
+async def _fetch_quote_chunk_async(symbols, deadline=None):
+    # Only the first call (and one after a rejection) does any I/O
+    auth = await asyncio.to_thread(crumb.get, deadline)
+    response = await async_http.shared().get(**_quote_request(symbols, auth), deadline=deadline)
+    if _rejected(response) and auth is not None:
+        crumb.invalidate(auth)
+        response = await async_http.shared().get(
+            **_quote_request(symbols, await asyncio.to_thread(crumb.get, deadline)), deadline=deadline)
+    return _parse_quotes(response)
+
+
+def _download_quote_chunk(symbols):
+    """
+    Fallback when the quote endpoint refuses us: one batched yfinance
+    download of the last few daily bars, reduced to quote-like dicts
+    """
+    import yfinance as yf
+
+    data = yf.download(symbols, period='5d', group_by='column', progress=False, auto_adjust=False)
+    if data.empty:
+        return {}
+
+    closes = data['Close']
+    if not hasattr(closes, 'columns'):
+        closes = closes.to_frame(symbols[0])
+
+    quotes = {}
+    for symbol in closes.columns:
+        series = closes[symbol].dropna()
+        if series.empty:
+            continue
+        quotes[str(symbol).upper()] = {
+            'symbol': str(symbol).upper(),
+            'regularMarketPrice': float(series.iloc[-1]),
+            'regularMarketPreviousClose': float(series.iloc[-2]) if len(series) > 1 else None,
+        }
+    return quotes
+
+
+def _unique_symbols(symbols):
+    return list(dict.fromkeys(s.strip().upper() for s in symbols if s and s.strip()))
+
+
+def _expired(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def fetch_quotes(symbols, deadline=None, strict=False):
+    """
+    Fetch quotes for many symbols in as few requests as possible.
+    Returns {SYMBOL: quote dict}; symbols Yahoo doesn't know are left out.
+    HTTP retries stop at `deadline` (a time.monotonic() value), and the
+    download fallback, which can't be cut short, is skipped after it.
+    With `strict`, a chunk that couldn't be fetched at all raises rather
+    than being left out like unknown symbols.
+    """
+    symbols = _unique_symbols(symbols)
+    quotes = {}
+    for chunk in _chunks(symbols, CHUNK_SIZE):
+        started = time.monotonic()
+        try:
+            quotes.update(_fetch_quote_chunk(chunk, deadline))
+            source_stats.record('endpoint', time.monotonic() - started)
+        except Exception as e:
+            if _expired(deadline):
+                logging.warning(f"Quote endpoint failed ({e}) and the deadline has passed")
+                source_stats.record('failed', time.monotonic() - started)
+                if strict:
+                    raise
+                continue
+            logging.warning(f"Quote endpoint failed ({e}), falling back to batch download")
+            try:
+                quotes.update(_download_quote_chunk(chunk))
+                source_stats.record('download', time.monotonic() - started)
+            except Exception as e:
+                logging.error(f"Error downloading quotes for {chunk}: {e}")
+                source_stats.record('failed', time.monotonic() - started)
+                if strict:
+                    raise
+    return quotes
+
+
+def is_tradable_quote(quote):
+    return bool(quote) and quote.get('regularMarketPrice') is not None
+
+
+def first_tradable(candidates, deadline=None):
+    """
+    Verify a ranked list of candidate symbols in one batch and return the
+    first one with a live market price, or None. Raises when the quotes
+    couldn't be fetched, which is not the same as no candidate trading.
+    """
+    candidates = [c.strip() for c in candidates if c and c.strip()]
+    if not candidates:
+        return None
+
+    quotes = fetch_quotes(candidates, deadline, strict=True)
+    for candidate in candidates:
+        if is_tradable_quote(quotes.get(candidate.upper())):
+            return candidate
+    return None
+
+
+async def fetch_quotes_async(symbols, deadline=None, strict=False):
+    """
+    fetch_quotes on the event loop; the yfinance fallback runs in a thread
+    """
+    symbols = _unique_symbols(symbols)
+    quotes = {}
+    for chunk in _chunks(symbols, CHUNK_SIZE):
+        started = time.monotonic()
+        try:
+            quotes.update(await _fetch_quote_chunk_async(chunk, deadline))
+            source_stats.record('endpoint', time.monotonic() - started)
+        except Exception as e:
+            if _expired(deadline):
+                logging.warning(f"Quote endpoint failed ({e}) and the deadline has passed")
+                source_stats.record('failed', time.monotonic() - started)
+                if strict:
+                    raise
+                continue
+            logging.warning(f"Quote endpoint failed ({e}), falling back to batch download")
+            try:
+                quotes.update(await asyncio.to_thread(_download_quote_chunk, chunk))
+                source_stats.record('download', time.monotonic() - started)
+            except Exception as e:
+                logging.error(f"Error downloading quotes for {chunk}: {e}")
+                source_stats.record('failed', time.monotonic() - started)
+                if strict:
+                    raise
+    return quotes
+
+
+async def first_tradable_async(candidates, deadline=None):
+    candidates = [c.strip() for c in candidates if c and c.strip()]
+    if not candidates:
+        return None
+
+    quotes = await fetch_quotes_async(candidates, deadline, strict=True)
+    for candidate in candidates:
+        if is_tradable_quote(quotes.get(candidate.upper())):
+            return candidate
+    return None
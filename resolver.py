@@ -0,0 +1,461 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import logging_setup
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class _Unresolved:
+    """
+    Falsy result of a lookup that found no ticker while some source failed,
+    timed out or was skipped, so it isn't known that nothing matches
+    """
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return 'UNRESOLVED'
+
+
+UNRESOLVED = _Unresolved()
+
+
+class Source:
+    """
+    One step of the ticker search cascade. `fn(company_name, cancelled,
+    deadline)` returns a verified ticker or None. It should bail out early
+    once the `cancelled` event is set, and pass `deadline` (a
+    time.monotonic() value) on to its HTTP calls so retries stop when the
+    lookup has given up on the source.
+    """
+
+    def __init__(self, name, fn, timeout=5.0):
+        self.name = name
+        self.fn = fn
+        self.timeout = timeout
+
+
+class SourceHealth:
+    """
+    Rolling record of a source's recent calls (hit, miss or failure, and
+    latency) with a circuit breaker on top. After `min_calls` calls with a
+    failure rate of at least `threshold` the breaker opens and the source is
+    skipped for `cooldown` seconds, doubling on each consecutive trip up to
+    `max_cooldown`. Then a single half-open probe decides whether it closes
+    again.
+    """
+
+    def __init__(self, window=50, window_seconds=600.0, threshold=0.5, min_calls=5,
+                 cooldown=30.0, max_cooldown=600.0):
+        self.window_seconds = window_seconds
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self._calls = deque(maxlen=window)  # (finished_at, outcome, latency)
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.trips = 0
+        self.skipped = 0
+        self._consecutive_trips = 0
+        self._probing = False
+
+    def _prune(self, now):
+        while self._calls and now - self._calls[0][0] > self.window_seconds:
+            self._calls.popleft()
+
+    def allow(self):
+        """
+        Whether the source may be called now. In the half-open state only
+        one probe is let through at a time.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() >= self.open_until:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.skipped += 1
+            return False
+
+    def release(self):
+        """
+        End a call that produced no outcome (cancelled, or abandoned by a
+        finished race) so a half-open probe slot isn't held forever
+        """
+        with self._lock:
+            self._probing = False
+
+    def record(self, outcome, latency):
+        """
+        `outcome` is 'hit' (returned a ticker), 'miss' or 'failure'
+        (raised or timed out)
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._calls.append((now, outcome, latency))
+            self._prune(now)
+            if self.state == HALF_OPEN and self._probing:
+                self._probing = False
+                if outcome == 'failure':
+                    self._trip(now)
+                else:
+                    self.state = CLOSED
+                    self._consecutive_trips = 0
+                    # Start the window afresh so old failures can't re-trip it
+                    self._calls.clear()
+                    self._calls.append((now, outcome, latency))
+                return
+            if self.state == CLOSED and outcome == 'failure':
+                failures = sum(1 for _, o, _ in self._calls if o == 'failure')
+                if len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.threshold:
+                    self._trip(now)
+
+    def _trip(self, now):
+        self.state = OPEN
+        self.open_until = now + min(self.max_cooldown, self.cooldown * 2 ** self._consecutive_trips)
+        self._consecutive_trips += 1
+        self.trips += 1
+
+    def expected_cost(self, failure_penalty=5.0, prior_latency=0.5):
+        """
+        Estimated seconds spent per ticker found: mean latency, with failures
+        charged `failure_penalty`, over the hit rate. Both are smoothed
+        towards a prior so new sources start even.
+        """
+        with self._lock:
+            self._prune(time.monotonic())
+            calls = len(self._calls)
+            hits = sum(1 for _, o, _ in self._calls if o == 'hit')
+            latency = sum(max(l, failure_penalty) if o == 'failure' else l for _, o, l in self._calls)
+        hit_rate = (hits + 1) / (calls + 2)
+        mean_latency = (latency + prior_latency) / (calls + 1)
+        return mean_latency / hit_rate
+
+    def stats(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            calls = list(self._calls)
+            state = self.state
+        latencies = sorted(l for _, _, l in calls)
+        count = len(calls)
+        return {
+            'state': state,
+            'open': 0 if state == CLOSED else 1,
+            'calls': count,
+            'hit_rate': sum(1 for _, o, _ in calls if o == 'hit') / count if count else 0.0,
+            'failure_rate': sum(1 for _, o, _ in calls if o == 'failure') / count if count else 0.0,
+            'latency_p50': latencies[count // 2] if count else 0.0,
+            'trips': self.trips,
+            'skipped': self.skipped,
+        }
+
+
+class HedgedResolver:
+    """
+    Runs independent ticker sources concurrently, each with its own deadline
+    counted from the start of the lookup, and returns the first verified
+    candidate, None when every source answered without one, or UNRESOLVED
+    when some couldn't answer. A hit from a source is held for up to `grace` seconds while
+    sources earlier in `priority` are still running, and the one first in
+    `priority` wins.
+
+    Each source has a SourceHealth: sources whose breaker is open are
+    skipped, and with `adaptive` sequential lookups try sources in order of
+    their recent latency and hit rate, with `priority` only breaking ties.
+    They only hear from the sources they reach, so a fraction `explore` of
+    them start with a random source instead.
+    """
+
+    def __init__(self, sources, priority=None, grace=0.2, max_workers=16, adaptive=True, health=None,
+                 explore=0.05):
+        self.sources = {source.name: source for source in sources}
+        self.priority = list(priority or self.sources)
+        self.grace = grace
+        self.adaptive = adaptive
+        self.explore = explore
+        self.health = {name: (health or SourceHealth)() for name in self.sources}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='resolver')
+
+    def _rank(self, name):
+        try:
+            return self.priority.index(name)
+        except ValueError:
+            return len(self.priority)
+
+    def ranked(self):
+        """
+        Sources in the order they should be preferred right now
+        """
+        sources = [self.sources[name] for name in self.priority if name in self.sources]
+        if self.adaptive:
+            costs = {source.name: self.health[source.name].expected_cost(source.timeout) for source in sources}
+            sources.sort(key=lambda source: (costs[source.name], self._rank(source.name)))
+        return sources
+
+    def _record(self, source, started, cancelled, ticker=None, failed=False, raced=True):
+        health = self.health[source.name]
+        latency = time.monotonic() - started
+        if latency > source.timeout:
+            if raced:
+                # The race has already recorded the timeout
+                health.release()
+                return
+            failed = True
+        elif cancelled.is_set() and not ticker and not failed:
+            # Bailed out because the race was over, which says nothing
+            health.release()
+            return
+        health.record('failure' if failed else 'hit' if ticker else 'miss', latency)
+
+    def _run(self, source, company_name, cancelled, deadline=None, raced=True, started=None):
+        if started is not None:
+            started.add(source.name)
+        if cancelled.is_set():
+            self.health[source.name].release()
+            return UNRESOLVED
+        started = time.monotonic()
+        try:
+            ticker = source.fn(company_name, cancelled, deadline or started + source.timeout)
+        except Exception as e:
+            logging.error(f"Error in {source.name} search: {e}")
+            self._record(source, started, cancelled, failed=True, raced=raced)
+            return UNRESOLVED
+        self._record(source, started, cancelled, ticker, raced=raced)
+        return ticker
+
+    async def _run_async(self, source, company_name, cancelled, deadline=None, raced=True, started=None):
+        if not asyncio.iscoroutinefunction(source.fn):
+            return await asyncio.to_thread(self._run, source, company_name, cancelled, deadline, raced, started)
+        if started is not None:
+            started.add(source.name)
+        started = time.monotonic()
+        try:
+            ticker = await source.fn(company_name, cancelled, deadline or started + source.timeout)
+        except asyncio.CancelledError:
+            self.health[source.name].release()
+            raise
+        except Exception as e:
+            logging.error(f"Error in {source.name} search: {e}")
+            self._record(source, started, cancelled, failed=True, raced=raced)
+            return UNRESOLVED
+        self._record(source, started, cancelled, ticker, raced=raced)
+        return ticker
+
+    def _timed_out(self, source):
+        self.health[source.name].record('failure', source.timeout)
+
+    def _allowed(self):
+        return [source for source in self.ranked() if self.health[source.name].allow()]
+
+    def _sequence(self):
+        sources = self.ranked()
+        if self.adaptive and len(sources) > 1 and random.random() < self.explore:
+            sources.insert(0, sources.pop(random.randrange(1, len(sources))))
+        return sources
+
+    def resolve(self, company_name):
+        cancelled = threading.Event()
+        sources = self._allowed()
+        race = _Race(self, company_name, sources, skipped=len(sources) < len(self.sources))
+        for source in sources:
+            race.add(logging_setup.submit(
+                self._executor, self._run, source, company_name, cancelled, race.deadline(source), True,
+                race.started), source)
+
+        try:
+            while not race.decided():
+                done, _ = wait(race.pending, timeout=race.timeout(), return_when=FIRST_COMPLETED)
+                race.collect(done)
+        finally:
+            cancelled.set()
+            for future, (source, _) in race.pending.items():
+                if future.cancel():
+                    self.health[source.name].release()
+        return race.winner()
+
+    async def resolve_async(self, company_name):
+        """
+        resolve() on the running event loop. Coroutine sources run as tasks,
+        plain ones in a worker thread.
+        """
+        cancelled = threading.Event()
+        sources = self._allowed()
+        race = _Race(self, company_name, sources, skipped=len(sources) < len(self.sources))
+        for source in sources:
+            race.add(asyncio.ensure_future(
+                self._run_async(source, company_name, cancelled, race.deadline(source), True, race.started)), source)
+
+        try:
+            while not race.decided():
+                done, _ = await asyncio.wait(
+                    race.pending, timeout=race.timeout(), return_when=asyncio.FIRST_COMPLETED)
+                race.collect(done)
+        finally:
+            cancelled.set()
+            for task, (source, _) in race.pending.items():
+                task.cancel()
+                if source.name not in race.started:
+                    self.health[source.name].release()
+        return race.winner()
+
+    def resolve_sequential(self, company_name):
+        """
+        Try the sources one at a time, best ranked first. A source running
+        past its timeout counts as a failure.
+        """
+        cancelled = threading.Event()
+        result = None
+        for source in self._sequence():
+            # Ask each breaker only when its turn comes, so a half-open probe
+            # isn't claimed by a lookup that never gets that far
+            if not self.health[source.name].allow():
+                result = UNRESOLVED
+                continue
+            ticker = self._run(source, company_name, cancelled, raced=False)
+            if ticker:
+                return ticker
+            result = ticker if result is None else result
+        return result
+
+    async def resolve_sequential_async(self, company_name):
+        cancelled = threading.Event()
+        result = None
+        for source in self._sequence():
+            if not self.health[source.name].allow():
+                result = UNRESOLVED
+                continue
+            ticker = await self._run_async(source, company_name, cancelled, raced=False)
+            if ticker:
+                return ticker
+            result = ticker if result is None else result
+        return result
+
+    def stats(self):
+        ranks = {source.name: i for i, source in enumerate(self.ranked())}
+        return {name: dict(health.stats(), rank=ranks.get(name, len(ranks))) for name, health in self.health.items()}
+
+
+class _Race:
+    """
+    Bookkeeping for one resolve(): which sources are still pending and
+    which of them have actually started, their deadlines, the best result
+    so far, and whether every source gave a real answer
+    """
+
+    def __init__(self, resolver, company_name, sources, skipped=False):
+        self.resolver = resolver
+        self.company_name = company_name
+        # The winner is picked by priority; adaptive ranking only orders
+        # sequential lookups
+        self.ranks = {source.name: resolver._rank(source.name) for source in sources}
+        self.began = time.monotonic()
+        self.started = set()  # names of sources whose call has begun
+        self.answered = not skipped
+        self.pending = {}  # future -> (source, deadline)
+        self.best = None  # (rank, ticker, source name)
+        self.decide_at = None
+
+    def deadline(self, source):
+        return self.began + source.timeout
+
+    def add(self, future, source):
+        self.pending[future] = (source, self.deadline(source))
+
+    def timeout(self):
+        deadline = min(d for _, d in self.pending.values())
+        if self.decide_at is not None:
+            deadline = min(deadline, self.decide_at)
+        return max(0.0, deadline - time.monotonic())
+
+    def collect(self, done):
+        for future in done:
+            source, _ = self.pending.pop(future)
+            ticker = future.result()
+            if ticker is UNRESOLVED:
+                self.answered = False
+            elif ticker:
+                rank = self.ranks[source.name]
+                if self.best is None or rank < self.best[0]:
+                    self.best = (rank, ticker, source.name)
+                if self.decide_at is None:
+                    self.decide_at = time.monotonic() + self.resolver.grace
+
+        now = time.monotonic()
+        for future, (source, deadline) in list(self.pending.items()):
+            if deadline <= now:
+                self.answered = False
+                del self.pending[future]
+                future.cancel()
+                if source.name in self.started:
+                    logging.warning(f"{source.name} search timed out for '{self.company_name}'")
+                    self.resolver._timed_out(source)
+                else:
+                    # Still queued for a worker, which says nothing about the source
+                    logging.warning(f"{source.name} search never started for '{self.company_name}'")
+                    self.resolver.health[source.name].release()
+
+    def decided(self):
+        if not self.pending:
+            return True
+        if self.best is None:
+            return False
+        # Stop as soon as nothing still running could outrank the winner
+        higher = [s for s, _ in self.pending.values() if self.ranks[s.name] < self.best[0]]
+        return not higher or time.monotonic() >= self.decide_at
+
+    def winner(self):
+        if self.best is not None:
+            logging.debug(f"Resolved '{self.company_name}' to {self.best[1]} via {self.best[2]}")
+            return self.best[1]
+        return None if self.answered else UNRESOLVED
+
+
+def parse_timeouts(value, default):
+    """
+    Parse "yahoo=3,marketwatch=4" into {'yahoo': 3.0, 'marketwatch': 4.0}
+    """
+    timeouts = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, seconds = item.partition('=')
+        timeouts[name.strip()] = float(seconds or default)
+    return timeouts
+
+
+def from_env(sources):
+    default_timeout = float(os.environ.get('RESOLVE_TIMEOUT', 5))
+    timeouts = parse_timeouts(os.environ.get('RESOLVE_TIMEOUTS', ''), default_timeout)
+    for source in sources:
+        source.timeout = timeouts.get(source.name, default_timeout)
+
+    def health():
+        return SourceHealth(
+            window=int(os.environ.get('RESOLVE_HEALTH_WINDOW', 50)),
+            threshold=float(os.environ.get('RESOLVE_BREAKER_THRESHOLD', 0.5)),
+            cooldown=float(os.environ.get('RESOLVE_BREAKER_COOLDOWN', 30)),
+        )
+
+    priority = os.environ.get('RESOLVE_PRIORITY')
+    return HedgedResolver(
+        sources,
+        priority=[name.strip() for name in priority.split(',')] if priority else None,
+        grace=float(os.environ.get('RESOLVE_GRACE', 0.2)),
+        max_workers=int(os.environ.get('RESOLVE_WORKERS', 16)),
+        adaptive=os.environ.get('RESOLVE_ADAPTIVE', '1') == '1',
+        explore=float(os.environ.get('RESOLVE_EXPLORE', 0.05)),
+        health=health,
+    )
@@ -0,0 +1,460 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from slack.errors import SlackApiError
+
+import metrics
+from http_client import TokenBucket
+
+METHODS = {'post': 'chat.postMessage', 'update': 'chat.update'}
+
+# What stays when a queued post's content is replaced by a later update
+ROUTING = ('channel', 'thread_ts', 'reply_broadcast')
+
+
+def _replace_content(message, kwargs):
+    for key in [key for key in message if key not in ROUTING]:
+        del message[key]
+    message.update(kwargs)
+
+
+class MessageHandle:
+    """
+    A message the outbox has posted (or will post). `ts` is filled in once
+    Slack has accepted it.
+    """
+
+    def __init__(self, channel, ts=None):
+        self.channel = channel
+        self.ts = ts
+        self.error = None
+        self.posted = threading.Event()
+        # The post's kwargs until it is sent; updates before then replace its content
+        self.pending_post = None
+        self.pending_update = None
+        # The asyncio task sending the post (AsyncSlackOutbox only)
+        self.task = None
+        if ts is not None:
+            self.posted.set()
+
+    def wait(self, timeout=None):
+        """
+        Block until the message has been posted and return its ts
+        """
+        self.posted.wait(timeout)
+        return self.ts
+
+
+class SlackOutbox:
+    """
+    Sends Slack Web API calls from per-channel queues, so each channel's
+    messages stay in order and are paced separately. Calls are also limited
+    per method and back off on 429s using Retry-After. Only the latest
+    pending update for a message is ever sent, and updates to a message
+    that hasn't been posted yet are folded into the post.
+
+    Workers never wait on a limit: a channel whose next call can't go yet
+    is set aside until it can, and the workers serve other channels
+    meanwhile, so one throttled channel (or an exhausted chat.update
+    budget) doesn't hold up the rest.
+    """
+
+    def __init__(self, client, workers=4, channel_rate=1.0, channel_burst=3,
+                 method_limits=None, max_attempts=5):
+        self.client = client
+        self.workers = workers
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.max_attempts = max_attempts
+        self.method_buckets = {
+            method: TokenBucket(rate, burst)
+            for method, (rate, burst) in (method_limits or {}).items()
+        }
+
+        # channel -> deque of (kind, handle, kwargs, attempt); an update's
+        # content is read from its handle when it is sent
+        self._channels = {}
+        self._channel_buckets = {}
+        self._due = []  # heap of (time, seq, channel) for channels waiting to be served
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._idle = threading.Condition(self._lock)
+        self._blocked_until = {}  # method -> monotonic time its 429 expires
+        self._threads = []
+
+        self.calls = {}
+        self.coalesced = 0
+        self.deferred = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"slack-outbox-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _schedule(self, channel, at):
+        heapq.heappush(self._due, (at, next(self._seq), channel))
+        self._wakeup.notify()
+
+    def _enqueue(self, channel, operation):
+        if not self._threads:
+            self.start()
+        with self._lock:
+            pending = self._channels.get(channel)
+            if pending is None:
+                pending = self._channels[channel] = deque()
+                self._schedule(channel, time.monotonic())
+            pending.append(operation)
+
+    def post(self, channel, **kwargs):
+        """
+        Queue a chat.postMessage and return its MessageHandle
+        """
+        handle = MessageHandle(channel)
+        kwargs = dict(kwargs, channel=channel)
+        handle.pending_post = kwargs
+        self._enqueue(channel, ('post', handle, kwargs, 0))
+        return handle
+
+    def handle(self, channel, ts):
+        """
+        A handle for a message that was posted outside the outbox
+        """
+        return MessageHandle(channel, ts)
+
+    def update(self, handle, **kwargs):
+        """
+        Queue a chat.update for `handle`, replacing any update for it that
+        hasn't been sent yet. If the message itself hasn't been sent, it is
+        posted with this content instead.
+        """
+        with self._lock:
+            if handle.pending_post is not None:
+                _replace_content(handle.pending_post, kwargs)
+                self.coalesced += 1
+                return
+            queued = handle.pending_update is not None
+            handle.pending_update = kwargs
+            if queued:
+                self.coalesced += 1
+                return
+        self._enqueue(handle.channel, ('update', handle, None, 0))
+
+    def join(self):
+        """
+        Wait until every queued call has been sent
+        """
+        with self._idle:
+            while self._channels:
+                self._idle.wait()
+
+    def _next_channel(self):
+        # Called with the lock held
+        while True:
+            now = time.monotonic()
+            if self._due and self._due[0][0] <= now:
+                return heapq.heappop(self._due)[2]
+            self._wakeup.wait(self._due[0][0] - now if self._due else None)
+
+    def _take(self, method, channel):
+        """
+        Take what a call needs from the limits it is under, or return how
+        long until it could go
+        """
+        wait = self._blocked_until.get(method, 0) - time.monotonic()
+        if wait > 0:
+            return wait
+        buckets = [self.method_buckets.get(method)]
+        if method == 'chat.postMessage':
+            buckets.append(self._channel_bucket(channel))
+        taken = []
+        for bucket in filter(None, buckets):
+            if not bucket.try_take():
+                for other in taken:
+                    other.refund()
+                return max(bucket.wait_time(), 0.001)
+            taken.append(bucket)
+        return 0.0
+
+    def _work(self):
+        while True:
+            with self._lock:
+                channel = self._next_channel()
+                pending = self._channels[channel]
+                operation, handle, kwargs, attempt = pending[0]
+                kind = operation
+                if operation == 'update':
+                    kwargs = content = handle.pending_update
+                    if kwargs is not None and handle.ts is None:
+                        # The original post failed, so send the latest content as a new message
+                        kind, kwargs = 'post', dict(kwargs, channel=channel)
+                if kwargs is not None:
+                    wait = self._take(METHODS[kind], channel)
+                    if wait > 0:
+                        self.deferred += 1
+                        self._schedule(channel, time.monotonic() + wait)
+                        continue
+                pending.popleft()
+                if operation == 'post':
+                    handle.pending_post = None
+                else:
+                    handle.pending_update = None
+
+            retry = None
+            if kwargs is not None:
+                try:
+                    self._send(kind, handle, kwargs)
+                except SlackApiError as e:
+                    if e.response.status_code == 429 and attempt + 1 < self.max_attempts:
+                        retry = float(e.response.headers.get('Retry-After', 1))
+                    else:
+                        self._failed(kind, channel, handle, e)
+                except Exception as e:
+                    self._failed(kind, channel, handle, e)
+
+            with self._lock:
+                if retry is not None:
+                    method = METHODS[kind]
+                    self.rate_limited += 1
+                    logging.warning(f"Slack rate limited {method}, retrying in {retry}s")
+                    self._blocked_until[method] = max(
+                        self._blocked_until.get(method, 0), time.monotonic() + retry)
+                    if operation == 'post':
+                        pending.appendleft((operation, handle, kwargs, attempt + 1))
+                    elif handle.pending_update is None:
+                        # (otherwise a newer update is already queued behind it)
+                        handle.pending_update = content
+                        pending.appendleft((operation, handle, None, attempt + 1))
+                if pending:
+                    self._schedule(channel, time.monotonic())
+                else:
+                    del self._channels[channel]
+                    self._idle.notify_all()
+
+    def _send(self, kind, handle, kwargs):
+        method = METHODS[kind]
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        with metrics.stage(f'slack.{method}'):
+            if kind == 'post':
+                response = self.client.chat_postMessage(**kwargs)
+                handle.ts = response['ts']
+                handle.posted.set()
+            else:
+                self.client.chat_update(**dict(kwargs, channel=handle.channel, ts=handle.ts))
+
+    def _failed(self, kind, channel, handle, error):
+        with self._lock:
+            self.failed += 1
+        logging.error(f"Error sending Slack {kind} to {channel}: {error}")
+        if kind == 'post':
+            handle.error = error
+            handle.posted.set()
+
+    def _channel_bucket(self, channel):
+        # Called with the lock held
+        if channel not in self._channel_buckets:
+            self._channel_buckets[channel] = TokenBucket(self.channel_rate, self.channel_burst)
+        return self._channel_buckets[channel]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'channels_pending': len(self._channels),
+                'calls': dict(self.calls),
+                'coalesced': self.coalesced,
+                'deferred': self.deferred,
+                'rate_limited': self.rate_limited,
+                'failed': self.failed,
+            }
+
+
+class AsyncSlackOutbox:
+    """
+    SlackOutbox for an async WebClient (run_async=True). Each channel's
+    calls run in order under that channel's lock, with the same pacing,
+    per-method limits and 429 handling, and pending updates are coalesced
+    (or folded into a post not yet sent) the same way. A channel waiting on
+    a limit only holds up its own tasks. post() and update() schedule the
+    call and return at once.
+    """
+
+    def __init__(self, client, channel_rate=1.0, channel_burst=3, method_limits=None, max_attempts=5):
+        self.client = client
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.max_attempts = max_attempts
+        self.method_buckets = {
+            method: TokenBucket(rate, burst)
+            for method, (rate, burst) in (method_limits or {}).items()
+        }
+
+        self._channel_locks = {}  # channel -> [lock, number of queued calls]
+        self._channel_buckets = {}
+        self._blocked_until = {}
+        self._tasks = set()
+
+        self.calls = {}
+        self.coalesced = 0
+        self.rate_limited = 0
+        self.failed = 0
+
+    def _spawn(self, channel, kind, operation):
+        entry = self._channel_locks.get(channel)
+        if entry is None:
+            entry = self._channel_locks[channel] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        task = asyncio.ensure_future(self._run(channel, kind, entry, operation))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, channel, kind, entry, operation):
+        try:
+            async with entry[0]:
+                await operation()
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Error sending Slack {kind} to {channel}: {e}")
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._channel_locks[channel]
+
+    def post(self, channel, **kwargs):
+        """
+        Schedule a chat.postMessage and return its MessageHandle
+        """
+        handle = MessageHandle(channel)
+        kwargs = dict(kwargs, channel=channel)
+        handle.pending_post = kwargs
+        handle.task = self._spawn(channel, 'post', lambda: self._post(handle, kwargs))
+        return handle
+
+    def handle(self, channel, ts):
+        return MessageHandle(channel, ts)
+
+    async def wait(self, handle):
+        """
+        Wait until `handle` has been posted and return its ts
+        """
+        if handle.task is not None:
+            await asyncio.shield(handle.task)
+        return handle.ts
+
+    def update(self, handle, **kwargs):
+        """
+        Schedule a chat.update for `handle`, replacing any update for it
+        that hasn't been sent yet. If the message itself hasn't been sent,
+        it is posted with this content instead.
+        """
+        if handle.pending_post is not None:
+            _replace_content(handle.pending_post, kwargs)
+            self.coalesced += 1
+            return
+        queued = handle.pending_update is not None
+        handle.pending_update = kwargs
+        if queued:
+            self.coalesced += 1
+            return
+        self._spawn(handle.channel, 'update', lambda: self._update(handle))
+
+    async def join(self):
+        """
+        Wait until every scheduled call has been sent
+        """
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    async def _post(self, handle, kwargs):
+        try:
+            response = await self._call('chat.postMessage', self.client.chat_postMessage, kwargs, handle)
+            handle.ts = response['ts']
+        except Exception as e:
+            handle.error = e
+            raise
+        finally:
+            handle.posted.set()
+
+    async def _update(self, handle):
+        kwargs, handle.pending_update = handle.pending_update, None
+        if kwargs is None:
+            return
+        if handle.ts is None:
+            await self._post(handle, dict(kwargs, channel=handle.channel))
+            return
+        await self._call('chat.update', self.client.chat_update, dict(kwargs, channel=handle.channel, ts=handle.ts))
+
+    def _channel_bucket(self, channel):
+        if channel not in self._channel_buckets:
+            self._channel_buckets[channel] = TokenBucket(self.channel_rate, self.channel_burst)
+        return self._channel_buckets[channel]
+
+    async def _call(self, method, fn, kwargs, handle=None):
+        for attempt in range(self.max_attempts):
+            blocked = self._blocked_until.get(method, 0) - time.monotonic()
+            if blocked > 0:
+                await asyncio.sleep(blocked)
+            if method == 'chat.postMessage':
+                await self._channel_bucket(kwargs['channel']).acquire_async()
+            if method in self.method_buckets:
+                await self.method_buckets[method].acquire_async()
+
+            if handle is not None:
+                # Later updates go out as chat.update from here on
+                handle.pending_post = None
+            self.calls[method] = self.calls.get(method, 0) + 1
+            try:
+                with metrics.stage(f'slack.{method}'):
+                    return await fn(**kwargs)
+            except SlackApiError as e:
+                if e.response.status_code != 429 or attempt == self.max_attempts - 1:
+                    raise
+                retry_after = float(e.response.headers.get('Retry-After', 1))
+                self.rate_limited += 1
+                logging.warning(f"Slack rate limited {method}, retrying in {retry_after}s")
+                self._blocked_until[method] = max(
+                    self._blocked_until.get(method, 0), time.monotonic() + retry_after)
+
+    def stats(self):
+        return {
+            'channels_pending': len(self._channel_locks),
+            'calls': dict(self.calls),
+            'coalesced': self.coalesced,
+            'rate_limited': self.rate_limited,
+            'failed': self.failed,
+        }
+
+
+def _method_limits():
+    # chat.update is a Tier 3 method (~50 calls per minute)
+    return {'chat.update': (float(os.environ.get('SLACK_UPDATE_RATE', 50)) / 60, 10)}
+
+
+def from_env(client):
+    return SlackOutbox(
+        client,
+        workers=int(os.environ.get('SLACK_OUTBOX_WORKERS', 4)),
+        channel_rate=float(os.environ.get('SLACK_CHANNEL_RATE', 1)),
+        method_limits=_method_limits(),
+    )
+
+
+def from_env_async(client):
+    return AsyncSlackOutbox(
+        client,
+        channel_rate=float(os.environ.get('SLACK_CHANNEL_RATE', 1)),
+        method_limits=_method_limits(),
+    )
@@ -0,0 +1,158 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import market_hours
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SnapshotCache:
+    """
+    Cache of per-symbol snapshots whose TTL follows the exchange session.
+    Concurrent misses for the same symbol are coalesced so only one fetch per
+    symbol is ever in flight.
+
+    Values `usable` rejects (by default None) are kept for at most
+    `negative_ttl` seconds, or not at all when it is 0, so one bad fetch
+    after the close isn't served until the next open.
+    """
+
+    def __init__(self, fetch, ttl=market_hours.quote_ttl, max_size=1000, usable=None, negative_ttl=0.0):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_size = max_size
+        self.usable = usable or (lambda value: value is not None)
+        self.negative_ttl = negative_ttl
+
+        self._entries = OrderedDict()  # symbol -> (value, expires_at, prefetched)
+        self._flights = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        # Prefetched entries that served a request before expiring, i.e.
+        # user lookups that would otherwise have been cold misses
+        self.prefetch_saves = 0
+        self.prefetch_unused = 0
+        self.unusable = 0
+
+    def get(self, symbol):
+        symbol = symbol.upper()
+        with self._lock:
+            entry = self._entries.get(symbol)
+            if entry is not None and entry[1] > time.time():
+                self._entries.move_to_end(symbol)
+                self.hits += 1
+                if entry[2]:
+                    self.prefetch_saves += 1
+                    self._entries[symbol] = (entry[0], entry[1], False)
+                return entry[0]
+        return self._load(symbol)
+
+    def refresh(self, symbol, prefetched=False):
+        """
+        Fetch `symbol` whether or not it is cached, through the same single
+        flight as get(): if a fetch is already running its result is shared
+        rather than a second one started. Not counted as a lookup.
+        """
+        return self._load(symbol.upper(), prefetched, lookup=False)
+
+    def _load(self, symbol, prefetched=False, lookup=True):
+        with self._lock:
+            flight = self._flights.get(symbol)
+            if flight is not None:
+                if lookup:
+                    self.coalesced += 1
+                leader = False
+            else:
+                flight = self._flights[symbol] = _Flight()
+                if lookup:
+                    self.misses += 1
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = self.fetch(symbol)
+            self.put(symbol, flight.value, prefetched=prefetched)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(symbol, None)
+            flight.done.set()
+
+    def put(self, symbol, value, ttl=None, prefetched=False):
+        if ttl is None:
+            ttl = self.ttl()
+        if not self.usable(value):
+            with self._lock:
+                self.unusable += 1
+            if self.negative_ttl <= 0:
+                return
+            ttl = min(ttl, self.negative_ttl)
+        symbol = symbol.upper()
+        with self._lock:
+            old = self._entries.get(symbol)
+            if old is not None and old[2]:
+                self.prefetch_unused += 1
+            self._entries[symbol] = (value, time.time() + ttl, prefetched)
+            self._entries.move_to_end(symbol)
+            while len(self._entries) > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                if evicted[2]:
+                    self.prefetch_unused += 1
+
+    def peek(self, symbol):
+        """
+        (value, seconds until it expires) without counting a lookup; the
+        value may already be stale. (None, 0.0) when not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(symbol.upper())
+        if entry is None:
+            return None, 0.0
+        return entry[0], entry[1] - time.time()
+
+    def invalidate(self, symbol):
+        with self._lock:
+            self._entries.pop(symbol.upper(), None)
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            'size': len(self._entries),
+            'in_flight': len(self._flights),
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            'prefetch_saves': self.prefetch_saves,
+            'prefetch_unused': self.prefetch_unused,
+            'unusable': self.unusable,
+        }
+
+
+def from_env(fetch, usable=None):
+    open_ttl = float(os.environ.get('QUOTE_CACHE_OPEN_TTL', 5))
+    return SnapshotCache(
+        fetch,
+        ttl=lambda: market_hours.quote_ttl(open_ttl=open_ttl),
+        max_size=int(os.environ.get('QUOTE_CACHE_SIZE', 1000)),
+        usable=usable,
+        negative_ttl=float(os.environ.get('QUOTE_CACHE_NEGATIVE_TTL', 30)),
+    )
@@ -0,0 +1,545 @@
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class StateStore:
+    """
+    Key/hash store for bot state that may be shared between worker processes.
+    Values are strings; callers encode anything richer themselves.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def incr(self, key, amount=1):
+        raise NotImplementedError
+
+    def hget(self, key, field):
+        raise NotImplementedError
+
+    def hset(self, key, field, value):
+        raise NotImplementedError
+
+    def hsetnx(self, key, field, value):
+        """
+        Set the field only if it doesn't exist yet; returns True if it was set
+        """
+        raise NotImplementedError
+
+    def hdel(self, key, field):
+        raise NotImplementedError
+
+    def hgetall(self, key):
+        raise NotImplementedError
+
+    def hincr(self, key, field, amount=1):
+        raise NotImplementedError
+
+    def pipeline(self):
+        """
+        Batch several writes into one round trip:
+
+            with store.pipeline() as pipe:
+                pipe.hset(...)
+                pipe.hincr(...)
+        """
+        return Pipeline(self)
+
+    def _execute(self, commands):
+        return [getattr(self, name)(*args) for name, args in commands]
+
+
+class Pipeline:
+    def __init__(self, store):
+        self.store = store
+        self.commands = []
+        self.results = None
+
+    def __getattr__(self, name):
+        if not hasattr(StateStore, name) or name.startswith('_') or name == 'pipeline':
+            raise AttributeError(name)
+
+        def queue(*args):
+            self.commands.append((name, args))
+            return self
+        return queue
+
+    def execute(self):
+        commands, self.commands = self.commands, []
+        self.results = self.store._execute(commands) if commands else []
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.execute()
+
+
+class _Entry:
+    __slots__ = ('value', 'touched')
+
+    def __init__(self, value, touched):
+        self.value = value
+        self.touched = touched
+
+
+class MemoryStateStore(StateStore):
+    """
+    In-process state; only correct with a single worker process.
+
+    Every hash field is a compact slotted entry stamped with its last access.
+    Entries idle for longer than `idle_ttl` are dropped by periodic
+    compaction, and the least recently used ones are evicted once there are
+    more than `max_entries`, so memory stays flat however long the bot runs.
+    Keys marked with persist() are exempt from both.
+    """
+
+    # Plain keys are stored as a hash with this field
+    VALUE = ''
+
+    def __init__(self, idle_ttl=None, max_entries=None):
+        self.idle_ttl = idle_ttl
+        self.max_entries = max_entries
+        self._hashes = {}  # key -> {field: _Entry}
+        self._size = 0  # evictable entries, i.e. not under a persistent key
+        self._persistent = set()
+        self._lock = threading.RLock()
+        self._compactor = None
+
+        self.expired = 0
+        self.evicted = 0
+
+    def persist(self, *keys):
+        """
+        Never expire or evict the fields of `keys`, for state that has to
+        outlive inactivity (an alert can sit untouched for months)
+        """
+        with self._lock:
+            for key in keys:
+                if key not in self._persistent:
+                    self._persistent.add(key)
+                    self._size -= len(self._hashes.get(key, ()))
+
+    def _fields(self, key, create=False):
+        fields = self._hashes.get(key)
+        if fields is None and create:
+            fields = self._hashes[sys.intern(key)] = {}
+        return fields
+
+    def _entry(self, key, field):
+        fields = self._hashes.get(key)
+        if not fields:
+            return None
+        entry = fields.get(field)
+        if entry is None:
+            return None
+        now = time.monotonic()
+        if self.idle_ttl is not None and now - entry.touched > self.idle_ttl and key not in self._persistent:
+            return None
+        entry.touched = now
+        return entry
+
+    def _store(self, key, field, value):
+        fields = self._fields(key, create=True)
+        entry = fields.get(field)
+        if entry is None:
+            # Short repeated strings ("awaiting_company", user ids) are shared
+            if isinstance(value, str) and len(value) <= 64:
+                value = sys.intern(value)
+            fields[sys.intern(field)] = _Entry(value, time.monotonic())
+            if key not in self._persistent:
+                self._size += 1
+                if self.max_entries is not None and self._size > self.max_entries:
+                    self._evict()
+        else:
+            entry.value = value
+            entry.touched = time.monotonic()
+
+    def _remove(self, key, field):
+        fields = self._hashes.get(key)
+        if fields and fields.pop(field, None) is not None:
+            if key not in self._persistent:
+                self._size -= 1
+            if not fields:
+                del self._hashes[key]
+
+    def get(self, key):
+        return self.hget(key, self.VALUE)
+
+    def set(self, key, value):
+        self.hset(key, self.VALUE, value)
+
+    def delete(self, key):
+        with self._lock:
+            removed = len(self._hashes.pop(key, ()))
+            if key not in self._persistent:
+                self._size -= removed
+
+    def incr(self, key, amount=1):
+        return self.hincr(key, self.VALUE, amount)
+
+    def hget(self, key, field):
+        with self._lock:
+            entry = self._entry(key, field)
+            return None if entry is None else str(entry.value)
+
+    def hset(self, key, field, value):
+        with self._lock:
+            self._store(key, field, str(value))
+
+    def hsetnx(self, key, field, value):
+        with self._lock:
+            if self._entry(key, field) is not None:
+                return False
+            self._store(key, field, str(value))
+            return True
+
+    def hdel(self, key, field):
+        with self._lock:
+            self._remove(key, field)
+
+    def hgetall(self, key):
+        with self._lock:
+            entries = ((field, self._entry(key, field)) for field in list(self._fields(key) or ()))
+            return {field: str(entry.value) for field, entry in entries if entry is not None}
+
+    def hincr(self, key, field, amount=1):
+        with self._lock:
+            entry = self._entry(key, field)
+            # Counters are kept as ints rather than strings
+            value = (int(entry.value) if entry is not None else 0) + amount
+            self._store(key, field, value)
+            return value
+
+    def _execute(self, commands):
+        with self._lock:
+            return super()._execute(commands)
+
+    def _evict(self):
+        """
+        Drop the least recently used entries down to 90% of max_entries
+        """
+        target = int(self.max_entries * 0.9)
+        entries = sorted(
+            (entry.touched, key, field)
+            for key, fields in self._hashes.items() if key not in self._persistent
+            for field, entry in fields.items())
+        for _, key, field in entries[:max(0, self._size - target)]:
+            self._remove(key, field)
+            self.evicted += 1
+
+    def compact(self):
+        """
+        Drop idle entries and rebuild the dicts so freed slots are returned
+        """
+        with self._lock:
+            if self.idle_ttl is not None:
+                cutoff = time.monotonic() - self.idle_ttl
+                for key, fields in list(self._hashes.items()):
+                    if key in self._persistent:
+                        continue
+                    for field, entry in list(fields.items()):
+                        if entry.touched < cutoff:
+                            self._remove(key, field)
+                            self.expired += 1
+            # dicts never shrink in place after deletions
+            self._hashes = {key: dict(fields) for key, fields in self._hashes.items()}
+
+    def start_compaction(self, interval=300.0):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.compact()
+                except Exception as e:
+                    logging.error(f"Error compacting state: {e}")
+
+        if self._compactor is None:
+            self._compactor = threading.Thread(target=run, name='state-compaction', daemon=True)
+            self._compactor.start()
+
+    def stats(self):
+        """
+        Entry counts per key prefix and an approximate size in bytes
+        """
+        with self._lock:
+            counts = {}
+            size = sys.getsizeof(self._hashes)
+            for key, fields in self._hashes.items():
+                prefix = key.split(':', 1)[0]
+                counts[prefix] = counts.get(prefix, 0) + len(fields)
+                size += sys.getsizeof(key) + sys.getsizeof(fields)
+                for field, entry in fields.items():
+                    size += sys.getsizeof(field) + sys.getsizeof(entry) + sys.getsizeof(entry.value)
+            return {
+                'entries': self._size,
+                'by_key': counts,
+                'approx_bytes': size,
+                'expired': self.expired,
+                'evicted': self.evicted,
+            }
+
+
+class SQLiteStateStore(StateStore):
+    """
+    State in a SQLite file, shared by every process on the same host
+    """
+
+    # Plain keys are stored as a hash with this field
+    VALUE = ''
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        db = self._db()
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS state '
+            '(key TEXT, field TEXT, value TEXT, PRIMARY KEY (key, field))')
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            self._local.db = db
+        return db
+
+    def _write(self):
+        return _Transaction(self._db())
+
+    def get(self, key):
+        return self.hget(key, self.VALUE)
+
+    def set(self, key, value):
+        self.hset(key, self.VALUE, value)
+
+    def delete(self, key):
+        with self._write() as db:
+            db.execute('DELETE FROM state WHERE key = ?', (key,))
+
+    def incr(self, key, amount=1):
+        return self.hincr(key, self.VALUE, amount)
+
+    def hget(self, key, field):
+        row = self._db().execute(
+            'SELECT value FROM state WHERE key = ? AND field = ?', (key, field)).fetchone()
+        return row[0] if row else None
+
+    def hset(self, key, field, value):
+        with self._write() as db:
+            db.execute('REPLACE INTO state (key, field, value) VALUES (?, ?, ?)', (key, field, str(value)))
+
+    def hsetnx(self, key, field, value):
+        with self._write() as db:
+            cursor = db.execute(
+                'INSERT OR IGNORE INTO state (key, field, value) VALUES (?, ?, ?)', (key, field, str(value)))
+            return cursor.rowcount == 1
+
+    def hdel(self, key, field):
+        with self._write() as db:
+            db.execute('DELETE FROM state WHERE key = ? AND field = ?', (key, field))
+
+    def hgetall(self, key):
+        rows = self._db().execute('SELECT field, value FROM state WHERE key = ?', (key,)).fetchall()
+        return dict(rows)
+
+    def hincr(self, key, field, amount=1):
+        with self._write() as db:
+            db.execute(
+                'INSERT INTO state (key, field, value) VALUES (?, ?, ?) '
+                'ON CONFLICT (key, field) DO UPDATE SET value = CAST(value AS INTEGER) + ?',
+                (key, field, str(amount), amount))
+            row = db.execute('SELECT value FROM state WHERE key = ? AND field = ?', (key, field)).fetchone()
+        return int(row[0])
+
+    def _execute(self, commands):
+        # One write transaction for the whole batch; nested _write() calls
+        # just join it
+        with self._write():
+            return super()._execute(commands)
+
+
+class _Transaction:
+    """
+    BEGIN IMMEDIATE ... COMMIT around a block, re-entrant per connection
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        if not self.db.in_transaction:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.owner = True
+        else:
+            self.owner = False
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.owner:
+            self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisStateStore(StateStore):
+    """
+    State in Redis (or anything speaking the Redis protocol), shared across
+    hosts. Talks RESP directly over one socket per thread.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', timeout=5.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or 6379
+        self.db = int(parts.path.strip('/') or 0)
+        self.password = parts.password
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            conn = self._local.conn = (sock, sock.makefile('rb'))
+            setup = []
+            if self.password:
+                setup.append(('AUTH', self.password))
+            if self.db:
+                setup.append(('SELECT', self.db))
+            if setup:
+                self._send(setup)
+        return conn
+
+    @staticmethod
+    def _encode(command):
+        out = [f'*{len(command)}\r\n'.encode()]
+        for arg in command:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            out.append(f'${len(data)}\r\n'.encode() + data + b'\r\n')
+        return b''.join(out)
+
+    def _read_reply(self, reader):
+        line = reader.readline()
+        if not line:
+            raise RedisError('Connection closed by server')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            return RedisError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length < 0:
+                return None
+            data = reader.read(length + 2)[:-2]
+            return data.decode()
+        if kind == b'*':
+            length = int(payload)
+            if length < 0:
+                return None
+            return [self._read_reply(reader) for _ in range(length)]
+        raise RedisError(f'Unexpected reply {line!r}')
+
+    def _send(self, commands):
+        """
+        Pipeline several commands in one write and read all the replies
+        """
+        sock, reader = self._connection()
+        try:
+            sock.sendall(b''.join(self._encode(command) for command in commands))
+            replies = [self._read_reply(reader) for _ in commands]
+        except (OSError, RedisError):
+            # Drop the connection so the next call reconnects cleanly
+            self._local.conn = None
+            sock.close()
+            raise
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def _command(self, *command):
+        return self._send([command])[0]
+
+    def get(self, key):
+        return self._command('GET', key)
+
+    def set(self, key, value):
+        self._command('SET', key, value)
+
+    def delete(self, key):
+        self._command('DEL', key)
+
+    def incr(self, key, amount=1):
+        return self._command('INCRBY', key, amount)
+
+    def hget(self, key, field):
+        return self._command('HGET', key, field)
+
+    def hset(self, key, field, value):
+        self._command('HSET', key, field, value)
+
+    def hsetnx(self, key, field, value):
+        return self._command('HSETNX', key, field, value) == 1
+
+    def hdel(self, key, field):
+        self._command('HDEL', key, field)
+
+    def hgetall(self, key):
+        flat = self._command('HGETALL', key) or []
+        return dict(zip(flat[::2], flat[1::2]))
+
+    def hincr(self, key, field, amount=1):
+        return self._command('HINCRBY', key, field, amount)
+
+    COMMANDS = {
+        'get': 'GET', 'set': 'SET', 'delete': 'DEL', 'incr': 'INCRBY',
+        'hget': 'HGET', 'hset': 'HSET', 'hsetnx': 'HSETNX', 'hdel': 'HDEL',
+        'hgetall': 'HGETALL', 'hincr': 'HINCRBY',
+    }
+
+    def _execute(self, commands):
+        replies = self._send([(self.COMMANDS[name],) + tuple(args) for name, args in commands])
+        results = []
+        for (name, _), reply in zip(commands, replies):
+            if name == 'hgetall':
+                reply = dict(zip((reply or [])[::2], (reply or [])[1::2]))
+            elif name == 'hsetnx':
+                reply = reply == 1
+            elif name in ('set', 'delete', 'hset', 'hdel'):
+                reply = None
+            results.append(reply)
+        return results
+
+
+def from_env():
+    backend = os.environ.get('STATE_BACKEND', 'memory')
+    if backend == 'sqlite':
+        return SQLiteStateStore(os.environ.get('STATE_PATH', 'state.db'))
+    if backend == 'redis':
+        return RedisStateStore(os.environ.get('REDIS_URL', 'redis://localhost:6379/0'))
+    store = MemoryStateStore(
+        idle_ttl=float(os.environ.get('STATE_IDLE_TTL', 30 * 24 * 3600)),
+        max_entries=int(os.environ.get('STATE_MAX_ENTRIES', 100000)),
+    )
+    store.start_compaction(float(os.environ.get('STATE_COMPACT_INTERVAL', 300)))
+    return store
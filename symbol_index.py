@@ -0,0 +1,266 @@
+import bisect
+import csv
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from io import StringIO
+
+import http_client
+
+WIKIPEDIA_SP500_URL = 'https://en.wikipedia.org/wiki/List_of_S%26P_500_companies'
+
+# Words that don't help tell companies apart
+NAME_STOPWORDS = {
+    'inc', 'incorporated', 'corp', 'corporation', 'co', 'company', 'ltd',
+    'limited', 'plc', 'holdings', 'group', 'the', 'class', 'sa', 'nv', 'ag',
+}
+
+
+def normalize(name):
+    words = re.sub(r'[^a-z0-9&\s]', ' ', name.lower()).split()
+    return ' '.join(w for w in words if w not in NAME_STOPWORDS)
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, max_distance=None):
+    """
+    Levenshtein distance, giving up early once every cell in a row is past
+    max_distance
+    """
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    if max_distance is not None and len(a) - len(b) > max_distance:
+        return max_distance + 1
+
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb),
+            ))
+        if max_distance is not None and min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+class _Index:
+    """
+    Immutable lookup structures for one version of the listing, so a refresh
+    can swap them in without locking readers
+    """
+
+    def __init__(self, rows):
+        self.symbols = {}      # symbol -> security name
+        self.by_name = {}      # normalized name -> symbol
+        self.names = []        # normalized names, position = row id
+        self.row_symbols = []  # row id -> symbol
+        self.grams = {}        # trigram -> list of row ids
+
+        for symbol, security in rows:
+            symbol = symbol.strip().upper()
+            key = normalize(security)
+            if not symbol or symbol in self.symbols:
+                continue
+            self.symbols[symbol] = security.strip()
+            self.by_name.setdefault(key, symbol)
+
+            row = len(self.names)
+            self.names.append(key)
+            self.row_symbols.append(symbol)
+            for gram in trigrams(key):
+                self.grams.setdefault(gram, []).append(row)
+
+        self.sorted_names = sorted((name, row) for row, name in enumerate(self.names))
+
+
+class SymbolIndex:
+    """
+    In-memory index over a listing of ticker symbols and security names.
+    Answers name -> ticker queries with ranked candidates using exact,
+    prefix, trigram and edit-distance matching.
+    """
+
+    def __init__(self, aliases=None):
+        self.aliases = dict(aliases or {})
+        self.loaded_at = None
+        self._index = _Index([])
+
+    def __len__(self):
+        return len(self._index.symbols)
+
+    def load(self, rows):
+        self._index = _Index(rows)
+        self.loaded_at = time.time()
+        logging.info(f"Loaded symbol universe with {len(self)} symbols")
+
+    def load_csv(self, path):
+        with open(path, newline='') as f:
+            reader = csv.DictReader(f)
+            self.load((row['Symbol'], row['Security']) for row in reader)
+
+    def add_alias(self, typo, symbol):
+        self.aliases[typo.upper()] = symbol.upper()
+
+    def name_for(self, symbol):
+        return self._index.symbols.get(symbol.upper())
+
+    def correct(self, symbol, fuzzy=False):
+        """
+        Correct a mistyped ticker. Known aliases always apply; with fuzzy=True,
+        an unknown symbol is replaced by the only listed symbol one edit away.
+        """
+        symbol = symbol.strip().upper()
+        if symbol in self.aliases:
+            return self.aliases[symbol]
+
+        index = self._index
+        if not fuzzy or symbol in index.symbols:
+            return symbol
+
+        close = [s for s in index.symbols
+                 if abs(len(s) - len(symbol)) <= 1 and edit_distance(s, symbol, 1) <= 1]
+        if len(close) == 1:
+            return close[0]
+        return symbol
+
+    def search(self, query, limit=5):
+        """
+        Returns up to `limit` (symbol, security, score) tuples, best first
+        """
+        index = self._index
+        results = {}
+
+        def add(symbol, score):
+            if score > results.get(symbol, 0):
+                results[symbol] = score
+
+        upper = query.strip().upper()
+        if upper in self.aliases:
+            add(self.aliases[upper], 0.99)
+        if upper in index.symbols:
+            add(upper, 1.0)
+
+        key = normalize(query)
+        if not key:
+            return self._ranked(results, limit)
+
+        if key in index.by_name:
+            add(index.by_name[key], 1.0)
+
+        # Prefix matches, shorter names first ("apple" -> "apple" before "applied materials")
+        start = bisect.bisect_left(index.sorted_names, (key,))
+        for name, row in index.sorted_names[start:start + 50]:
+            if not name.startswith(key):
+                break
+            add(index.row_symbols[row], 0.9 * len(key) / len(name) + 0.05)
+
+        # Trigram candidates, re-scored by edit distance
+        query_grams = trigrams(key)
+        overlap = Counter()
+        for gram in query_grams:
+            overlap.update(index.grams.get(gram, ()))
+
+        for row, shared in overlap.most_common(20):
+            name = index.names[row]
+            jaccard = shared / (len(query_grams) + len(trigrams(name)) - shared)
+            if jaccard < 0.3:
+                continue
+            distance = edit_distance(key, name)
+            similarity = 1 - distance / max(len(key), len(name))
+            add(index.row_symbols[row], 0.8 * max(jaccard, similarity))
+
+        return self._ranked(results, limit)
+
+    def _ranked(self, results, limit):
+        ranked = sorted(results.items(), key=lambda item: -item[1])[:limit]
+        return [(symbol, self.name_for(symbol), round(score, 3)) for symbol, score in ranked]
+
+
+class SymbolUniverse(SymbolIndex):
+    """
+    SymbolIndex backed by a local CSV listing, refreshed from the Wikipedia
+    S&P 500 table on a schedule rather than on every query
+    """
+
+    def __init__(self, path, refresh_interval=24 * 3600, aliases=None, url=WIKIPEDIA_SP500_URL):
+        super().__init__(aliases)
+        self.path = path
+        self.url = url
+        self.refresh_interval = refresh_interval
+        self._refresh_lock = threading.Lock()
+
+    def start(self, delay=0.0):
+        """
+        Load the local listing and start the refresh loop, which waits
+        `delay` seconds first so it doesn't compete with startup
+        """
+        if os.path.exists(self.path):
+            try:
+                self.load_csv(self.path)
+            except Exception as e:
+                logging.error(f"Error loading symbol universe from {self.path}: {e}")
+
+        thread = threading.Thread(
+            target=self._refresh_loop, args=(delay,), name='symbol-universe', daemon=True)
+        thread.start()
+
+    def _is_stale(self):
+        if not os.path.exists(self.path) or not len(self):
+            return True
+        return time.time() - os.path.getmtime(self.path) >= self.refresh_interval
+
+    def _refresh_loop(self, delay):
+        time.sleep(delay)
+        while True:
+            if self._is_stale():
+                self.refresh()
+            time.sleep(min(self.refresh_interval, 3600))
+
+    def refresh(self):
+        """
+        Download the listing, save it locally and rebuild the index
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            import pandas as pd
+
+            response = http_client.shared().get(self.url, timeout=30)
+            response.raise_for_status()
+            sp500 = pd.read_html(StringIO(response.text))[0]
+            rows = list(zip(sp500['Symbol'].astype(str), sp500['Security'].astype(str)))
+
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['Symbol', 'Security'])
+                writer.writerows(rows)
+            os.replace(tmp_path, self.path)
+
+            self.load(rows)
+        except Exception as e:
+            logging.error(f"Error refreshing symbol universe: {e}")
+        finally:
+            self._refresh_lock.release()
+
+
+def from_env(aliases=None):
+    return SymbolUniverse(
+        os.environ.get('SYMBOL_UNIVERSE_PATH', 'symbols.csv'),
+        refresh_interval=float(os.environ.get('SYMBOL_UNIVERSE_REFRESH', 24 * 3600)),
+        aliases=aliases,
+        url=os.environ.get('SYMBOL_UNIVERSE_URL', WIKIPEDIA_SP500_URL),
+    )
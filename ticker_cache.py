@@ -0,0 +1,135 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by get() when a name isn't cached at all, as opposed to a cached
+# failure which is returned as None
+MISS = object()
+
+
+def normalize_name(name):
+    """
+    Normalize a company name so "Apple", " apple " and "APPLE!" share an entry
+    """
+    name = re.sub(r'[^\w\s.&-]', '', name.lower())
+    return ' '.join(name.split())
+
+
+class ResolutionCache:
+    """
+    Name -> ticker cache. Entries live in an in-memory LRU and are written
+    through to SQLite so they survive restarts. Names that failed to resolve
+    are cached as None with a shorter TTL.
+    """
+
+    def __init__(self, path=None, max_size=5000, ttl=7 * 24 * 3600, negative_ttl=3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self._entries = OrderedDict()  # name -> (ticker, expires_at)
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS resolutions '
+                '(name TEXT PRIMARY KEY, ticker TEXT, expires_at REAL)')
+            self._db.commit()
+            self._load()
+
+    def _load(self):
+        """
+        Warm the in-memory LRU from disk, most recently written entries last
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute('DELETE FROM resolutions WHERE expires_at <= ?', (now,))
+            self._db.execute(
+                'DELETE FROM resolutions WHERE rowid NOT IN '
+                '(SELECT rowid FROM resolutions ORDER BY rowid DESC LIMIT ?)', (self.max_size,))
+            self._db.commit()
+            rows = self._db.execute(
+                'SELECT name, ticker, expires_at FROM resolutions ORDER BY rowid DESC LIMIT ?',
+                (self.max_size,)).fetchall()
+            for name, ticker, expires_at in reversed(rows):
+                self._entries[name] = (ticker, expires_at)
+        logging.info(f"Loaded {len(rows)} cached ticker resolutions")
+
+    def get(self, name):
+        key = normalize_name(name)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISS
+
+            ticker, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return MISS
+
+            self._entries.move_to_end(key)
+            if ticker is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return ticker
+
+    def set(self, name, ticker):
+        key = normalize_name(name)
+        ttl = self.ttl if ticker else self.negative_ttl
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._entries[key] = (ticker, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+            if self._db is not None:
+                try:
+                    # REPLACE re-inserts the row so rowid order tracks recency
+                    self._db.execute(
+                        'REPLACE INTO resolutions (name, ticker, expires_at) VALUES (?, ?, ?)',
+                        (key, ticker, expires_at))
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logging.error(f"Error persisting ticker resolution: {e}")
+
+    def invalidate(self, name):
+        key = normalize_name(name)
+        with self._lock:
+            self._entries.pop(key, None)
+            if self._db is not None:
+                self._db.execute('DELETE FROM resolutions WHERE name = ?', (key,))
+                self._db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+
+def from_env():
+    return ResolutionCache(
+        path=os.environ.get('TICKER_CACHE_PATH', 'ticker_cache.db'),
+        max_size=int(os.environ.get('TICKER_CACHE_SIZE', 5000)),
+        ttl=float(os.environ.get('TICKER_CACHE_TTL', 7 * 24 * 3600)),
+        negative_ttl=float(os.environ.get('TICKER_CACHE_NEGATIVE_TTL', 3600)),
+    )